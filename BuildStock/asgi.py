@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BuildStock.settings')
 
 application = get_asgi_application()
+
+# Load the precomputed OpenAPI schema before serving requests
+from BuildStock import schema  # noqa: E402
+
+schema.warm()
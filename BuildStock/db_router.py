@@ -0,0 +1,211 @@
+"""
+Read-replica routing with read-your-writes stickiness.
+
+``ReplicaMiddleware`` picks one alias of ``DATABASE_REPLICAS`` (settings,
+from DATABASE_REPLICA_URLS) for each GET/HEAD/OPTIONS request, and
+``ReplicaRouter`` sends that request's reads there. Writes,
+``select_for_update``, ``primary()`` blocks and any query made outside a
+request (workers, management commands) stay on the primary.
+
+A client that sends a write (POST/PUT/PATCH/DELETE) is pinned to the primary
+for REPLICA_STICKY_SECONDS, so it reads its own changes back despite
+replication lag. The pin travels with the client as a short-lived signed
+cookie, which any worker can check. When the default cache is shared
+(REDIS_URL) the pin is also kept there under the user id (from the JWT claims,
+no query), which covers clients that drop cookies; a process-local cache is
+not used for it, since the next request usually lands on another worker.
+"""
+import math
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+KEY_PREFIX = 'buildstock:db-primary'
+PIN_COOKIE = 'buildstock_primary'
+PIN_SALT = 'BuildStock.db_router.pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Alias reads go to for the current request; None means the primary
+_read_alias = ContextVar('buildstock_read_alias', default=None)
+
+
+def _key(user_id):
+    return f'{KEY_PREFIX}:{user_id}'
+
+
+def _token_user_id(request):
+    # Signature and expiry only; the user is not loaded
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw = header and authentication.get_raw_token(header)
+    if not raw:
+        return None
+    try:
+        return authentication.get_validated_token(raw).get(api_settings.USER_ID_CLAIM)
+    except (InvalidToken, TokenError):
+        return None
+
+
+def _session_user_id(request):
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def _user_id(request):
+    return _token_user_id(request) or _session_user_id(request)
+
+
+@contextmanager
+def primary():
+    """
+    Read from the primary inside this block (or decorated function) whatever the request
+    """
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def _read_from(alias, content):
+    """
+    Keep a streamed body's queries on ``alias`` (they run after the middleware returns)
+    """
+    iterator = iter(content)
+    while True:
+        token = _read_alias.set(alias)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _read_alias.reset(token)
+        yield chunk
+
+
+async def _aread_from(alias, content):
+    iterator = aiter(content)
+    while True:
+        token = _read_alias.set(alias)
+        try:
+            chunk = await anext(iterator)
+        except StopAsyncIteration:
+            return
+        finally:
+            _read_alias.reset(token)
+        yield chunk
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.replicas = list(getattr(settings, 'DATABASE_REPLICAS', ()))
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+        self.shared_pin = not isinstance(caches['default'], (LocMemCache, DummyCache))
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _cookie_pinned(self, request):
+        value = request.COOKIES.get(PIN_COOKIE)
+        if not value:
+            return False
+        try:
+            signing.TimestampSigner(salt=PIN_SALT).unsign(value, max_age=self.sticky_seconds)
+            return True
+        except signing.BadSignature:
+            return False
+
+    def _cache_pinned(self, request):
+        # May load the session user: sync only
+        user_id = _user_id(request)
+        return user_id is not None and bool(cache.get(_key(user_id)))
+
+    def _pinned(self, request):
+        return self._cookie_pinned(request) or (self.shared_pin and self._cache_pinned(request))
+
+    def _pin(self, request, response):
+        # DRF has set request.user by now; token claims cover failed authentication
+        user_id = _session_user_id(request) or _token_user_id(request)
+        response.set_cookie(
+            PIN_COOKIE, signing.TimestampSigner(salt=PIN_SALT).sign(str(user_id or '')),
+            max_age=math.ceil(self.sticky_seconds), secure=request.is_secure(), httponly=True, samesite='Lax'
+        )
+        if self.shared_pin and user_id is not None:
+            cache.set(_key(user_id), True, self.sticky_seconds)
+
+    def _alias(self, request):
+        if not self.replicas or request.method not in SAFE_METHODS or self._pinned(request):
+            return None
+        return random.choice(self.replicas)
+
+    async def _aalias(self, request):
+        if not self.replicas or request.method not in SAFE_METHODS or self._cookie_pinned(request):
+            return None
+        if self.shared_pin and await sync_to_async(self._cache_pinned)(request):
+            return None
+        return random.choice(self.replicas)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        alias = self._alias(request)
+        token = _read_alias.set(alias)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+
+        if alias is not None and response.streaming:
+            response.streaming_content = _read_from(alias, response.streaming_content)
+        elif self.replicas and request.method not in SAFE_METHODS:
+            self._pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        alias = await self._aalias(request)
+        token = _read_alias.set(alias)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+
+        if alias is not None and response.streaming:
+            read_from = _aread_from if response.is_async else _read_from
+            response.streaming_content = read_from(alias, response.streaming_content)
+        elif self.replicas and request.method not in SAFE_METHODS:
+            await sync_to_async(self._pin)(request, response)
+        return response
+
+
+class ReplicaRouter:
+    """
+    Reads go to the replica chosen by ReplicaMiddleware, everything else to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        # Explicit: left to Django, related lookups would follow an instance loaded from a replica
+        return _read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        pool = {DEFAULT_DB_ALIAS, *getattr(settings, 'DATABASE_REPLICAS', ())}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
@@ -0,0 +1,288 @@
+"""
+Per-route request metrics in Prometheus text format.
+
+``MetricsMiddleware`` times every request, counts its SQL queries and their
+time through an execute wrapper and measures the response size. It runs in
+sync and async chains: the wrapper is installed on the connections of the
+thread doing the queries and reports to the request's timer through a context
+variable, which ``sync_to_async`` carries into that thread.
+Values are aggregated per (method, route pattern) in process, so label
+cardinality is bounded by the URLconf; ``/metrics`` (``MetricsView``) renders
+them. Each worker process keeps its own registry: scrape workers individually
+or run the metrics on a single-worker deployment.
+
+Queries slower than ``SLOW_QUERY_LOG_SECONDS`` and requests slower than
+``SLOW_REQUEST_LOG_SECONDS`` are logged on the ``buildstock.metrics`` logger.
+"""
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from drf_spectacular.utils import extend_schema
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+
+from users.authentication import CachedJWTAuthentication
+
+logger = logging.getLogger('buildstock.metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """
+        (le, cumulative count) pairs, ending with +Inf
+        """
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            yield bound, total
+
+
+class RouteStats:
+    __slots__ = ('statuses', 'duration', 'queries', 'size', 'db_seconds', 'slow_queries')
+
+    def __init__(self):
+        self.statuses = {}
+        self.duration = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.db_seconds = 0.0
+        self.slow_queries = 0
+
+
+class Registry:
+    """
+    In-process metrics, one lock acquisition per request
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, method, route, status, duration, queries, db_seconds, slow_queries, size):
+        with self._lock:
+            stats = self._routes.get((method, route))
+            if stats is None:
+                stats = self._routes[(method, route)] = RouteStats()
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.duration.observe(duration)
+            stats.queries.observe(queries)
+            if size is not None:
+                stats.size.observe(size)
+            stats.db_seconds += db_seconds
+            stats.slow_queries += slow_queries
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+
+    def render(self):
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = []
+
+            def family(name, kind, help_text):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+            def histogram(name, labels, hist):
+                for bound, total in hist.samples():
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f'{name}_sum{{{labels}}} {hist.sum}')
+                lines.append(f'{name}_count{{{labels}}} {hist.count}')
+
+            family('buildstock_http_requests_total', 'counter', "Requests by route, method and status.")
+            for (method, route), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'buildstock_http_requests_total{{{_labels(method, route)},status="{status}"}} {count}')
+            for name, attr, help_text in (
+                ('buildstock_http_request_duration_seconds', 'duration', "Request latency."),
+                ('buildstock_db_queries_per_request', 'queries', "SQL queries per request."),
+                ('buildstock_http_response_size_bytes', 'size', "Response body size (not measured for streaming responses)."),
+            ):
+                family(name, 'histogram', help_text)
+                for (method, route), stats in routes:
+                    histogram(name, _labels(method, route), getattr(stats, attr))
+            family('buildstock_db_query_seconds_total', 'counter', "Time spent in SQL queries.")
+            for (method, route), stats in routes:
+                lines.append(f'buildstock_db_query_seconds_total{{{_labels(method, route)}}} {stats.db_seconds}')
+            family('buildstock_db_slow_queries_total', 'counter', "Queries slower than SLOW_QUERY_LOG_SECONDS.")
+            for (method, route), stats in routes:
+                lines.append(f'buildstock_db_slow_queries_total{{{_labels(method, route)}}} {stats.slow_queries}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(method, route):
+    return f'method="{_escape(method)}",route="{_escape(route)}"'
+
+
+registry = Registry()
+
+
+class QueryTimer:
+    """
+    ``execute_wrapper`` callable: counts queries and their time, logs slow ones
+    """
+
+    def __init__(self, slow_threshold):
+        self.slow_threshold = slow_threshold
+        self.count = 0
+        self.seconds = 0.0
+        self.slow = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+                self.slow += 1
+                logger.warning("Slow query (%.3fs on %s): %.1000s", elapsed, context['connection'].alias, sql)
+
+
+# QueryTimer of the current request, if metrics are on
+_query_timer = ContextVar('buildstock_query_timer', default=None)
+
+
+def _timed(execute, sql, params, many, context):
+    timer = _query_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_timer():
+    """
+    Add the timing wrapper to this thread's connections, once
+    """
+    for connection in connections.all():
+        if _timed not in connection.execute_wrappers:
+            # First, so execute_wrapper() blocks (which pop the last one) leave it in place
+            connection.execute_wrappers.insert(0, _timed)
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    # Unresolved paths share one label so scanners cannot blow up the cardinality
+    return '/' + match.route if match is not None and match.route else '<unmatched>'
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'METRICS_ENABLED', True)
+        self.slow_query = getattr(settings, 'SLOW_QUERY_LOG_SECONDS', None)
+        self.slow_request = getattr(settings, 'SLOW_REQUEST_LOG_SECONDS', None)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        install_query_timer()
+        timer = QueryTimer(self.slow_query)
+        token = _query_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_timer.reset(token)
+        self._record(request, response, timer, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        # The request's sync thread, where its queries run
+        await sync_to_async(install_query_timer)()
+        timer = QueryTimer(self.slow_query)
+        token = _query_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_timer.reset(token)
+        self._record(request, response, timer, time.perf_counter() - start)
+        return response
+
+    def _record(self, request, response, timer, duration):
+        route = _route(request)
+        size = None if response.streaming else len(response.content)
+        registry.record(request.method, route, response.status_code, duration, timer.count, timer.seconds, timer.slow, size)
+        if self.slow_request is not None and duration >= self.slow_request:
+            logger.warning(
+                "Slow request (%.3fs, %d queries, %.3fs in SQL): %s %s",
+                duration, timer.count, timer.seconds, request.method, request.get_full_path()
+            )
+
+
+class _Scraper:
+    is_authenticated = True
+    username = 'metrics-scraper'
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """
+    ``Authorization: Bearer <METRICS_TOKEN>`` for Prometheus, which cannot refresh JWTs
+    """
+
+    def authenticate(self, request):
+        token = getattr(settings, 'METRICS_TOKEN', None)
+        if not token:
+            return None
+        parts = get_authorization_header(request).split()
+        if len(parts) == 2 and parts[0].lower() == b'bearer' and hmac.compare_digest(parts[1], token.encode()):
+            return _Scraper(), None
+        return None
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="api"'
+
+
+class MetricsView(APIView):
+    authentication_classes = [MetricsTokenAuthentication, CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(exclude=True)
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,109 @@
+"""
+Precomputed OpenAPI schema.
+
+``manage.py build_schema`` generates the schema and writes it to
+``OPENAPI_SCHEMA_FILE`` (the Procfiles run it before starting the server).
+Each worker loads that file once at startup (``warm()`` from wsgi.py/asgi.py)
+and ``SchemaView`` serves the rendered bytes from memory with an ETag, so a
+schema request never introspects views and serializers. Without the file, or
+with ``DEBUG`` on, the schema is generated at startup instead.
+"""
+import hashlib
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from drf_spectacular.renderers import OpenApiJsonRenderer
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SpectacularAPIView
+
+logger = logging.getLogger('buildstock.schema')
+
+_lock = threading.Lock()
+_compiled = None
+
+
+def generate():
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    return generator.get_schema(request=None, public=True)
+
+
+def write(path):
+    """
+    Generate the schema and write it to ``path`` as JSON
+    """
+    content = OpenApiJsonRenderer().render(generate(), renderer_context={})
+    with open(path, 'wb') as f:
+        f.write(content)
+    return content
+
+
+class CompiledSchema:
+    """
+    The schema and its rendering per renderer class, each with a strong ETag
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._rendered = {}
+
+    def rendered(self, renderer):
+        key = type(renderer)
+        if key not in self._rendered:
+            content = renderer.render(self.schema, renderer_context={})
+            etag = '"schema-%s-%s"' % (renderer.format, hashlib.md5(content).hexdigest()[:16])
+            self._rendered[key] = (content, etag)
+        return self._rendered[key]
+
+
+def _load():
+    path = getattr(settings, 'OPENAPI_SCHEMA_FILE', None)
+    if path and not settings.DEBUG:
+        try:
+            with open(path, 'rb') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            logger.warning("%s not found; generating the OpenAPI schema at startup (run build_schema at build time)", path)
+    return generate()
+
+
+def warm():
+    """
+    Load (or generate) the schema and pre-render it for every schema renderer
+    """
+    global _compiled
+    with _lock:
+        if _compiled is None:
+            compiled = CompiledSchema(_load())
+            for renderer_class in SchemaView.renderer_classes:
+                compiled.rendered(renderer_class())
+            _compiled = compiled
+    return _compiled
+
+
+def reset():
+    global _compiled
+    with _lock:
+        _compiled = None
+
+
+class SchemaView(SpectacularAPIView):
+    """
+    ``SpectacularAPIView`` content negotiation, answered from the precomputed schema
+    """
+
+    @extend_schema(exclude=True)
+    def get(self, request, *args, **kwargs):
+        renderer, media_type = self.perform_content_negotiation(request)
+        content, etag = (_compiled or warm()).rendered(renderer)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(content, content_type=media_type)
+            response['Content-Disposition'] = f'inline; filename="{self._get_filename(request, None)}"'
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 import os
+import importlib.util
 import dj_database_url
 from pathlib import Path
 from datetime import timedelta
@@ -48,11 +49,13 @@ INSTALLED_APPS = [
     'rest_framework',
     'drf_spectacular',
     'users',
-    'products'
+    'products',
+    'jobs',
+    'idempotency',
 ]
 
 
-SSPECTACULAR_SETTINGS = {
+SPECTACULAR_SETTINGS = {
     'TITLE': 'BuildStock API',
     'DESCRIPTION': 'Documentation de l’API BuildStock',
     'VERSION': '1.0.0',
@@ -61,23 +64,27 @@ SSPECTACULAR_SETTINGS = {
    
     'COMPONENT_SPLIT_REQUEST': True,
 }
+# Written by `manage.py build_schema`, served by BuildStock.schema.SchemaView
+OPENAPI_SCHEMA_FILE = os.getenv("OPENAPI_SCHEMA_FILE", str(BASE_DIR / 'openapi-schema.json'))
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
 
 
 MIDDLEWARE = [
+    'BuildStock.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'BuildStock.db_router.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'BuildStock.static.WhiteNoiseMiddleware',
 ]
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -85,13 +92,68 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',   
     'PAGE_SIZE': 10, 
-
+    'DEFAULT_RENDERER_CLASSES': [
+        'BuildStock.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'BuildStock.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# MessagePack (application/msgpack, ?format=msgpack) for the mobile client, when msgpack is installed
+if importlib.util.find_spec('msgpack'):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].insert(1, 'BuildStock.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].insert(1, 'BuildStock.renderers.MessagePackParser')
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30), 
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
+
+# Seconds an authenticated user stays cached by users.authentication.CachedJWTAuthentication;
+# the local value applies when the default cache is per process (no REDIS_URL)
+AUTH_USER_CACHE_TIMEOUT = 60
+AUTH_USER_LOCAL_CACHE_TIMEOUT = 5
+
+# Request metrics served on /metrics (BuildStock.metrics)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true")
+# Static bearer token for the Prometheus scraper; JWT-authenticated users can read /metrics too
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+SLOW_QUERY_LOG_SECONDS = float(os.getenv("SLOW_QUERY_LOG_SECONDS", "0.5"))
+SLOW_REQUEST_LOG_SECONDS = float(os.getenv("SLOW_REQUEST_LOG_SECONDS", "2"))
+
+# Delta sync (products.sync): rows stamped this recently wait for the next call,
+# and deletions are kept this long (prune_tombstones)
+SYNC_SETTLE_SECONDS = float(os.getenv("SYNC_SETTLE_SECONDS", "2"))
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "90"))
+
+# Workers fold pending category summary deltas into the summary rows this often
+SUMMARY_FOLD_SECONDS = int(os.getenv("SUMMARY_FOLD_SECONDS", "60"))
+
+# Background jobs (jobs app): uploaded imports and produced exports live in JOB_FILES_DIR,
+# shared by the web and worker processes
+JOB_FILES_DIR = os.getenv("JOB_FILES_DIR", str(BASE_DIR / 'job-files'))
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", "2"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_BASE_SECONDS = 10
+JOB_RETRY_MAX_SECONDS = 3600
+# A running job is stamped every JOB_HEARTBEAT_SECONDS; one without a heartbeat for
+# JOB_STALE_SECONDS (its worker died) counts as a failed attempt
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "60"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "900"))
+# Exports (and imports kept after a failure) are deleted after this long by prune_job_files
+JOB_FILES_RETENTION_HOURS = int(os.getenv("JOB_FILES_RETENTION_HOURS", "24"))
+
+# Idempotency-Key (idempotency app): responses are replayed for IDEMPOTENCY_TTL_SECONDS;
+# a retry waits up to IDEMPOTENCY_WAIT_SECONDS for the first request, whose key is
+# released IDEMPOTENCY_LOCK_SECONDS after its process stops renewing it (crashed)
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 60 * 60)))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "120"))
 ROOT_URLCONF = 'BuildStock.urls'
 
 TEMPLATES = [
@@ -126,10 +188,48 @@ DATABASES = {
 
 if os.getenv("DATABASE_URL"):
     DATABASES['default'] = dj_database_url.config(
-    conn_max_age=600,
+    # ASGI deployments should set CONN_MAX_AGE=0: persistent connections are per thread
+    conn_max_age=int(os.getenv("CONN_MAX_AGE", 600)),
     ssl_require=True
 )
 
+# Read replicas: comma-separated URLs, e.g. DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3
+# for a local try (copy db.sqlite3 to start it). GET requests read from a random replica
+# (BuildStock.db_router); a user who writes reads from the primary for REPLICA_STICKY_SECONDS.
+DATABASE_REPLICAS = []
+for index, url in enumerate(u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(',') if u.strip()):
+    alias = f'replica{index + 1}'
+    DATABASES[alias] = dj_database_url.parse(
+        url, conn_max_age=int(os.getenv("CONN_MAX_AGE", 600)), ssl_require=not url.startswith('sqlite')
+    )
+    # Tests run against the primary only
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['BuildStock.db_router.ReplicaRouter']
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+
+# Cache
+# Per-process by default; set REDIS_URL to share cached data between workers
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.getenv("REDIS_URL"):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv("REDIS_URL"),
+    }
+
+# Cache alias holding the category/unit list versions (products.reference_cache).
+# Must be shared across workers; when unset, each process re-reads the lists
+# from the database every REFERENCE_CACHE_LOCAL_TTL seconds instead.
+REFERENCE_CACHE_ALIAS = os.getenv("REFERENCE_CACHE_ALIAS", 'default' if os.getenv("REDIS_URL") else None)
+REFERENCE_CACHE_LOCAL_TTL = float(os.getenv("REFERENCE_CACHE_LOCAL_TTL", "5"))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -1,14 +1,13 @@
 from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import (
-    SpectacularAPIView,
     SpectacularSwaggerView,
     SpectacularRedocView,
 )
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
+from rest_framework_simplejwt.views import TokenRefreshView
+from users.views import BuildStockTokenObtainPairView
+from .metrics import MetricsView
+from .schema import SchemaView
 
 urlpatterns = [
     # Admin
@@ -18,15 +17,22 @@ urlpatterns = [
   
     path('api/users/', include('users.urls')),
     path('api/products/', include('products.urls')),
+    # Background jobs (jobs app, processed by manage.py run_worker)
+    path('api/jobs/', include('jobs.urls')),
+    # Async read-only lists for ASGI deployments (Procfile.asgi)
+    path('api/async/products/', include('products.async_urls')),
 
     # JWT
-    path('api/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/login/', BuildStockTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
-    # Schéma OpenAPI
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
+    # Schéma OpenAPI (précalculé, voir BuildStock/schema.py)
+    path('api/schema/', SchemaView.as_view(), name='schema'),
 
     # Documentation
     path('swagger/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+
+    # Prometheus metrics (BuildStock.metrics)
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BuildStock.settings')
 
 application = get_wsgi_application()
+
+# Load the precomputed OpenAPI schema before serving requests
+from BuildStock import schema  # noqa: E402
+
+schema.warm()
@@ -0,0 +1,198 @@
+"""
+``Idempotency-Key`` support for create endpoints.
+
+The first request with a given key (per user) runs the view and stores its
+response for IDEMPOTENCY_TTL_SECONDS; retries with the same key and body get
+that response back with ``Idempotent-Replayed: true`` instead of creating a
+second row. A retry that arrives while the first request is still running
+waits for it (up to IDEMPOTENCY_WAIT_SECONDS, then 409) rather than racing it.
+
+Keys live in the database, not the cache: the default cache is per process,
+and the unique (owner, key) row is what lets concurrent workers agree on which
+request executes. Server errors are not stored, so the client can retry them.
+
+The running request holds its key on a lease of IDEMPOTENCY_LOCK_SECONDS,
+renewed from a thread while the view runs. A lease only runs out when the
+request's process died or a renewal failed, and only then may a retry take the
+key over; the response is stored only while the request still owns its row.
+"""
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.utils import timezone
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger('buildstock.idempotency')
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+# How often a waiting retry checks on the first request
+POLL_SECONDS = 0.1
+
+IDEMPOTENCY_PARAMETER = OpenApiParameter(
+    HEADER, str, OpenApiParameter.HEADER,
+    description="Client-generated key (e.g. a UUID); retries with the same key and body replay the first response"
+)
+
+
+def fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def _claim(owner, key, digest):
+    """
+    (record, created): created is True when this request gets to run the view
+    """
+    now = timezone.now()
+    IdempotencyKey.objects.filter(owner=owner, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            # Short lease while running (renewed by Lease), so a crashed request frees the key
+            return IdempotencyKey.objects.create(
+                owner=owner, key=key, fingerprint=digest,
+                expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+            ), True
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(owner=owner, key=key).first(), False
+
+
+def renew(pk):
+    """
+    Extend a running request's lease on its key; False when the key is no longer its
+    """
+    return IdempotencyKey.objects.filter(pk=pk, response_status__isnull=True).update(
+        expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+    ) > 0
+
+
+class Lease(threading.Thread):
+    """
+    Renews the claim ``pk`` three times per IDEMPOTENCY_LOCK_SECONDS until stopped.
+    A failed renewal sets ``lost`` and ends the thread: the lease may run out, so the
+    key can be taken over by a retry from then on.
+    """
+
+    def __init__(self, pk):
+        super().__init__(name=f'idempotency-lease-{pk}', daemon=True)
+        self.pk = pk
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.IDEMPOTENCY_LOCK_SECONDS / 3):
+                try:
+                    if renew(self.pk):
+                        continue
+                    logger.warning("Idempotency key %s is no longer held by its request", self.pk)
+                except DatabaseError:
+                    logger.exception("Could not renew idempotency key %s", self.pk)
+                self.lost = True
+                break
+        finally:
+            # This thread's own connection
+            connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def prune():
+    """
+    Delete expired keys of every user; returns how many
+    """
+    return IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+def _wait(owner, key, record):
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while record is not None and record.response_status is None and time.monotonic() < deadline:
+        time.sleep(POLL_SECONDS)
+        record = IdempotencyKey.objects.filter(owner=owner, key=key).first()
+    return record
+
+
+def _replay(record):
+    response = Response(record.response_data, status=record.response_status)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """
+    Make an APIView ``post`` honour the ``Idempotency-Key`` header
+    """
+
+    @functools.wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'detail': f"{HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        owner = str(request.user.pk or '')
+        digest = fingerprint(request)
+        record, created = _claim(owner, key, digest)
+        while not created:
+            if record is None:
+                # The first request failed and released the key: run it here
+                record, created = _claim(owner, key, digest)
+                continue
+            if record.fingerprint != digest:
+                return Response(
+                    {'detail': f"{HEADER} was already used for a different request."},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            record = _wait(owner, key, record)
+            if record is None:
+                continue
+            if record.response_status is None:
+                response = Response(
+                    {'detail': "A request with this Idempotency-Key is still being processed."},
+                    status=status.HTTP_409_CONFLICT
+                )
+                response['Retry-After'] = '1'
+                return response
+            return _replay(record)
+
+        # Still this request's row: if the lease ran out meanwhile, the key may belong to another request now
+        claimed = IdempotencyKey.objects.filter(pk=record.pk, fingerprint=digest, response_status__isnull=True)
+        lease = Lease(record.pk)
+        lease.start()
+        try:
+            response = view_method(view, request, *args, **kwargs)
+        except Exception:
+            claimed.delete()
+            raise
+        finally:
+            lease.stop()
+        if isinstance(response, Response) and response.status_code < 500:
+            stored = claimed.update(
+                response_status=response.status_code, response_data=response.data,
+                expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+            )
+            if not stored and lease.lost:
+                logger.warning("Lost the lease on idempotency key %s; its response was not stored", record.pk)
+        else:
+            claimed.delete()
+        return response
+
+    return extend_schema(parameters=[IDEMPOTENCY_PARAMETER])(wrapper)
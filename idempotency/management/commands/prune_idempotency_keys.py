@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from idempotency.decorators import prune
+
+
+class Command(BaseCommand):
+    help = "Delete expired Idempotency-Key records (run daily; each user's are also cleared on their next keyed request)"
+
+    def handle(self, *args, **options):
+        deleted = prune()
+        self.stdout.write(self.style.SUCCESS(f"{deleted} idempotency keys pruned"))
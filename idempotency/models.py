@@ -0,0 +1,29 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+
+class IdempotencyKey(models.Model):
+    """
+    The outcome of the first request sent with an ``Idempotency-Key`` header,
+    replayed to retries until ``expires_at`` (see idempotency.decorators)
+    """
+
+    owner = models.CharField(max_length=64, help_text="User id the key belongs to")
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 of the method, path and body")
+    # NULL while the first request is still running
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_data = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'key'], name='idempotencykey_owner_key'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'expires_at'], name='idempotencykey_owner_expires'),
+        ]
+
+    def __str__(self):
+        return f"{self.owner}:{self.key}"
@@ -0,0 +1,169 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from products.models import Product, ProductCategory, StockMovement, Unit
+from products.serializers import UnitSerializer
+from users.models import User
+
+from . import decorators
+from .models import IdempotencyKey
+
+
+class IdempotencyKeyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='store', password='x', role='storekeeper')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _post(self, name, body, key):
+        url = name if name.startswith('/') else reverse(name)
+        return self.client.post(url, body, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self._post('categories-list-create', {'name': 'Cement'}, 'k1')
+        retry = self._post('categories-list-create', {'name': 'Cement'}, 'k1')
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(ProductCategory.objects.count(), 1)
+
+        # Keys are per user, and requests without one are not tracked
+        other = User.objects.create_user(username='other', password='x', role='storekeeper')
+        self.client.force_authenticate(other)
+        self.assertEqual(self._post('categories-list-create', {'name': 'Sand'}, 'k1').status_code, 201)
+        self.assertEqual(self.client.post(reverse('units-list-create'), {'name': 'Kilogram', 'symbol': 'kg'}, format='json').status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.count(), 2)
+
+    def test_stock_movements_are_applied_once(self):
+        category = ProductCategory.objects.create(name='Cement')
+        kg = Unit.objects.create(name='Kilogram', symbol='kg')
+        for _ in range(2):
+            self._post('products-list-create', {'name': 'Bag', 'category': category.id, 'base_unit_id': kg.id}, 'p')
+        product = Product.objects.get(name='Bag')
+        body = {'movements': [{'product_id': product.id, 'unit_id': kg.id, 'movement_type': 'in', 'quantity': '10'}]}
+        for _ in range(2):
+            response = self._post('stock-movements-list-create', body, 'm')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(StockMovement.objects.count(), 1)
+
+    def test_key_reused_for_another_body_is_refused(self):
+        self._post('categories-list-create', {'name': 'Cement'}, 'k1')
+        response = self._post('categories-list-create', {'name': 'Sand'}, 'k1')
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(ProductCategory.objects.filter(name='Sand').exists())
+
+    def test_errors_are_replayed_but_server_errors_release_the_key(self):
+        self.assertEqual(self._post('units-list-create', {'name': ''}, 'k1').status_code, 400)
+        self.assertEqual(self._post('units-list-create', {'name': ''}, 'k1')['Idempotent-Replayed'], 'true')
+
+        with mock.patch('products.views.UnitSerializer.save', side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                self._post('units-list-create', {'name': 'Kilogram', 'symbol': 'kg'}, 'k2')
+        self.assertFalse(IdempotencyKey.objects.filter(key='k2').exists())
+        self.assertEqual(self._post('units-list-create', {'name': 'Kilogram', 'symbol': 'kg'}, 'k2').status_code, 201)
+
+    def test_concurrent_retry_waits_for_the_first_request(self):
+        first = self._post('categories-list-create', {'name': 'Cement'}, 'k1')
+        record = IdempotencyKey.objects.get()
+        stored = (record.response_status, record.response_data)
+        IdempotencyKey.objects.update(response_status=None, response_data=None)
+
+        # Still running after the wait: the retry is told to come back
+        with override_settings(IDEMPOTENCY_WAIT_SECONDS=0):
+            response = self._post('categories-list-create', {'name': 'Cement'}, 'k1')
+        self.assertEqual((response.status_code, response['Retry-After']), (409, '1'))
+
+        def finish(seconds):
+            IdempotencyKey.objects.update(response_status=stored[0], response_data=stored[1])
+
+        with mock.patch('idempotency.decorators.time.sleep', side_effect=finish) as sleep:
+            response = self._post('categories-list-create', {'name': 'Cement'}, 'k1')
+        sleep.assert_called_once()
+        self.assertEqual((response.status_code, response.json()), (201, first.json()))
+        self.assertEqual(ProductCategory.objects.count(), 1)
+
+    def test_expired_keys_run_again_and_are_pruned(self):
+        self._post('categories-list-create', {'name': 'Cement'}, 'k1')
+        user = {'username': 'john', 'email': 'john@example.com', 'role': 'storekeeper', 'password': 'P@ssword123!'}
+        self.assertEqual(self._post('/api/users/', user, 'k2').status_code, 201)
+        self.assertEqual(self._post('/api/users/', user, 'k2').status_code, 201)
+        self.assertEqual(User.objects.filter(username='john').count(), 1)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self._post('categories-list-create', {'name': 'Cement'}, 'k1')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('Idempotent-Replayed', response)
+        call_command('prune_idempotency_keys', stdout=mock.MagicMock())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['k1'])
+
+
+class IdempotencyLeaseTests(TransactionTestCase):
+    # The lease thread writes through its own connection: the claim must be committed
+
+    @override_settings(IDEMPOTENCY_LOCK_SECONDS=0.3)
+    def test_a_request_running_past_its_lease_keeps_the_key(self):
+        user = User.objects.create_user(username='store', password='x', role='storekeeper')
+        client = APIClient()
+        client.force_authenticate(user)
+        save = UnitSerializer.save
+        retries = []
+
+        def slow_save(serializer, **kwargs):
+            # Twice the lease; a retry arriving now must wait, not run the view again
+            time.sleep(0.6)
+            record = IdempotencyKey.objects.get(key='k1')
+            self.assertGreater(record.expires_at, timezone.now())
+            retries.append(decorators._claim(record.owner, record.key, record.fingerprint)[1])
+            return save(serializer, **kwargs)
+
+        with mock.patch.object(UnitSerializer, 'save', autospec=True, side_effect=slow_save):
+            response = client.post(
+                reverse('units-list-create'), {'name': 'Kilogram', 'symbol': 'kg'},
+                format='json', HTTP_IDEMPOTENCY_KEY='k1'
+            )
+        self.assertEqual((response.status_code, retries), (201, [False]))
+        self.assertEqual(IdempotencyKey.objects.get(key='k1').response_status, 201)
+        self.assertEqual(Unit.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_LOCK_SECONDS=0.3)
+    def test_a_failed_renewal_gives_up_the_key_without_overwriting_the_next_owner(self):
+        user = User.objects.create_user(username='store', password='x', role='storekeeper')
+        client = APIClient()
+        client.force_authenticate(user)
+        save = UnitSerializer.save
+        retries = []
+
+        def slow_save(serializer, **kwargs):
+            # The lease could not be renewed, so a retry arriving after it ran out takes the key over
+            time.sleep(0.6)
+            record = IdempotencyKey.objects.get(key='k1')
+            retries.append(decorators._claim(record.owner, record.key, record.fingerprint))
+            return save(serializer, **kwargs)
+
+        with mock.patch.object(UnitSerializer, 'save', autospec=True, side_effect=slow_save), \
+                mock.patch.object(decorators, 'renew', side_effect=DatabaseError("database is locked")) as renew, \
+                self.assertLogs('buildstock.idempotency') as logs:
+            response = client.post(
+                reverse('units-list-create'), {'name': 'Kilogram', 'symbol': 'kg'},
+                format='json', HTTP_IDEMPOTENCY_KEY='k1'
+            )
+        self.assertEqual(response.status_code, 201)
+        # The lease thread stopped at its first failure
+        self.assertEqual(renew.call_count, 1)
+        (retry, created), = retries
+        self.assertTrue(created)
+        # The retry's claim is left to the retry rather than given the first request's response
+        self.assertEqual(list(IdempotencyKey.objects.values_list('pk', 'response_status')), [(retry.pk, None)])
+        self.assertIn("response was not stored", logs.output[-1])
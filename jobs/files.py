@@ -0,0 +1,45 @@
+"""
+Files handed to or produced by jobs (uploaded imports, exports), under
+``JOB_FILES_DIR``. Workers run on the same host, so local storage suffices.
+Files older than JOB_FILES_RETENTION_HOURS are deleted by ``prune``
+(``manage.py prune_job_files``).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+
+# Where tasks read and write their files
+DIRECTORIES = ('imports', 'exports')
+
+
+def storage():
+    return FileSystemStorage(location=settings.JOB_FILES_DIR)
+
+
+def prune(hours=None):
+    """
+    Delete job files older than ``hours`` (JOB_FILES_RETENTION_HOURS), except the
+    uploads of jobs still queued or running; returns how many
+    """
+    from .models import Job
+
+    if hours is None:
+        hours = settings.JOB_FILES_RETENTION_HOURS
+    cutoff = timezone.now() - timedelta(hours=hours)
+    pending = {
+        payload.get('file') for payload in
+        Job.objects.filter(status__in=[Job.QUEUED, Job.RUNNING]).values_list('payload', flat=True)
+    }
+    store = storage()
+    deleted = 0
+    for directory in DIRECTORIES:
+        if not store.exists(directory):
+            continue
+        for name in store.listdir(directory)[1]:
+            path = f'{directory}/{name}'
+            if path not in pending and store.get_modified_time(path) < cutoff:
+                store.delete(path)
+                deleted += 1
+    return deleted
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from jobs.files import prune
+
+
+class Command(BaseCommand):
+    help = "Delete job files (exports, failed imports) older than JOB_FILES_RETENTION_HOURS (run hourly)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, help="Override the retention, in hours")
+
+    def handle(self, *args, hours, **options):
+        deleted = prune(hours)
+        self.stdout.write(self.style.SUCCESS(f"{deleted} job files pruned"))
@@ -0,0 +1,33 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs import registry
+from jobs.worker import Worker, run_pool
+
+
+class Command(BaseCommand):
+    help = "Run background jobs (imports, exports, mass updates, summary rebuilds) from the database queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=getattr(settings, 'JOB_WORKER_PROCESSES', 2),
+            help="Worker processes, each running one job at a time"
+        )
+        parser.add_argument('--poll', type=float, help="Seconds between polls of an empty queue")
+        parser.add_argument('--burst', action='store_true', help="Run due jobs in this process, then exit")
+
+    def handle(self, *args, processes, poll, burst, **options):
+        self.stdout.write(f"Tasks: {', '.join(registry.kinds())}")
+        if burst:
+            processed = Worker(poll_interval=poll).run(burst=True)
+            self.stdout.write(self.style.SUCCESS(f"{processed} jobs run"))
+        elif processes <= 1:
+            worker = Worker(poll_interval=poll)
+            # Finish the current job, then exit
+            signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+            signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+            worker.run()
+        else:
+            run_pool(processes, poll)
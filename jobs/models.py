@@ -0,0 +1,73 @@
+import uuid
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    A unit of background work, run by ``manage.py run_worker`` (see jobs.queue)
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    uuid = models.UUIDField(
+        default=uuid.uuid4,
+        editable=False,
+        unique=True
+    )
+    kind = models.CharField(max_length=50, help_text="Registered task name, e.g. products.import")
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Not claimed before this time (retry backoff)")
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='jobs'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers poll for the oldest due queued job
+            models.Index(fields=['run_after', 'id'], condition=models.Q(status='queued'), name='job_queued_run_after'),
+            # Stale running jobs
+            models.Index(fields=['heartbeat_at'], condition=models.Q(status='running'), name='job_running_heartbeat'),
+            models.Index(fields=['created_by', '-created_at'], name='job_created_by_created_at'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.uuid} ({self.status})"
+
+    def set_progress(self, done, total=None):
+        """
+        Record progress from inside a task; also serves as the worker heartbeat
+        """
+        self.progress_done = done
+        if total is not None:
+            self.progress_total = total
+        Job.objects.filter(pk=self.pk, status=Job.RUNNING).update(
+            progress_done=done, progress_total=self.progress_total, heartbeat_at=timezone.now()
+        )
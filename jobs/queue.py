@@ -0,0 +1,159 @@
+"""
+A job queue in the database, so no broker is needed on SQLite or PostgreSQL.
+
+``enqueue`` inserts a queued ``Job``. Workers ``claim`` the oldest due job with
+a conditional ``UPDATE ... WHERE status = 'queued'``: only one worker's update
+matches, on either backend, and no lock is held while the task runs. A failed
+attempt is queued again after an exponential backoff until ``max_attempts``;
+``JobError`` fails the job at once. While a task runs, a heartbeat thread
+stamps the job every JOB_HEARTBEAT_SECONDS (``Job.set_progress`` does too),
+whether or not the task reports progress. Running jobs whose heartbeat is
+older than ``JOB_STALE_SECONDS`` are treated as a failed attempt, so a killed
+worker does not strand its job.
+"""
+import logging
+import random
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import F
+from django.utils import timezone
+
+from . import registry
+from .models import Job
+
+logger = logging.getLogger('buildstock.jobs')
+
+CLAIM_CANDIDATES = 10
+
+
+class JobError(Exception):
+    """
+    Raised by a task to fail its job without retrying; ``result`` is kept on the job
+    """
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+def enqueue(kind, payload=None, user=None, max_attempts=None):
+    registry.get(kind)
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        created_by=user if user is not None and user.is_authenticated else None,
+        max_attempts=max_attempts or getattr(settings, 'JOB_MAX_ATTEMPTS', 3),
+    )
+
+
+def backoff(attempts):
+    """
+    Delay before attempt ``attempts + 1``: exponential, capped, with jitter
+    """
+    base = getattr(settings, 'JOB_RETRY_BASE_SECONDS', 10)
+    cap = getattr(settings, 'JOB_RETRY_MAX_SECONDS', 3600)
+    delay = min(base * 2 ** (attempts - 1), cap)
+    return timedelta(seconds=delay * random.uniform(0.75, 1.0))
+
+
+def claim(worker):
+    """
+    Mark the oldest due queued job as running for ``worker`` and return it, or None
+    """
+    now = timezone.now()
+    candidates = list(
+        Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+        .order_by('run_after', 'id').values_list('id', flat=True)[:CLAIM_CANDIDATES]
+    )
+    for pk in candidates:
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, attempts=F('attempts') + 1,
+            started_at=now, heartbeat_at=now,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+        # Another worker got it first
+    return None
+
+
+def _finish(job, **fields):
+    # Only if the job is still ours: a stale job may have been handed to another worker
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker).update(**fields)
+
+
+def complete(job, result):
+    _finish(job, status=Job.SUCCEEDED, result=result, finished_at=timezone.now(), heartbeat_at=None)
+
+
+def fail(job, error, result=None, retry=True):
+    now = timezone.now()
+    if retry and job.attempts < job.max_attempts:
+        _finish(job, status=Job.QUEUED, error=error, run_after=now + backoff(job.attempts), heartbeat_at=None)
+        return Job.QUEUED
+    _finish(job, status=Job.FAILED, error=error, result=result, finished_at=now, heartbeat_at=None)
+    return Job.FAILED
+
+
+def requeue_stale():
+    """
+    Count running jobs without a recent heartbeat as failed attempts; returns how many
+    """
+    limit = timezone.now() - timedelta(seconds=getattr(settings, 'JOB_STALE_SECONDS', 300))
+    stale = list(Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=limit))
+    for job in stale:
+        logger.warning("Job %s (%s) on %s stopped responding", job.uuid, job.kind, job.worker)
+        fail(job, "Worker stopped responding.")
+    return len(stale)
+
+
+def beat(job):
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker).update(heartbeat_at=timezone.now())
+
+
+class Heartbeat(threading.Thread):
+    """
+    Keeps a running job's heartbeat fresh from a thread of the worker process
+    """
+
+    def __init__(self, job, interval):
+        super().__init__(name=f'job-heartbeat-{job.pk}', daemon=True)
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    beat(self.job)
+                except DatabaseError:
+                    logger.exception("Heartbeat of job %s failed", self.job.uuid)
+        finally:
+            # This thread's own connection
+            connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run(job):
+    """
+    Run a claimed job's task and record the outcome; returns the new status
+    """
+    heartbeat = Heartbeat(job, getattr(settings, 'JOB_HEARTBEAT_SECONDS', 60))
+    heartbeat.start()
+    try:
+        result = registry.get(job.kind)(job, job.payload)
+    except JobError as exc:
+        return fail(job, str(exc), result=exc.result, retry=False)
+    except Exception as exc:
+        logger.exception("Job %s (%s) attempt %d failed", job.uuid, job.kind, job.attempts)
+        return fail(job, f"{type(exc).__name__}: {exc}")
+    finally:
+        heartbeat.stop()
+    complete(job, result)
+    return Job.SUCCEEDED
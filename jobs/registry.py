@@ -0,0 +1,45 @@
+"""
+Task registry: ``@task('products.import')`` maps a job kind to a function
+called as ``fn(job, payload)``, whose JSON-serializable return value becomes
+``Job.result``. ``@periodic('products.fold_summary', 60)`` registers
+housekeeping that every worker runs from its loop, called as ``fn()`` at most
+once per interval. Apps register both from ``AppConfig.ready``.
+"""
+_tasks = {}
+_periodic = {}
+
+
+def task(kind):
+    def register(fn):
+        if kind in _tasks and _tasks[kind] is not fn:
+            raise ValueError(f"Task '{kind}' is already registered.")
+        _tasks[kind] = fn
+        return fn
+    return register
+
+
+def get(kind):
+    try:
+        return _tasks[kind]
+    except KeyError:
+        raise LookupError(f"No task registered for '{kind}'.") from None
+
+
+def kinds():
+    return sorted(_tasks)
+
+
+def periodic(name, seconds):
+    def register(fn):
+        if name in _periodic and _periodic[name][1] is not fn:
+            raise ValueError(f"Periodic task '{name}' is already registered.")
+        _periodic[name] = (seconds, fn)
+        return fn
+    return register
+
+
+def periodic_tasks():
+    """
+    [(name, seconds, fn)], sorted by name
+    """
+    return [(name, seconds, fn) for name, (seconds, fn) in sorted(_periodic.items())]
@@ -0,0 +1,31 @@
+from django.urls import reverse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
+from rest_framework import serializers
+
+from .models import Job
+
+
+class JobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+    file_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'uuid', 'kind', 'status', 'attempts', 'max_attempts', 'progress', 'result', 'error',
+            'file_url', 'run_after', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+    @extend_schema_field({'type': 'object', 'properties': {'done': {'type': 'integer'}, 'total': {'type': 'integer', 'nullable': True}}})
+    def get_progress(self, obj):
+        return {'done': obj.progress_done, 'total': obj.progress_total}
+
+    @extend_schema_field(OpenApiTypes.URI)
+    def get_file_url(self, obj):
+        if obj.status != Job.SUCCEEDED or not (obj.result or {}).get('file'):
+            return None
+        url = reverse('job-file', args=[obj.uuid])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,227 @@
+import io
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from products.models import Product, ProductCategory, ProductUnit, Unit
+from users.models import User
+
+from . import files, queue
+from .models import Job
+from . import registry
+from .registry import periodic, task
+from .worker import Worker
+
+_calls = []
+
+
+@task('tests.flaky')
+def flaky(job, payload):
+    _calls.append(job.attempts)
+    if job.attempts <= payload.get('failures', 0):
+        raise RuntimeError(f"attempt {job.attempts} failed")
+    if payload.get('reject'):
+        raise queue.JobError("Rejected.", result={'why': 'test'})
+    job.set_progress(3, 3)
+    return {'attempts': job.attempts}
+
+
+_beaten = threading.Event()
+
+
+@task('tests.silent')
+def silent(job, payload):
+    # Reports no progress: only the heartbeat thread keeps the job fresh
+    if not _beaten.wait(5):
+        raise RuntimeError("no heartbeat")
+    return {}
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        _calls.clear()
+        self.worker = Worker(name='test-worker')
+
+    def test_failed_attempts_are_retried_after_a_backoff(self):
+        job = queue.enqueue('tests.flaky', {'failures': 1}, max_attempts=2)
+        with self.assertLogs('buildstock.jobs', 'ERROR'):
+            self.assertEqual(self.worker.run(burst=True), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertEqual(job.error, "RuntimeError: attempt 1 failed")
+        self.assertGreater(job.run_after, timezone.now())
+        # Not due yet
+        self.assertEqual(self.worker.run(burst=True), 0)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.worker.run(burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.SUCCEEDED, {'attempts': 2}))
+        self.assertEqual((job.progress_done, job.progress_total), (3, 3))
+        self.assertEqual(_calls, [1, 2])
+
+    def test_last_attempt_and_job_error_fail_for_good(self):
+        exhausted = queue.enqueue('tests.flaky', {'failures': 5}, max_attempts=1)
+        rejected = queue.enqueue('tests.flaky', {'reject': True})
+        with self.assertLogs('buildstock.jobs', 'ERROR'):
+            self.worker.run(burst=True)
+        exhausted.refresh_from_db()
+        rejected.refresh_from_db()
+        self.assertEqual((exhausted.status, exhausted.attempts), (Job.FAILED, 1))
+        self.assertEqual((rejected.status, rejected.attempts, rejected.result), (Job.FAILED, 1, {'why': 'test'}))
+        self.assertIsNotNone(rejected.finished_at)
+
+    def test_a_job_is_claimed_once_and_stale_jobs_are_requeued(self):
+        job = queue.enqueue('tests.flaky')
+        self.assertEqual(queue.claim('a').pk, job.pk)
+        self.assertIsNone(queue.claim('b'))
+
+        with override_settings(JOB_STALE_SECONDS=60):
+            Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+            with self.assertLogs('buildstock.jobs', 'WARNING'):
+                self.assertEqual(queue.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (Job.QUEUED, "Worker stopped responding."))
+
+    def test_heartbeat_runs_while_a_task_reports_no_progress(self):
+        job = queue.enqueue('tests.silent')
+        _beaten.clear()
+        with override_settings(JOB_HEARTBEAT_SECONDS=0.01), \
+                mock.patch('jobs.queue.beat', side_effect=lambda job: _beaten.set()) as beat:
+            self.worker.run(burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(beat.call_args.args[0].pk, job.pk)
+        self.assertFalse([t for t in threading.enumerate() if t.name.startswith('job-heartbeat')])
+
+        # A beat refreshes only the worker's own running job
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, heartbeat_at=None)
+        queue.beat(job)
+        self.assertIsNotNone(Job.objects.get(pk=job.pk).heartbeat_at)
+
+    def test_periodic_tasks_run_once_per_interval_and_failures_are_logged(self):
+        ticks = []
+
+        with mock.patch.dict(registry._periodic, clear=True):
+            @periodic('tests.tick', 3600)
+            def tick():
+                ticks.append(len(ticks))
+                if len(ticks) > 1:
+                    raise RuntimeError("tick failed")
+
+            next_runs = {}
+            self.worker.run_periodic(next_runs)
+            self.worker.run_periodic(next_runs)
+            self.assertEqual(ticks, [0])
+
+            next_runs['tests.tick'] = 0
+            with self.assertLogs('buildstock.jobs', 'ERROR'):
+                self.worker.run_periodic(next_runs)
+            self.assertEqual(ticks, [0, 1])
+
+    def test_unknown_kind_is_refused_at_enqueue(self):
+        with self.assertRaises(LookupError):
+            queue.enqueue('tests.missing')
+
+    def test_run_worker_burst(self):
+        queue.enqueue('tests.flaky')
+        out = io.StringIO()
+        call_command('run_worker', '--burst', stdout=out)
+        self.assertIn('1 jobs run', out.getvalue())
+        self.assertIn('products.import', out.getvalue())
+
+
+class JobAPITests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='admin', password='x', role='admin')
+        cls.storekeeper = User.objects.create_user(username='store', password='x', role='storekeeper')
+        category = ProductCategory.objects.create(name='Cement')
+        kg = Unit.objects.create(name='Kilogram', symbol='kg')
+        for i in range(3):
+            product = Product.objects.create(name=f'Product {i}', category=category)
+            ProductUnit.objects.create(product=product, unit=kg, is_base=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.storekeeper)
+        self.files = tempfile.TemporaryDirectory()
+        self.addCleanup(self.files.cleanup)
+        overrides = override_settings(JOB_FILES_DIR=self.files.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def _run_jobs(self):
+        Worker(name='test-worker').run(burst=True)
+
+    def test_async_bulk_update_is_queued_and_reported(self):
+        product = Product.objects.get(name='Product 0')
+        response = self.client.patch(
+            reverse('products-bulk-update') + '?async=true',
+            {'items': [{'id': product.id, 'fields': {'is_active': False}}]}, format='json'
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], Job.QUEUED)
+        self.assertTrue(Product.objects.get(pk=product.pk).is_active)
+
+        self._run_jobs()
+        job = self.client.get(response['Location']).data
+        self.assertEqual(job['status'], Job.SUCCEEDED)
+        self.assertEqual(job['result']['updated'], 1)
+        self.assertFalse(Product.objects.get(pk=product.pk).is_active)
+
+    def test_async_import_and_export(self):
+        upload = SimpleUploadedFile('products.csv', b"name,base_unit\nGravel,kg\n", content_type='text/csv')
+        imported = self.client.post(reverse('products-import') + '?async=1', {'file': upload}, format='multipart')
+        self.assertEqual(imported.status_code, 202)
+        exported = self.client.post(reverse('products-export') + '?file_format=jsonl')
+        self.assertEqual(exported.status_code, 202)
+        self._run_jobs()
+
+        job = Job.objects.get(uuid=imported.data['uuid'])
+        self.assertEqual((job.status, job.result['created']), (Job.SUCCEEDED, 1))
+        self.assertFalse(os.listdir(os.path.join(self.files.name, 'imports')))
+
+        job = self.client.get(reverse('job-detail', args=[exported.data['uuid']])).data
+        self.assertEqual((job['result']['rows'], job['progress']), (4, {'done': 4, 'total': 4}))
+        download = self.client.get(job['file_url'])
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(len(b''.join(download.streaming_content).splitlines()), 4)
+
+    def test_old_job_files_are_pruned_except_pending_uploads(self):
+        storage = files.storage()
+        for name in ('exports/old.csv', 'exports/new.csv', 'imports/queued.csv', 'imports/failed.csv'):
+            storage.save(name, io.BytesIO(b"name\n"))
+        queue.enqueue('products.import', {'file': 'imports/queued.csv', 'file_format': 'csv'})
+        day_ago = time.time() - 25 * 60 * 60
+        for name in ('exports/old.csv', 'imports/queued.csv', 'imports/failed.csv'):
+            os.utime(storage.path(name), (day_ago, day_ago))
+
+        out = io.StringIO()
+        call_command('prune_job_files', stdout=out)
+        self.assertIn('2 job files pruned', out.getvalue())
+        self.assertEqual(storage.listdir('exports')[1], ['new.csv'])
+        self.assertEqual(storage.listdir('imports')[1], ['queued.csv'])
+
+    def test_summary_rebuild_and_visibility(self):
+        response = self.client.post(reverse('categories-summary-rebuild'))
+        self.assertEqual(response.status_code, 202)
+        self._run_jobs()
+        self.assertEqual(Job.objects.get().result, {'drifted': 0})
+
+        other = User.objects.create_user(username='other', password='x', role='storekeeper')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(reverse('job-detail', args=[response.data['uuid']])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('jobs-list')).data['count'], 0)
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get(reverse('jobs-list'), {'kind': 'products.rebuild_summary'}).data['count'], 1)
@@ -0,0 +1,8 @@
+from django.urls import path
+from .views import JobDetailAPIView, JobFileAPIView, JobListAPIView
+
+urlpatterns = [
+    path('', JobListAPIView.as_view(), name='jobs-list'),
+    path('<uuid:job_uuid>/', JobDetailAPIView.as_view(), name='job-detail'),
+    path('<uuid:job_uuid>/file/', JobFileAPIView.as_view(), name='job-file'),
+]
@@ -0,0 +1,82 @@
+from django.http import FileResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from products.pagination import GlobalPagination
+
+from . import files
+from .models import Job
+from .serializers import JobSerializer
+
+
+def visible_jobs(user):
+    """
+    Admins see every job, other users the jobs they started
+    """
+    jobs = Job.objects.all()
+    if not (user.is_superuser or getattr(user, 'role', None) == 'admin'):
+        jobs = jobs.filter(created_by=user)
+    return jobs
+
+
+def accepted(request, job):
+    """
+    202 response for an endpoint that queued ``job``
+    """
+    response = Response(JobSerializer(job, context={'request': request}).data, status=status.HTTP_202_ACCEPTED)
+    response['Location'] = request.build_absolute_uri(reverse('job-detail', args=[job.uuid]))
+    return response
+
+
+class JobListAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+    pagination_class = GlobalPagination
+
+    @extend_schema(
+        responses=JobSerializer(many=True),
+        description="Background jobs, newest first: yours, or every job for admins",
+        parameters=[
+            OpenApiParameter('status', str, enum=[choice for choice, _ in Job.STATUS_CHOICES]),
+            OpenApiParameter('kind', str, description="e.g. products.import"),
+        ],
+    )
+    def get(self, request):
+        jobs = visible_jobs(request.user).order_by('-created_at', '-id')
+        for param in ('status', 'kind'):
+            if request.query_params.get(param):
+                jobs = jobs.filter(**{param: request.query_params[param]})
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(jobs, request)
+        return paginator.get_paginated_response(JobSerializer(page, many=True, context={'request': request}).data)
+
+
+class JobDetailAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(responses={200: JobSerializer, 404: None}, description="Status, progress and result of a background job")
+    def get(self, request, job_uuid):
+        job = get_object_or_404(visible_jobs(request.user), uuid=job_uuid)
+        return Response(JobSerializer(job, context={'request': request}).data)
+
+
+class JobFileAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(responses={(200, 'application/octet-stream'): bytes, 404: None}, description="Download the file a job produced (e.g. an export)")
+    def get(self, request, job_uuid):
+        job = get_object_or_404(visible_jobs(request.user), uuid=job_uuid, status=Job.SUCCEEDED)
+        result = job.result or {}
+        storage = files.storage()
+        if not result.get('file') or not storage.exists(result['file']):
+            return Response({'detail': "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(
+            storage.open(result['file'], 'rb'),
+            as_attachment=True,
+            filename=result.get('filename') or result['file'].rsplit('/', 1)[-1],
+            content_type=result.get('content_type') or 'application/octet-stream',
+        )
@@ -0,0 +1,131 @@
+"""
+Worker loop and process pool behind ``manage.py run_worker``.
+
+Each worker process polls the queue (``jobs.queue.claim``) and runs one job
+at a time; parallelism comes from running several processes. The pool parent
+forwards SIGTERM/SIGINT to its children, which finish their current job
+before exiting, and restarts a child that died.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections
+
+from . import queue, registry
+
+logger = logging.getLogger('buildstock.jobs')
+
+STALE_CHECK_SECONDS = 60
+
+
+class Worker:
+    def __init__(self, name=None, poll_interval=None):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        if poll_interval is None:
+            poll_interval = getattr(settings, 'JOB_POLL_SECONDS', 1)
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run_once(self):
+        """
+        Claim and run one job; returns its new status, or None if none was due
+        """
+        job = queue.claim(self.name)
+        if job is None:
+            return None
+        logger.info("Running job %s (%s), attempt %d", job.uuid, job.kind, job.attempts)
+        return queue.run(job)
+
+    def run_periodic(self, next_runs):
+        """
+        Call the periodic tasks that are due; ``next_runs`` maps names to monotonic due times
+        """
+        for name, seconds, fn in registry.periodic_tasks():
+            now = time.monotonic()
+            if now < next_runs.get(name, 0):
+                continue
+            next_runs[name] = now + seconds
+            try:
+                fn()
+            except Exception:
+                logger.exception("Periodic task %s failed on worker %s", name, self.name)
+
+    def run(self, burst=False):
+        """
+        Process jobs until stopped, or until no job is due when ``burst``.
+        Returns the number of jobs run.
+        """
+        processed = 0
+        next_stale_check = 0
+        next_periodic = {}
+        while not self.stopping.is_set():
+            if not burst:
+                # As between requests: drop broken connections and honour CONN_MAX_AGE
+                close_old_connections()
+            self.run_periodic(next_periodic)
+            try:
+                if time.monotonic() >= next_stale_check:
+                    queue.requeue_stale()
+                    next_stale_check = time.monotonic() + STALE_CHECK_SECONDS
+                status = self.run_once()
+            except DatabaseError:
+                # e.g. SQLite "database is locked" or a dropped connection: retry after a pause
+                logger.exception("Worker %s could not reach the queue", self.name)
+                status = None
+            if status is not None:
+                processed += 1
+            elif burst:
+                break
+            else:
+                self.stopping.wait(self.poll_interval)
+        return processed
+
+
+def _child(poll_interval):
+    worker = Worker(poll_interval=poll_interval)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    # Ctrl-C reaches the whole process group; the parent turns it into SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker.run()
+
+
+def run_pool(processes, poll_interval=None):
+    """
+    Run ``processes`` worker processes until SIGTERM or SIGINT
+    """
+    # Children must not share the parent's database connections
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    stopping = threading.Event()
+
+    def start():
+        process = context.Process(target=_child, args=(poll_interval,), daemon=False)
+        process.start()
+        return process
+
+    def stop(signum, frame):
+        stopping.set()
+        for process in children:
+            if process.is_alive():
+                process.terminate()
+
+    children = [start() for _ in range(processes)]
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while not stopping.is_set():
+        for index, process in enumerate(children):
+            if not process.is_alive() and not stopping.is_set():
+                logger.warning("Worker process %s exited with %s; restarting", process.pid, process.exitcode)
+                children[index] = start()
+        stopping.wait(1)
+    for process in children:
+        process.join()
@@ -1,6 +1,29 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def repair_triggers(sender, using, **kwargs):
+    from django.db import connections
+    from . import search, summary, sync
+
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    tables = connection.introspection.table_names()
+    if search.FTS_TABLE in tables:
+        search.install(connection)
+    if summary.SUMMARY_TABLE in tables:
+        summary.install(connection)
+    if sync.TOMBSTONE_TABLE in tables:
+        sync.install(connection)
 
 
 class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products'
+
+    def ready(self):
+        from . import signals, tasks  # noqa: F401
+
+        # SQLite table rebuilds in later migrations drop the FTS, summary and sync triggers
+        post_migrate.connect(repair_triggers, sender=self)
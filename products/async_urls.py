@@ -0,0 +1,8 @@
+from django.urls import path
+from .async_views import category_list, product_list, unit_list
+
+urlpatterns = [
+    path('categories/', category_list, name='async-categories-list'),
+    path('products/', product_list, name='async-products-list'),
+    path('units/', unit_list, name='async-units-list'),
+]
@@ -0,0 +1,132 @@
+"""
+Async read endpoints for the product, unit and category lists.
+
+These are plain Django ``async def`` views (DRF's APIView is sync only), meant
+for an ASGI worker (see Procfile.asgi) where the middleware chain is async too
+(BuildStock.metrics, BuildStock.db_router, BuildStock.static), so a request
+only leaves the event loop for its database work. That work (count, page and
+unit prefetch) runs as one ``sync_to_async`` call per request rather than one
+thread hop per async ORM call.
+
+Responses match the sync endpoints: same querysets, ``?fields=``/``?exclude=``,
+page and cursor pagination, and the configured renderers (orjson, msgpack)
+chosen from ``Accept``/``?format=``. Writes stay on the sync views in
+products.views.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from users.authentication import CachedJWTAuthentication
+from . import reference_cache
+from .pagination import GlobalPagination, get_paginator
+from .reference_cache import conditional_response
+from .serializers import ProductCategorySerializer, ProductSerializer, UnitSerializer
+from .sparse_fields import get_sparse_fields, trim
+from .views import product_list_queryset, unit_list_queryset
+
+
+def _renderers():
+    # The browsable API needs a DRF view to render
+    return [cls() for cls in api_settings.DEFAULT_RENDERER_CLASSES if not issubclass(cls, BrowsableAPIRenderer)]
+
+
+def _negotiate(request):
+    request.accepted_renderer, request.accepted_media_type = DefaultContentNegotiation().select_renderer(
+        request, _renderers()
+    )
+
+
+def _render(request, data, status=200):
+    """
+    ``data`` rendered as a DRF Response would be, for a DRF ``Request``
+    """
+    if getattr(request, 'accepted_renderer', None) is None:
+        _negotiate(request)
+    renderer, media_type = request.accepted_renderer, request.accepted_media_type
+    content_type = f'{media_type}; charset={renderer.charset}' if renderer.charset else media_type
+    return HttpResponse(renderer.render(data, media_type), status=status, content_type=content_type)
+
+
+def _error(request, exc):
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    try:
+        return _render(request, data, status=exc.status_code)
+    except APIException:
+        # Nothing acceptable to render the error with
+        return HttpResponse(str(exc.detail), status=exc.status_code, content_type='text/plain')
+
+
+def async_read_view(view):
+    """
+    GET/HEAD only, with the same authentication and IsAuthenticated check as the sync API.
+    The view gets a DRF ``Request`` (query_params, negotiation) wrapping the Django one.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        drf_request = Request(request)
+        if request.method not in ('GET', 'HEAD'):
+            return _render(drf_request, {'detail': f'Method "{request.method}" not allowed.'}, status=405)
+        try:
+            result = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+            if result is None:
+                return _render(drf_request, {'detail': "Authentication credentials were not provided."}, status=401)
+            request.user = result[0]
+            _negotiate(drf_request)
+            return await view(drf_request, *args, **kwargs)
+        except APIException as exc:
+            return _error(drf_request, exc)
+    return wrapper
+
+
+async def _paginated(request, queryset, serializer_class, fields):
+    """
+    The sync endpoints' paginated body ({count, next, previous, results} or the cursor form)
+    """
+    paginator = get_paginator(request, GlobalPagination)
+
+    def load():
+        page = paginator.paginate_queryset(queryset, request)
+        return paginator.get_paginated_response(serializer_class(page, many=True, fields=fields).data).data
+
+    return _render(request, await sync_to_async(load)())
+
+
+@async_read_view
+async def product_list(request):
+    fields = get_sparse_fields(request, ProductSerializer)
+    products = product_list_queryset(request.query_params.get('search', ''), fields)
+    return await _paginated(request, products, ProductSerializer, fields)
+
+
+@async_read_view
+async def unit_list(request):
+    search_query = request.query_params.get('search', '')
+    fields = get_sparse_fields(request, UnitSerializer)
+    paginator = get_paginator(request, GlobalPagination)
+    if not search_query and isinstance(paginator, GlobalPagination):
+        # Served from the versioned reference cache, as the sync list is
+        def build_response(units):
+            page = paginator.paginate_queryset(units, request)
+            return _render(request, paginator.get_paginated_response(trim(page, fields)).data)
+        return await sync_to_async(conditional_response)(
+            request, reference_cache.units, build_response, variant=request.GET.urlencode()
+        )
+    return await _paginated(request, unit_list_queryset(search_query, fields), UnitSerializer, fields)
+
+
+@async_read_view
+async def category_list(request):
+    fields = get_sparse_fields(request, ProductCategorySerializer)
+    # The reference cache answers 304s from its version; a miss loads the list in a thread
+    return await sync_to_async(conditional_response)(
+        request, reference_cache.categories,
+        lambda categories: _render(request, trim(categories, fields)),
+        variant=request.GET.urlencode()
+    )
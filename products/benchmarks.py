@@ -0,0 +1,202 @@
+"""
+Endpoint benchmarks run through the Django test client.
+
+``run_benchmarks`` seeds a synthetic catalog (see products.seeding), times each
+scenario's requests and counts their queries, then rolls everything back.
+Results are plain dicts that ``bench_api`` writes as JSON, so a run on one
+commit can be compared with a run on another using ``compare``.
+"""
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import django
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import reference_cache
+from .models import Product, Unit
+from .pagination import GlobalPagination
+from .seeding import MATERIALS, seed_catalog
+
+USERNAME = '_bench'
+PASSWORD = 'Bench@12345'
+PERCENTILES = (50, 90, 95, 99)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class BenchContext:
+    """
+    Client, catalog ids and a private RNG shared by the scenarios of one run
+    """
+
+    def __init__(self, client, seed):
+        self.client = client
+        self.rng = random.Random(seed)
+        self.product_names = dict(Product.objects.values_list('id', 'name'))
+        self.unit_ids = list(Unit.objects.values_list('id', flat=True))
+        self.created = 0
+
+    def product_payload(self, name):
+        base, *secondary = self.rng.sample(self.unit_ids, min(3, len(self.unit_ids)))
+        return {
+            'name': name,
+            'description': "Benchmark product",
+            'base_unit_id': base,
+            'secondary_units': [{'unit_id': uid, 'conversion_factor': 50} for uid in secondary],
+        }
+
+
+def _product_list(ctx):
+    pages = max(1, min(5, len(ctx.product_names) // GlobalPagination.page_size))
+    return ctx.client.get(reverse('products-list-create'), {'page': ctx.rng.randint(1, pages)})
+
+
+def _product_search(ctx):
+    return ctx.client.get(reverse('products-list-create'), {'search': ctx.rng.choice(MATERIALS).lower()[:4]})
+
+
+def _product_create(ctx):
+    ctx.created += 1
+    return ctx.client.post(
+        reverse('products-list-create'), ctx.product_payload(f'Bench product {ctx.created:06d}'), content_type='application/json'
+    )
+
+
+def _product_update(ctx):
+    product_id, name = ctx.rng.choice(list(ctx.product_names.items()))
+    return ctx.client.put(
+        reverse('product-detail', args=[product_id]), ctx.product_payload(name), content_type='application/json'
+    )
+
+
+def _unit_list(ctx):
+    return ctx.client.get(reverse('units-list-create'))
+
+
+def _login(ctx):
+    return ctx.client.post(reverse('token_obtain_pair'), {'username': USERNAME, 'password': PASSWORD}, content_type='application/json')
+
+
+# name -> request; each call is one timed request
+SCENARIOS = {
+    'product_list': _product_list,
+    'product_search': _product_search,
+    'product_create': _product_create,
+    'product_update': _product_update,
+    'unit_list': _unit_list,
+    'login': _login,
+}
+
+
+def _percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(timings, queries, errors):
+    ordered = sorted(timings)
+    summary = {'requests': len(ordered), 'errors': errors}
+    summary.update({f'p{pct}_ms': round(_percentile(ordered, pct), 3) for pct in PERCENTILES})
+    summary['mean_ms'] = round(statistics.fmean(ordered), 3)
+    summary['max_ms'] = round(ordered[-1], 3)
+    summary['queries'] = max(queries)
+    return summary
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scenarios=None, iterations=50, warmup=5, products=500, seed=1):
+    """
+    {meta, scenarios: {name: summary}} for the selected scenarios.
+
+    ``products`` synthetic products are added to the current catalog (0 benchmarks
+    the catalog as is); every write is rolled back at the end.
+    """
+    names = list(scenarios or SCENARIOS)
+    results = {}
+    try:
+        with transaction.atomic():
+            if products:
+                # Tagged apart from a catalog seeded by seed_catalog
+                seed_catalog(products=products, seed=seed, tag='B')
+            get_user_model().objects.create_user(username=USERNAME, password=PASSWORD, role='admin')
+            reference_cache.categories.invalidate()
+            reference_cache.units.invalidate()
+
+            client = Client()
+            token = client.post(
+                reverse('token_obtain_pair'), {'username': USERNAME, 'password': PASSWORD}, content_type='application/json'
+            ).json()['access']
+            client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+            ctx = BenchContext(client, seed)
+
+            for name in names:
+                scenario = SCENARIOS[name]
+                for _ in range(warmup):
+                    scenario(ctx)
+                timings, queries, errors = [], [], 0
+                for _ in range(iterations):
+                    with CaptureQueriesContext(connection) as captured:
+                        start = time.perf_counter()
+                        response = scenario(ctx)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    queries.append(len(captured))
+                    errors += response.status_code >= 400
+                results[name] = summarize(timings, queries, errors)
+            raise _Rollback()
+    except _Rollback:
+        pass
+    finally:
+        reference_cache.categories.invalidate()
+        reference_cache.units.invalidate()
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'iterations': iterations,
+            'warmup': warmup,
+            'products': products,
+            'seed': seed,
+        },
+        'scenarios': results,
+    }
+
+
+def compare(previous, current, threshold=0.2):
+    """
+    One row per scenario present in both runs: (name, field, before, after, regressed).
+
+    A query count that grows, or a p50/p95 more than ``threshold`` slower, is a regression.
+    """
+    rows = []
+    for name, after in current['scenarios'].items():
+        before = previous['scenarios'].get(name)
+        if before is None:
+            continue
+        for field in ('p50_ms', 'p95_ms', 'queries'):
+            if field == 'queries':
+                regressed = after[field] > before[field]
+            else:
+                regressed = after[field] > before[field] * (1 + threshold)
+            rows.append((name, field, before[field], after[field], regressed))
+    return rows
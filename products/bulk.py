@@ -0,0 +1,156 @@
+"""
+Mass product updates (``PATCH products/bulk/``).
+
+Either a list of ``{id, fields}`` items or a ``filter`` plus one ``fields``
+set. Items are validated together with one query for the products and one per
+referenced table, then written inside a single transaction: is_active and
+category changes with one ``UPDATE ... WHERE id IN`` per distinct value,
+free-text fields (name, description) with ``bulk_update``. Values a product
+already has are not rewritten. The category summary and search index follow
+through their triggers; cached products are invalidated here.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+
+from . import product_cache
+from .models import Product, ProductCategory
+
+UPDATE_CHUNK_SIZE = 500
+
+# Low-cardinality fields, written with one UPDATE per distinct value; the
+# others (free text) with bulk_update
+GROUPED_FIELDS = ('is_active', 'category')
+# A filter selects many products at once, so it cannot set a unique name
+FILTER_FIELDS = ('is_active', 'category', 'description')
+
+_COLUMNS = {'category': 'category_id'}
+
+
+class BulkUpdateError(Exception):
+    """
+    Raised when a batch fails validation; ``errors`` is a list of per-item dicts
+    """
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _check_categories(items, errors):
+    wanted = {fields['category'] for _, _, fields in items if fields.get('category') is not None}
+    known = set(ProductCategory.objects.filter(id__in=wanted).values_list('id', flat=True))
+    for index, product_id, fields in items:
+        if fields.get('category') is not None and fields['category'] not in known:
+            errors.append({'index': index, 'id': product_id, 'error': "Unknown category.", 'category': fields['category']})
+
+
+def _check_names(items, errors):
+    owners = defaultdict(list)
+    for index, product_id, fields in items:
+        if 'name' in fields:
+            owners[fields['name']].append((index, product_id))
+    taken = dict(Product.objects.filter(name__in=list(owners)).values_list('name', 'id'))
+    for name, claims in owners.items():
+        for index, product_id in claims:
+            # Names are unique per row at write time, so swapping names within a batch is refused too
+            if len(claims) > 1 or taken.get(name, product_id) != product_id:
+                errors.append({'index': index, 'id': product_id, 'error': "Name already in use.", 'name': name})
+
+
+def update_items(items):
+    """
+    Apply validated items ({id, fields}) all or nothing.
+    Returns [{id, changed: [field, ...]}] in request order.
+    """
+    indexed = [(index, item['id'], item['fields']) for index, item in enumerate(items)]
+    errors = []
+    seen = set()
+    for index, product_id, _ in indexed:
+        if product_id in seen:
+            errors.append({'index': index, 'id': product_id, 'error': "Product listed more than once."})
+        seen.add(product_id)
+
+    with transaction.atomic():
+        current = {
+            row['id']: row
+            for row in Product.objects.select_for_update().filter(id__in=seen).values(
+                'id', 'name', 'description', 'is_active', 'category_id'
+            )
+        }
+        for index, product_id, _ in indexed:
+            if product_id not in current:
+                errors.append({'index': index, 'id': product_id, 'error': "Unknown product."})
+        _check_categories(indexed, errors)
+        _check_names(indexed, errors)
+        if errors:
+            raise BulkUpdateError(sorted(errors, key=lambda e: e['index']))
+
+        results, groups, texts = [], defaultdict(list), defaultdict(list)
+        for _, product_id, fields in indexed:
+            row = current[product_id]
+            changed = [f for f, value in fields.items() if row[_COLUMNS.get(f, f)] != value]
+            results.append({'id': product_id, 'changed': changed})
+            for field in changed:
+                if field in GROUPED_FIELDS:
+                    groups[(field, fields[field])].append(product_id)
+                else:
+                    texts[field].append(Product(id=product_id, **{field: fields[field]}))
+
+        for (field, value), ids in groups.items():
+            for chunk in _chunks(ids, UPDATE_CHUNK_SIZE):
+                Product.objects.filter(id__in=chunk).update(**{_COLUMNS.get(field, field): value})
+        for field, products in texts.items():
+            Product.objects.bulk_update(products, [field], batch_size=UPDATE_CHUNK_SIZE)
+
+        product_cache.invalidate(r['id'] for r in results if r['changed'])
+    return results
+
+
+def update_matching(queryset, fields):
+    """
+    Set ``fields`` on every product of ``queryset`` that does not have them yet.
+    Returns (matched, updated ids).
+    """
+    columns = {_COLUMNS.get(f, f): value for f, value in fields.items()}
+    if fields.get('category') is not None and not ProductCategory.objects.filter(id=fields['category']).exists():
+        raise BulkUpdateError([{'error': "Unknown category.", 'category': fields['category']}])
+
+    with transaction.atomic():
+        matched = list(queryset.select_for_update().order_by('id').values_list('id', *columns))
+        ids = [row[0] for row in matched if list(row[1:]) != list(columns.values())]
+        for chunk in _chunks(ids, UPDATE_CHUNK_SIZE):
+            Product.objects.filter(id__in=chunk).update(**columns)
+        product_cache.invalidate(ids)
+    return len(matched), ids
+
+
+def filter_products(criteria):
+    """
+    Products matching a validated bulk filter (ids, category, is_active, search)
+    """
+    criteria = dict(criteria)
+    products = Product.objects.all()
+    if 'search' in criteria:
+        products = products.search(criteria.pop('search'))
+    if 'ids' in criteria:
+        products = products.filter(id__in=criteria.pop('ids'))
+    if 'category' in criteria:
+        products = products.filter(category_id=criteria.pop('category'))
+    return products.filter(**criteria)
+
+
+def apply(data):
+    """
+    Run validated ``ProductBulkUpdateSerializer`` data; returns the response body
+    """
+    if 'items' in data:
+        results = update_items(data['items'])
+        return {'updated': sum(1 for r in results if r['changed']), 'results': results}
+    matched, ids = update_matching(filter_products(data['filter']), data['fields'])
+    return {'matched': matched, 'updated': len(ids), 'ids': ids}
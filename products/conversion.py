@@ -0,0 +1,105 @@
+"""
+Exact unit conversion between any two units of a product.
+
+``ProductUnit.conversion_factor`` is a float relative to the base unit. Each
+factor is read back through its shortest decimal repr (50.0 -> 50, 0.1 -> 1/10)
+and kept as a ``Fraction``, so sack -> tonne is 50/1000 exactly instead of
+float arithmetic. Per-product factor maps are cached in the default cache and
+dropped whenever the product's units change; a per-process cache never hears
+of changes made by other workers, so there they are kept for LOCAL_TIMEOUT only.
+Factors that are not positive (rows written before they were validated) make
+conversions through that unit fail with ``ConversionError``.
+"""
+import math
+from decimal import Decimal, ROUND_HALF_EVEN, localcontext
+from fractions import Fraction
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from BuildStock import db_router
+
+from .models import ProductUnit
+
+KEY_PREFIX = 'buildstock:conversion'
+TIMEOUT = 60 * 60
+LOCAL_TIMEOUT = 30
+RESULT_PLACES = Decimal('0.000000001')
+
+
+class ConversionError(ValueError):
+    pass
+
+
+def _key(product_id):
+    return f'{KEY_PREFIX}:{product_id}'
+
+
+def factor_to_fraction(factor):
+    return Fraction(Decimal(repr(float(factor))))
+
+
+def _timeout():
+    return LOCAL_TIMEOUT if isinstance(caches['default'], (LocMemCache, DummyCache)) else TIMEOUT
+
+
+def get_matrices(product_ids):
+    """
+    {product_id: {unit_id: Fraction(base units per unit), or None for an invalid factor}},
+    one cache round trip and at most one query for the misses
+    """
+    product_ids = set(product_ids)
+    keys = {_key(pid): pid for pid in product_ids}
+    cached = cache.get_many(list(keys))
+    matrices = {keys[key]: value for key, value in cached.items()}
+
+    missing = product_ids - set(matrices)
+    if missing:
+        loaded = {pid: {} for pid in missing}
+        # From the primary, so a lagging replica cannot re-cache invalidated factors
+        with db_router.primary():
+            rows = list(ProductUnit.objects.filter(product_id__in=missing).values_list('product_id', 'unit_id', 'conversion_factor'))
+        for product_id, unit_id, factor in rows:
+            valid = math.isfinite(factor) and factor > 0
+            loaded[product_id][unit_id] = factor_to_fraction(factor) if valid else None
+        cache.set_many({_key(pid): matrix for pid, matrix in loaded.items()}, _timeout())
+        matrices.update(loaded)
+    return matrices
+
+
+def get_matrix(product_id):
+    return get_matrices([product_id])[product_id]
+
+
+def convert(matrix, quantity, from_unit_id, to_unit_id):
+    """
+    Exact ``Fraction`` result of ``quantity`` from one unit to another of the same product
+    """
+    try:
+        source, target = matrix[from_unit_id], matrix[to_unit_id]
+    except KeyError as exc:
+        raise ConversionError(f"Unit {exc.args[0]} is not configured for this product.")
+    if source is None or target is None:
+        unit_id = from_unit_id if source is None else to_unit_id
+        raise ConversionError(f"Unit {unit_id} has an invalid conversion factor for this product.")
+    return Fraction(quantity) * source / target
+
+
+def to_decimal(value):
+    """
+    (Decimal rounded to 9 places, whether that rounding was exact)
+    """
+    with localcontext() as ctx:
+        ctx.prec = 60
+        result = (Decimal(value.numerator) / Decimal(value.denominator)).quantize(RESULT_PLACES, rounding=ROUND_HALF_EVEN)
+    return Decimal(format(result.normalize(), 'f')), Fraction(result) == value
+
+
+def invalidate(product_ids):
+    keys = [_key(pid) for pid in set(product_ids)]
+    if keys:
+        # Again after commit, in case a reader re-cached the old rows meanwhile
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
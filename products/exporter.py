@@ -0,0 +1,101 @@
+"""
+Streaming catalog export in the same CSV/JSONL layout the importer reads.
+
+Products are walked with ``QuerySet.iterator(chunk_size=...)``; units and
+category are prefetched per chunk, so memory stays flat whatever the
+catalog size and the first bytes are sent before the last rows are read.
+Under ASGI, Django would buffer a sync iterator whole before sending it, so
+``astream`` hands the same lines over as an async iterator.
+"""
+import csv
+import json
+from decimal import Decimal
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from .models import Product
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+COLUMNS = ['uuid', 'name', 'description', 'category', 'is_active', 'stock_quantity', 'base_unit', 'secondary_units']
+DEFAULT_CHUNK_SIZE = 2000
+# Lines produced per thread hop by astream
+ASYNC_BATCH_LINES = 500
+
+
+class _Echo:
+    """
+    File-like object whose write() returns the value, for csv.writer
+    """
+
+    def write(self, value):
+        return value
+
+
+def format_factor(value):
+    """
+    Shortest exact decimal of a float factor (50.0 -> 50, 1234567.0 -> 1234567)
+    """
+    return format(Decimal(repr(float(value))).normalize(), 'f')
+
+
+def iter_products(queryset=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    if queryset is None:
+        queryset = Product.objects.all()
+    return queryset.with_units().order_by('id').iterator(chunk_size=chunk_size)
+
+
+def _row(product):
+    base_unit = None
+    secondary = []
+    for pu in product.units.all():
+        if pu.is_base:
+            base_unit = pu.unit.symbol
+        else:
+            secondary.append({'unit': pu.unit.symbol, 'conversion_factor': pu.conversion_factor})
+    return {
+        'uuid': str(product.uuid),
+        'name': product.name,
+        'description': product.description or '',
+        'category': product.category.name if product.category else '',
+        'is_active': product.is_active,
+        'stock_quantity': product.stock_quantity,
+        'base_unit': base_unit,
+        'secondary_units': secondary,
+    }
+
+
+def stream_csv(products):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for product in products:
+        row = _row(product)
+        row['is_active'] = 'true' if row['is_active'] else 'false'
+        row['secondary_units'] = '|'.join(f"{u['unit']}:{format_factor(u['conversion_factor'])}" for u in row['secondary_units'])
+        yield writer.writerow([row[column] for column in COLUMNS])
+
+
+def stream_jsonl(products):
+    for product in products:
+        yield json.dumps(_row(product), ensure_ascii=False) + '\n'
+
+
+def stream(file_format, products):
+    if file_format == 'csv':
+        return stream_csv(products)
+    if file_format == 'jsonl':
+        return stream_jsonl(products)
+    raise ValueError(f"Unsupported format '{file_format}', expected one of {', '.join(FORMATS)}.")
+
+
+async def astream(file_format, products):
+    """
+    ``stream`` as an async iterator: lines are produced in the request's sync thread
+    (which owns the database connection), ASYNC_BATCH_LINES per hop
+    """
+    lines = stream(file_format, products)
+    next_batch = sync_to_async(lambda: list(islice(lines, ASYNC_BATCH_LINES)))
+    while batch := await next_batch():
+        for line in batch:
+            yield line
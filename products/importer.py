@@ -0,0 +1,326 @@
+"""
+Streaming bulk import of products from CSV or JSONL.
+
+Rows are read lazily and processed in chunks. For each chunk, categories,
+units and existing products are resolved with one query each, then written
+with bulk_create / bulk_update inside a transaction. Bad rows are reported
+and skipped; they never abort the rest of the file.
+
+Columns / keys:
+    name (required), description, category (name), is_active,
+    base_unit (unit name or symbol, required for new products),
+    secondary_units ("sac:50|t:1000" in CSV, or a list of
+    {"unit": "sac", "conversion_factor": 50} in JSONL)
+
+On upsert, empty values (and omitted keys) leave the existing field as it is.
+"""
+import csv
+import json
+import math
+from itertools import islice
+
+from django.db import DatabaseError, transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Lower
+
+from . import product_cache
+from .models import Product, ProductCategory, ProductUnit, Unit
+from .units import UnitSyncPlan
+
+FORMATS = ('csv', 'jsonl')
+DEFAULT_CHUNK_SIZE = 500
+NAME_MAX_LENGTH = Product._meta.get_field('name').max_length
+
+_TRUE = {'1', 'true', 'yes', 'y', 'oui'}
+_FALSE = {'0', 'false', 'no', 'n', 'non'}
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(filename, default='csv'):
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def iter_rows(lines, file_format):
+    """
+    Yield (row_number, dict or RowError) from an iterable of text lines
+    """
+    if file_format == 'csv':
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            yield number, row
+    elif file_format == 'jsonl':
+        number = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield number, RowError(f"Invalid JSON: {exc}")
+                continue
+            yield number, row if isinstance(row, dict) else RowError("Each line must be a JSON object.")
+    else:
+        raise ValueError(f"Unsupported format '{file_format}', expected one of {', '.join(FORMATS)}.")
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _parse_bool(value, default=True):
+    text = _text(value).lower()
+    if not text:
+        return default
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise RowError(f"Invalid boolean '{value}'.")
+
+
+def _parse_secondary_units(value):
+    """
+    Return a list of (unit key, factor) or None when the column is absent
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        items = []
+        for part in filter(None, (p.strip() for p in value.split('|'))):
+            key, sep, factor = part.rpartition(':')
+            if not sep or not key.strip():
+                raise RowError(f"Invalid secondary unit '{part}', expected 'unit:factor'.")
+            items.append((key.strip(), factor))
+    elif isinstance(value, list):
+        items = []
+        for item in value:
+            if not isinstance(item, dict) or not item.get('unit'):
+                raise RowError("Secondary units must be objects with 'unit' and 'conversion_factor'.")
+            items.append((_text(item['unit']), item.get('conversion_factor', 1)))
+    else:
+        raise RowError("Invalid secondary_units.")
+
+    parsed = []
+    for key, factor in items:
+        try:
+            factor = float(factor)
+        except (TypeError, ValueError):
+            raise RowError(f"Invalid conversion factor for '{key}'.")
+        if not math.isfinite(factor) or factor <= 0:
+            raise RowError(f"Conversion factor for '{key}' must be positive.")
+        parsed.append((key, factor))
+    return parsed
+
+
+def _normalize(row):
+    name = _text(row.get('name'))
+    if not name:
+        raise RowError("Name is required.")
+    if len(name) > NAME_MAX_LENGTH:
+        raise RowError(f"Name is longer than {NAME_MAX_LENGTH} characters.")
+    return {
+        'name': name,
+        'description': _text(row.get('description')) or None,
+        'has_description': _text(row.get('description')) != '',
+        'category': _text(row.get('category')),
+        'is_active': _parse_bool(row.get('is_active')),
+        'has_is_active': _text(row.get('is_active')) != '',
+        'base_unit': _text(row.get('base_unit')),
+        'secondary_units': _parse_secondary_units(row.get('secondary_units')),
+    }
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+
+    def error(self, row, message, name=None):
+        self.errors.append({'row': row, 'name': name, 'error': message})
+
+    def as_dict(self):
+        return {'created': self.created, 'updated': self.updated, 'errors': self.errors}
+
+
+def _resolve_unit(units, key):
+    return units.get(key) or units.get(key.lower())
+
+
+def _import_chunk(chunk, upsert, result):
+    rows = []
+    seen = set()
+    for number, raw in chunk:
+        if isinstance(raw, RowError):
+            result.error(number, str(raw))
+            continue
+        try:
+            row = _normalize(raw)
+        except RowError as exc:
+            result.error(number, str(exc), _text(raw.get('name')) or None)
+            continue
+        if row['name'] in seen:
+            result.error(number, "Duplicate name in import.", row['name'])
+            continue
+        seen.add(row['name'])
+        rows.append((number, row))
+    if not rows:
+        return
+
+    category_names = {row['category'] for _, row in rows if row['category']}
+    categories = {c.name: c for c in ProductCategory.objects.filter(name__in=category_names)}
+
+    unit_keys = set()
+    for _, row in rows:
+        if row['base_unit']:
+            unit_keys.add(row['base_unit'])
+        unit_keys.update(key for key, _ in row['secondary_units'] or [])
+    # Matched case-insensitively; an exact match wins over a unit differing only in case
+    lowered = {key.lower() for key in unit_keys}
+    units = {}
+    for unit in Unit.objects.annotate(name_lower=Lower('name'), symbol_lower=Lower('symbol')).filter(
+        Q(name_lower__in=lowered) | Q(symbol_lower__in=lowered)
+    ):
+        units[unit.name] = units[unit.symbol] = unit
+    for unit in list(units.values()):
+        units.setdefault(unit.name.lower(), unit)
+        units.setdefault(unit.symbol.lower(), unit)
+
+    base_units = ProductUnit.objects.filter(product=OuterRef('pk'), is_base=True).values('unit_id')[:1]
+    existing = {
+        p.name: p for p in
+        Product.objects.filter(name__in=[row['name'] for _, row in rows]).annotate(current_base_unit_id=Subquery(base_units))
+    }
+
+    to_create, to_update = [], []
+    for number, row in rows:
+        name = row['name']
+        try:
+            category = None
+            if row['category']:
+                category = categories.get(row['category'])
+                if category is None:
+                    raise RowError(f"Unknown category '{row['category']}'.")
+            base_unit = None
+            if row['base_unit']:
+                base_unit = _resolve_unit(units, row['base_unit'])
+                if base_unit is None:
+                    raise RowError(f"Unknown unit '{row['base_unit']}'.")
+            secondary = None
+            if row['secondary_units'] is not None:
+                secondary = []
+                for key, factor in row['secondary_units']:
+                    unit = _resolve_unit(units, key)
+                    if unit is None:
+                        raise RowError(f"Unknown unit '{key}'.")
+                    secondary.append((unit.id, factor))
+                unit_ids = [uid for uid, _ in secondary]
+                if len(unit_ids) != len(set(unit_ids)):
+                    raise RowError("Duplicate units in secondary units.")
+                if base_unit and base_unit.id in unit_ids:
+                    raise RowError("Base unit cannot be included in secondary units.")
+        except RowError as exc:
+            result.error(number, str(exc), name)
+            continue
+
+        product = existing.get(name)
+        if product is None:
+            if base_unit is None:
+                result.error(number, "Base unit is required for new products.", name)
+                continue
+            product = Product(
+                name=name,
+                description=row['description'],
+                category=category,
+                is_active=row['is_active'],
+            )
+            to_create.append((number, product, base_unit, secondary or []))
+        elif upsert:
+            if base_unit is None and secondary and product.current_base_unit_id in {uid for uid, _ in secondary}:
+                # Listing the current base as a secondary would leave the product without one
+                result.error(number, "Base unit cannot be included in secondary units.", name)
+                continue
+            if row['has_description']:
+                product.description = row['description']
+            if row['category']:
+                product.category = category
+            if row['has_is_active']:
+                product.is_active = row['is_active']
+            to_update.append((number, product, base_unit, secondary))
+        else:
+            result.error(number, "Product already exists.", name)
+
+    if not to_create and not to_update:
+        return
+
+    try:
+        with transaction.atomic():
+            if to_create:
+                created = Product.objects.bulk_create([p for _, p, _, _ in to_create], batch_size=1000)
+                if any(p.pk is None for p in created):
+                    # Backends that cannot return ids from a bulk insert
+                    ids = dict(Product.objects.filter(name__in=[p.name for p in created]).values_list('name', 'id'))
+                    for p in created:
+                        p.pk = ids[p.name]
+                ProductUnit.objects.bulk_create(
+                    [
+                        ProductUnit(product=p, unit=base_unit, is_base=True, conversion_factor=1)
+                        for _, p, base_unit, _ in to_create
+                    ] + [
+                        ProductUnit(product=p, unit_id=unit_id, is_base=False, conversion_factor=factor)
+                        for _, p, _, secondary in to_create
+                        for unit_id, factor in secondary
+                    ],
+                    batch_size=1000
+                )
+            if to_update:
+                Product.objects.bulk_update(
+                    [p for _, p, _, _ in to_update],
+                    ['description', 'category', 'is_active'],
+                    batch_size=1000
+                )
+                product_cache.invalidate(p.pk for _, p, _, _ in to_update)
+                current = {}
+                for pu in ProductUnit.objects.filter(product__in=[p for _, p, _, _ in to_update]):
+                    current.setdefault(pu.product_id, []).append(pu)
+                plan = UnitSyncPlan()
+                for _, p, base_unit, secondary in to_update:
+                    plan.add(p, current.get(p.pk, []), base_unit.id if base_unit else None, secondary)
+                plan.apply()
+    except DatabaseError as exc:
+        for number, p, _, _ in to_create + to_update:
+            result.error(number, f"Chunk failed: {exc}", p.name)
+        return
+
+    result.created += len(to_create)
+    result.updated += len(to_update)
+
+
+def import_products(lines, file_format='csv', upsert=False, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    Import products from an iterable of text lines; returns an ImportResult.
+    ``progress(rows_read)`` is called after each chunk.
+    """
+    result = ImportResult()
+    rows = iter_rows(lines, file_format)
+    read = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        _import_chunk(chunk, upsert, result)
+        read += len(chunk)
+        if progress is not None:
+            progress(read)
+    result.errors.sort(key=lambda error: error['row'])
+    return result
@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.benchmarks import SCENARIOS, compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = "Benchmark the main endpoints on a synthetic catalog (rolled back) and optionally save/compare JSON results"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help="Repeatable; defaults to all")
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--products', type=int, default=500, help="Synthetic products added for the run; 0 uses the current catalog as is")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--compare', help="JSON results of a previous run to compare against")
+        parser.add_argument('--threshold', type=float, default=0.2, help="Allowed latency increase (0.2 = 20%%)")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, scenario, iterations, warmup, products, seed, output, threshold, fail_on_regression, **options):
+        if iterations < 1:
+            raise CommandError("--iterations must be at least 1.")
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    previous = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(exc)
+
+        results = run_benchmarks(scenario, iterations=iterations, warmup=warmup, products=products, seed=seed)
+
+        self.stdout.write(f"{products} seeded products, {iterations} requests per scenario ({results['meta']['database']})")
+        self.stdout.write(f"{'scenario':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'errors':>8}")
+        for name, summary in results['scenarios'].items():
+            self.stdout.write(
+                f"{name:<16}{summary['p50_ms']:>10.3f}{summary['p95_ms']:>10.3f}{summary['p99_ms']:>10.3f}"
+                f"{summary['queries']:>9}{summary['errors']:>8}"
+            )
+
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {output}")
+
+        if previous is not None:
+            regressions = 0
+            self.stdout.write(f"Compared with {previous['meta'].get('commit') or options['compare']}:")
+            for name, field, before, after, regressed in compare(previous, results, threshold):
+                regressions += regressed
+                flag = '  REGRESSION' if regressed else ''
+                self.stdout.write(f"{name:<16}{field:<9}{before:>10}{after:>10}{flag}")
+            if regressions and fail_on_regression:
+                raise CommandError(f"{regressions} regression(s).")
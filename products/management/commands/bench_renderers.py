@@ -0,0 +1,63 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from BuildStock.renderers import MessagePackRenderer, ORJSONRenderer, msgpack, orjson
+from products.models import Product, ProductCategory, ProductUnit, Unit
+from products.serializers import ProductSerializer
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare render time and payload size of ProductSerializer pages per renderer (sample data is rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, page_size, repeat, **options):
+        try:
+            with transaction.atomic():
+                data = self._sample_page(page_size)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        renderers = [('json (stdlib)', JSONRenderer())]
+        if orjson is not None:
+            renderers.append(('orjson', ORJSONRenderer()))
+        if msgpack is not None:
+            renderers.append(('msgpack', MessagePackRenderer()))
+
+        self.stdout.write(f"{page_size} products per page, {repeat} renders each")
+        self.stdout.write(f"{'renderer':<16}{'median ms':>12}{'p95 ms':>10}{'bytes':>10}")
+        for name, renderer in renderers:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                payload = renderer.render(data, renderer.media_type, {})
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(f"{name:<16}{statistics.median(timings):>12.3f}{p95:>10.3f}{len(payload):>10}")
+
+    def _sample_page(self, page_size):
+        category = ProductCategory.objects.create(name='Bench category')
+        units = [Unit.objects.create(name=f'Bench unit {i}', symbol=f'bu{i}') for i in range(4)]
+        products = Product.objects.bulk_create([
+            Product(name=f'Bench product {i:05d}', description="Ciment gris, sac de 50 kg " * 4, category=category)
+            for i in range(page_size)
+        ])
+        ProductUnit.objects.bulk_create([
+            ProductUnit(product=product, unit=unit, is_base=(i == 0), conversion_factor=[1, 50, 1000, 0.5][i])
+            for product in products
+            for i, unit in enumerate(units)
+        ])
+        page = Product.objects.with_units().filter(category=category).order_by('name')
+        return {'count': page_size, 'next': None, 'previous': None, 'results': ProductSerializer(page, many=True).data}
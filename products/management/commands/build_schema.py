@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from BuildStock import schema
+
+
+class Command(BaseCommand):
+    help = "Generate the OpenAPI schema served by /api/schema/ (run at build time or before the server starts)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Defaults to settings.OPENAPI_SCHEMA_FILE")
+
+    def handle(self, *args, output, **options):
+        path = output or settings.OPENAPI_SCHEMA_FILE
+        content = schema.write(path)
+        self.stdout.write(self.style.SUCCESS(f"OpenAPI schema written to {path} ({len(content)} bytes)"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from products import exporter
+
+
+class Command(BaseCommand):
+    help = "Stream the product catalog as CSV or JSONL to a file or stdout ('-')"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-')
+        parser.add_argument('--format', choices=exporter.FORMATS, default='csv')
+        parser.add_argument('--chunk-size', type=int, default=exporter.DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, path, format, chunk_size, **options):
+        products = exporter.iter_products(chunk_size=chunk_size)
+        chunks = exporter.stream(format, products)
+        if path == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as out:
+                out.writelines(chunks)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from products.summary import fold
+
+
+class Command(BaseCommand):
+    help = "Fold pending category summary deltas into the summary rows (job workers also do this every SUMMARY_FOLD_SECONDS)"
+
+    def handle(self, *args, **options):
+        updated = fold()
+        self.stdout.write(self.style.SUCCESS(f"{updated} category summaries updated"))
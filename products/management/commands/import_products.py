@@ -0,0 +1,30 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import DEFAULT_CHUNK_SIZE, FORMATS, detect_format, import_products
+
+
+class Command(BaseCommand):
+    help = "Import products from a CSV or JSONL file ('-' reads stdin)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, else csv")
+        parser.add_argument('--upsert', action='store_true', help="Update products that already exist by name")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, path, format, upsert, chunk_size, **options):
+        file_format = format or detect_format(path)
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as exc:
+            raise CommandError(exc)
+        with stream:
+            result = import_products(stream, file_format, upsert=upsert, chunk_size=chunk_size)
+
+        for error in result.errors:
+            self.stderr.write(f"row {error['row']} ({error['name'] or '-'}): {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{result.created} created, {result.updated} updated, {len(result.errors)} errors"
+        ))
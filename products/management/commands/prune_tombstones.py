@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.sync import prune
+
+
+class Command(BaseCommand):
+    help = "Delete sync tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS (run daily)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Override the retention, in days")
+
+    def handle(self, *args, days, **options):
+        deleted = prune(days)
+        self.stdout.write(self.style.SUCCESS(f"{deleted} tombstones pruned"))
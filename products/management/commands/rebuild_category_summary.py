@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.summary import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the category summary from the products and report drift (--check only reports)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="Report drift without fixing it; exit 1 if any")
+
+    def handle(self, *args, check, **options):
+        drift = rebuild(check_only=check)
+        for category_id, (stored, wanted) in sorted(drift.items()):
+            self.stderr.write(f"category {category_id}: stored {stored}, expected {wanted}")
+        if drift and check:
+            raise CommandError(f"{len(drift)} category summaries drifted.")
+        action = "fixed" if drift else "no drift"
+        self.stdout.write(self.style.SUCCESS(f"{len(drift)} drifted rows, {action}"))
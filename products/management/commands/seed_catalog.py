@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from products.seeding import DEFAULT_BATCH_SIZE, seed_catalog
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic catalog of categories, units, products and product units (same --seed, same catalog)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=15)
+        parser.add_argument('--units', type=int, default=20)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, categories, units, products, seed, batch_size, **options):
+        if categories < 1 or units < 1 or products < 0:
+            raise CommandError("--categories and --units must be at least 1, --products at least 0.")
+        try:
+            counts = seed_catalog(categories, units, products, seed=seed, batch_size=batch_size)
+        except (ValueError, IntegrityError) as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(', '.join(f"{count} {name}" for name, count in counts.items())))
@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-18 15:49
+
+from django.db import migrations, models
+
+
+def demote_extra_base_units(apps, schema_editor):
+    # Keep the oldest base unit of each product before the constraint is created
+    ProductUnit = apps.get_model('products', 'ProductUnit')
+    seen = set()
+    extra = []
+    for pk, product_id in ProductUnit.objects.filter(is_base=True).order_by('product_id', 'id').values_list('id', 'product_id'):
+        if product_id in seen:
+            extra.append(pk)
+        seen.add(product_id)
+    if extra:
+        ProductUnit.objects.filter(pk__in=extra).update(is_base=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_stockmovement'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'name'], name='product_category_name'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['name'], name='product_active_name'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at'], name='product_created_at'),
+        ),
+        migrations.RunPython(demote_extra_base_units, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productunit',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_base', True)), fields=('product',), name='productunit_one_base_per_product'),
+        ),
+    ]
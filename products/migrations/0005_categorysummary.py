@@ -0,0 +1,34 @@
+# Generated by Django 4.2 on 2026-10-18 16:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def install_summary(apps, schema_editor):
+    from products import summary
+    summary.install(schema_editor.connection)
+
+
+def uninstall_summary(apps, schema_editor):
+    from products import summary
+    summary.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_index_plan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySummary',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='products.productcategory')),
+                ('product_count', models.IntegerField(default=0)),
+                ('active_product_count', models.IntegerField(default=0)),
+                ('stock_total', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(install_summary, uninstall_summary),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2 on 2026-10-18 16:09
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def install_sync(apps, schema_editor):
+    from products import sync
+    sync.install(schema_editor.connection)
+
+
+def uninstall_sync(apps, schema_editor):
+    from products import sync
+    sync.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_categorysummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('product', 'Product'), ('unit', 'Unit')], max_length=10)),
+                ('uuid', models.UUIDField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='unit',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at', 'id'], name='product_updated_at_id'),
+        ),
+        migrations.AddIndex(
+            model_name='unit',
+            index=models.Index(fields=['updated_at', 'id'], name='unit_updated_at_id'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['kind', 'deleted_at', 'id'], name='tombstone_kind_deleted_at'),
+        ),
+        migrations.RunPython(install_sync, uninstall_sync),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-18 16:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def reinstall_summary(apps, schema_editor):
+    # Replaces the triggers that updated the summary rows in place; the summary is recomputed
+    from products import summary
+    summary.uninstall(schema_editor.connection)
+    summary.install(schema_editor.connection)
+
+
+def uninstall_summary(apps, schema_editor):
+    from products import summary
+    summary.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySummaryDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_count', models.IntegerField(default=0)),
+                ('active_product_count', models.IntegerField(default=0)),
+                ('stock_total', models.BigIntegerField(default=0)),
+                ('category', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='summary_deltas', to='products.productcategory')),
+            ],
+        ),
+        migrations.RunPython(reinstall_summary, uninstall_summary),
+    ]
@@ -1,8 +1,29 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 import uuid
+from .search import search as search_products
 
 # Create your models here.
 
+def units_prefetch():
+    return models.Prefetch('units', queryset=ProductUnit.objects.select_related('unit').order_by('id'))
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_units(self):
+        """
+        Load category and units (with their Unit) in a fixed number of queries
+        """
+        return self.select_related('category').prefetch_related(units_prefetch())
+
+    def search(self, query):
+        """
+        Indexed, ranked search on name and description (see products.search)
+        """
+        return search_products(self, query)
+
+
 class ProductCategory(models.Model):
     """
     Represents a category of products
@@ -19,6 +40,47 @@ class ProductCategory(models.Model):
     def __str__(self):
         return self.name
 
+class CategorySummary(models.Model):
+    """
+    Product count and base-unit stock per category, kept current by database
+    triggers (see products.summary)
+    """
+
+    category = models.OneToOneField(
+        'ProductCategory',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='summary'
+    )
+    product_count = models.IntegerField(default=0)
+    active_product_count = models.IntegerField(default=0)
+    stock_total = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.category_id}: {self.product_count} products"
+
+
+class CategorySummaryDelta(models.Model):
+    """
+    A change to a CategorySummary row not yet folded into it, appended by the
+    summary triggers (see products.summary.fold)
+    """
+
+    # No constraint: deltas of a deleted category are dropped by the next fold
+    category = models.ForeignKey(
+        'ProductCategory',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='summary_deltas'
+    )
+    product_count = models.IntegerField(default=0)
+    active_product_count = models.IntegerField(default=0)
+    stock_total = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.category_id}: {self.product_count:+d} products"
+
+
 class Product(models.Model):
     """
     Represents a product
@@ -42,7 +104,21 @@ class Product(models.Model):
     is_active = models.BooleanField(default=True)
     stock_quantity = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Stamped by database triggers on every change, including unit changes (see products.sync)
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Delta sync keyset
+            models.Index(fields=['updated_at', 'id'], name='product_updated_at_id'),
+            # List filtered by category, ordered by name
+            models.Index(fields=['category', 'name'], name='product_category_name'),
+            # List of active products, ordered by name
+            models.Index(fields=['name'], condition=models.Q(is_active=True), name='product_active_name'),
+            models.Index(fields=['created_at'], name='product_created_at'),
+        ]
 
     def __str__(self):
      return self.name
@@ -60,6 +136,13 @@ class Unit(models.Model):
     )
     name = models.CharField(max_length=50, unique=True)
     symbol = models.CharField(max_length=10, unique=True)
+    # Stamped by database triggers (see products.sync)
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='unit_updated_at_id'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.symbol})"
@@ -84,10 +167,98 @@ class ProductUnit(models.Model):
 
     class Meta:
         unique_together = ('product', 'unit')
+        constraints = [
+            # One base unit per product; also the index behind (product, is_base=True) lookups
+            models.UniqueConstraint(
+                fields=['product'], condition=models.Q(is_base=True), name='productunit_one_base_per_product'
+            ),
+        ]
    
 
     def __str__(self):
         base = " (Base)" if self.is_base else ""
         return f"{self.product.name} - {self.unit.name}{base}"
     
-    
\ No newline at end of file
+    
+
+class StockMovement(models.Model):
+    """
+    Append-only ledger entry for a stock change, expressed in a product unit
+    and converted to base units, e.g. in 3 sac = +150 kg
+    """
+
+    IN = 'in'
+    OUT = 'out'
+    ADJUST = 'adjust'
+    TYPE_CHOICES = (
+        (IN, 'In'),
+        (OUT, 'Out'),
+        (ADJUST, 'Adjust'),
+    )
+
+    uuid = models.UUIDField(
+        default=uuid.uuid4,
+        editable=False,
+        unique=True
+    )
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='stock_movements')
+    product_unit = models.ForeignKey(
+        'ProductUnit',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='stock_movements'
+    )
+    movement_type = models.CharField(max_length=10, choices=TYPE_CHOICES)
+    quantity = models.DecimalField(max_digits=14, decimal_places=3, help_text="Quantity in the movement's unit")
+    base_quantity = models.BigIntegerField(help_text="Signed change of stock_quantity, in base units")
+    note = models.CharField(max_length=255, blank=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stock_movements'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-created_at'], name='stockmovement_product_created'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Stock movements are append-only.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Stock movements are append-only.")
+
+    def __str__(self):
+        return f"{self.product_id} {self.movement_type} {self.base_quantity:+d}"
+
+
+class Tombstone(models.Model):
+    """
+    A deleted product or unit, kept for delta sync clients (see products.sync).
+    Written by database triggers.
+    """
+
+    PRODUCT = 'product'
+    UNIT = 'unit'
+    KIND_CHOICES = (
+        (PRODUCT, 'Product'),
+        (UNIT, 'Unit'),
+    )
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    uuid = models.UUIDField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'deleted_at', 'id'], name='tombstone_kind_deleted_at'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.uuid}"
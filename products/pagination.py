@@ -1,6 +1,43 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
 
 class GlobalPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
-    max_page_size = 100
\ No newline at end of file
+    max_page_size = 100
+
+
+class GlobalCursorPagination(CursorPagination):
+    """
+    Keyset pagination on (name, id): no OFFSET scan and no COUNT(*) unless ?count=true
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('name', 'id')
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            payload = {'count': self.count, **payload}
+        return Response(payload)
+
+
+def get_paginator(request, default_class=GlobalPagination):
+    """
+    Clients opt into keyset pagination with ?pagination=cursor (or by sending a cursor)
+    """
+    if request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params:
+        return GlobalCursorPagination()
+    return default_class()
@@ -0,0 +1,87 @@
+"""
+Per-product cache of serialized ``ProductSerializer`` data.
+
+Entries are keyed by product id, with a small uuid -> id pointer so labels
+and offline lists can resolve uuids without a query. ``get_many`` costs one
+cache round trip (two when uuids point at products not asked for by id) and
+loads all misses in one query with units prefetched.
+Product saves and deletes invalidate through signals; bulk paths (stock
+movements, unit sync, import) call ``invalidate`` themselves. Invalidations
+reach other processes (web workers, the job worker) only through a shared
+cache, so a per-process cache keeps entries for LOCAL_TIMEOUT only.
+"""
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Q
+
+from BuildStock import db_router
+
+from .models import Product
+
+KEY_PREFIX = 'buildstock:product'
+UUID_PREFIX = 'buildstock:product-uuid'
+TIMEOUT = 60 * 60
+LOCAL_TIMEOUT = 30
+
+
+def _key(product_id):
+    return f'{KEY_PREFIX}:{product_id}'
+
+
+def _uuid_key(product_uuid):
+    return f'{UUID_PREFIX}:{product_uuid}'
+
+
+def _timeout():
+    return LOCAL_TIMEOUT if isinstance(caches['default'], (LocMemCache, DummyCache)) else TIMEOUT
+
+
+# From the primary: a lagging replica would re-cache rows a write just invalidated
+@db_router.primary()
+def _load(filters):
+    # serializers -> units -> product_cache
+    from .serializers import ProductSerializer
+
+    products = list(Product.objects.with_units().filter(filters))
+    data = ProductSerializer(products, many=True).data
+    loaded = {product.pk: row for product, row in zip(products, data)}
+    entries = {_key(pk): row for pk, row in loaded.items()}
+    entries.update({_uuid_key(row['uuid']): pk for pk, row in loaded.items()})
+    cache.set_many(entries, _timeout())
+    return loaded
+
+
+def get_many(ids=(), uuids=()):
+    """
+    ({product_id: data}, {uuid: product_id}) for the products that exist
+    """
+    ids = {int(pk) for pk in ids}
+    uuids = {str(u) for u in uuids}
+    cached = cache.get_many([_key(pk) for pk in ids] + [_uuid_key(u) for u in uuids])
+
+    uuid_ids = {u: cached[_uuid_key(u)] for u in uuids if _uuid_key(u) in cached}
+    found = {pk: cached[_key(pk)] for pk in ids if _key(pk) in cached}
+    pointed = {pk for pk in uuid_ids.values() if pk not in found}
+    if pointed:
+        # Second round trip only for uuids whose product was not asked for by id
+        more = cache.get_many([_key(pk) for pk in pointed])
+        found.update({pk: more[_key(pk)] for pk in pointed if _key(pk) in more})
+
+    wanted_ids = (ids | set(uuid_ids.values())) - set(found)
+    unknown_uuids = uuids - set(uuid_ids)
+    if wanted_ids or unknown_uuids:
+        loaded = _load(Q(id__in=wanted_ids) | Q(uuid__in=unknown_uuids))
+        found.update(loaded)
+        uuid_ids.update({row['uuid']: pk for pk, row in loaded.items() if row['uuid'] in unknown_uuids})
+    # A cached pointer to a product deleted since is dropped here
+    return found, {u: pk for u, pk in uuid_ids.items() if pk in found}
+
+
+def invalidate(product_ids, uuids=()):
+    keys = [_key(pk) for pk in set(product_ids)] + [_uuid_key(u) for u in set(uuids)]
+    if keys:
+        # Again after commit, in case a reader re-cached the old rows meanwhile
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
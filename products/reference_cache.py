@@ -0,0 +1,165 @@
+"""
+Versioned cache for small, read-mostly reference lists (categories, units).
+
+Each list has a version token and a last-modified time, and the serialized
+payload is held in process. When ``REFERENCE_CACHE_ALIAS`` names a shared
+Django cache backend the version lives there, so every worker sees an
+invalidation made by any other; model save/delete signals bump it once the
+transaction commits, and conditional GETs are answered from the version alone,
+without loading the list.
+
+Without a shared cache there is no way to tell other processes (or the job
+worker's writes) about a change, so the version is derived from the database
+instead: a digest of the list, and its newest row stamp as last-modified,
+reloaded every REFERENCE_CACHE_LOCAL_TTL seconds. Workers agree on validators
+for the same data and go stale for at most that long; an invalidation made in
+this process still applies at once.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from BuildStock import db_router
+
+KEY_PREFIX = 'buildstock:reference'
+
+
+class ReferenceCache:
+    def __init__(self, name, loader, modified=None):
+        self.name = name
+        self.loader = loader
+        # Newest database stamp of the list (epoch seconds or None), for the local fallback
+        self.modified = modified
+        self._lock = threading.Lock()
+        self._entry = None
+        self._expires = 0
+        self._generation = 0
+
+    @property
+    def _shared(self):
+        alias = getattr(settings, 'REFERENCE_CACHE_ALIAS', None)
+        return caches[alias] if alias else None
+
+    @property
+    def _key(self):
+        return f'{KEY_PREFIX}:{self.name}'
+
+    @staticmethod
+    def _new_state():
+        return (uuid.uuid4().hex, int(time.time()))
+
+    def _local_state(self):
+        with self._lock:
+            if self._entry is not None and time.monotonic() < self._expires:
+                return self._entry[0]
+            generation = self._generation
+        payload = self.loader()
+        last_modified = self.modified() if self.modified else None
+        body = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+        state = (hashlib.md5(body.encode(), usedforsecurity=False).hexdigest(), last_modified)
+        with self._lock:
+            # An invalidation while loading: the next call reloads
+            if generation == self._generation:
+                self._entry = (state, payload)
+                self._expires = time.monotonic() + settings.REFERENCE_CACHE_LOCAL_TTL
+        return state
+
+    def state(self):
+        """
+        (version, last_modified timestamp or None); from the shared cache without touching
+        the database, or from the database at most every REFERENCE_CACHE_LOCAL_TTL seconds
+        """
+        shared = self._shared
+        if shared is None:
+            return self._local_state()
+        state = shared.get(self._key)
+        if state is None:
+            shared.add(self._key, self._new_state(), timeout=None)
+            state = shared.get(self._key)
+        return tuple(state)
+
+    def get(self):
+        """
+        The cached payload for the current version, loading it if needed
+        """
+        state = self.state()
+        entry = self._entry
+        if entry is not None and entry[0] == state:
+            return entry[1]
+        payload = self.loader()
+        if self._shared is not None:
+            self._entry = (state, payload)
+        return payload
+
+    def invalidate(self):
+        shared = self._shared
+        with self._lock:
+            self._entry = None
+            self._generation += 1
+        if shared is not None:
+            shared.set(self._key, self._new_state(), timeout=None)
+
+
+def conditional_response(request, cache, build_response, variant=''):
+    """
+    Answer ``request`` (a negotiated DRF Request) with 304 when its validators match
+    ``cache``; otherwise call ``build_response(payload)`` and add ETag/Last-Modified.
+    ``variant`` separates representations of the same list (e.g. different pages);
+    the negotiated media type (JSON, MessagePack) is part of it too.
+    """
+    version, last_modified = cache.state()
+    variant = f'{request.accepted_media_type} {variant}'
+    digest = hashlib.md5(variant.encode(), usedforsecurity=False).hexdigest()[:8] if variant else ''
+    etag = f'"{cache.name}-{version}{"-" + digest if digest else ""}"'
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        patch_vary_headers(not_modified, ['Accept'])
+        return not_modified
+
+    response = build_response(cache.get())
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+# Loaded from the primary: a lagging replica would cache the old list under the new version
+@db_router.primary()
+def _load_categories():
+    from .models import ProductCategory
+    from .serializers import ProductCategorySerializer
+    return list(ProductCategorySerializer(ProductCategory.objects.order_by('name'), many=True).data)
+
+
+@db_router.primary()
+def _load_units():
+    from .models import Unit
+    from .serializers import UnitSerializer
+    return list(UnitSerializer(Unit.objects.order_by('name'), many=True).data)
+
+
+@db_router.primary()
+def _units_modified():
+    from .models import Tombstone, Unit
+    stamps = [
+        Unit.objects.aggregate(stamp=Max('updated_at'))['stamp'],
+        Tombstone.objects.filter(kind=Tombstone.UNIT).aggregate(stamp=Max('deleted_at'))['stamp'],
+    ]
+    stamps = [stamp for stamp in stamps if stamp is not None]
+    return int(max(stamps).timestamp()) if stamps else None
+
+
+# Categories carry no row stamps: without a shared cache they are validated by ETag only
+categories = ReferenceCache('categories', _load_categories)
+units = ReferenceCache('units', _load_units, modified=_units_modified)
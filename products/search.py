@@ -0,0 +1,134 @@
+"""
+Indexed product search.
+
+PostgreSQL: a generated ``search_vector`` tsvector column with a GIN index,
+plus a pg_trgm index on ``name`` for typo-tolerant matches.
+SQLite: an FTS5 external-content table kept in sync by triggers.
+Other backends fall back to ``icontains``.
+"""
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'products_product_fts'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_SETUP = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description,
+        content='products_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description ON products_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+SQLITE_TEARDOWN = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+POSTGRES_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """ALTER TABLE products_product ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+        ) STORED""",
+    "CREATE INDEX IF NOT EXISTS products_product_search_vector_gin ON products_product USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS products_product_name_trgm ON products_product USING GIN (name gin_trgm_ops)",
+]
+
+POSTGRES_TEARDOWN = [
+    "DROP INDEX IF EXISTS products_product_name_trgm",
+    "DROP INDEX IF EXISTS products_product_search_vector_gin",
+    "ALTER TABLE products_product DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def install(connection):
+    """
+    Create (or repair) the search index for this connection. Idempotent.
+
+    On SQLite, Django rebuilds a table on most ALTERs, which drops its
+    triggers; when that happened the FTS index is rebuilt from scratch.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+                [f'{FTS_TABLE}_%'],
+            )
+            intact = cursor.fetchone()[0] == 3
+            for sql in SQLITE_SETUP:
+                cursor.execute(sql)
+            if not intact:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == 'postgresql':
+            for sql in POSTGRES_SETUP:
+                cursor.execute(sql)
+
+
+def uninstall(connection):
+    statements = {'sqlite': SQLITE_TEARDOWN, 'postgresql': POSTGRES_TEARDOWN}.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def _tokens(query):
+    return _TOKEN_RE.findall(query.lower())
+
+
+def search(queryset, query):
+    """
+    Filter ``queryset`` to products matching ``query`` and annotate ``search_rank``
+    (higher is better). Every term is matched as a prefix so partial input works.
+    """
+    tokens = _tokens(query)
+    if not tokens:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    vendor = connections[queryset.db].vendor
+    table = queryset.model._meta.db_table
+
+    if vendor == 'sqlite':
+        match = ' '.join(f'"{t}"*' for t in tokens)
+        return queryset.annotate(
+            search_rank=RawSQL(
+                f"SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id",
+                [match],
+                output_field=FloatField(),
+            )
+        ).filter(id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]))
+
+    if vendor == 'postgresql':
+        tsquery = ' & '.join(f'{t}:*' for t in tokens)
+        return queryset.annotate(
+            search_rank=RawSQL(
+                f"ts_rank({table}.search_vector, to_tsquery('simple', %s)) + similarity({table}.name, %s)",
+                [tsquery, query],
+                output_field=FloatField(),
+            )
+        ).filter(id__in=RawSQL(
+            f"SELECT id FROM {table} WHERE search_vector @@ to_tsquery('simple', %s) OR name %% %s",
+            [tsquery, query],
+        ))
+
+    return queryset.filter(
+        Q(name__icontains=query) | Q(description__icontains=query)
+    ).annotate(search_rank=Value(0.0, output_field=FloatField()))
@@ -0,0 +1,135 @@
+"""
+Synthetic catalog generator for load tests and benchmarks.
+
+The same ``seed`` always produces the same catalog. Category sizes follow a
+Zipf-like curve (a few large categories, a long tail), most products have one
+or two secondary units with the usual building-trade factors, and description
+lengths vary from empty to a few sentences. Rows are written with
+``bulk_create`` in batches; categories and units that already exist by name
+are reused, and a new unit whose symbol another unit already has gets a
+numbered one (``pc2``).
+"""
+import random
+
+from django.db import transaction
+
+from . import reference_cache
+from .models import Product, ProductCategory, ProductUnit, Unit
+
+DEFAULT_BATCH_SIZE = 1000
+
+UNIT_POOL = [
+    ('Kilogram', 'kg'), ('Sack', 'sac'), ('Tonne', 't'), ('Piece', 'pc'), ('Bag', 'bag'),
+    ('Carton', 'ctn'), ('Litre', 'L'), ('Metre', 'm'), ('Square metre', 'm2'), ('Cubic metre', 'm3'),
+    ('Pallet', 'pal'), ('Roll', 'roll'), ('Box', 'box'), ('Bundle', 'bdl'), ('Drum', 'drum'),
+    ('Sheet', 'sht'), ('Bar', 'bar'), ('Gram', 'g'), ('Bucket', 'bkt'), ('Truck load', 'tl'),
+]
+CATEGORY_POOL = [
+    'Cement', 'Steel', 'Sand & Gravel', 'Bricks & Blocks', 'Timber', 'Plumbing', 'Electrical',
+    'Paint', 'Tiles', 'Roofing', 'Insulation', 'Hardware', 'Tools', 'Doors & Windows', 'Adhesives',
+]
+MATERIALS = [
+    'Cement', 'Rebar', 'Sand', 'Gravel', 'Brick', 'Block', 'Plank', 'Pipe', 'Cable', 'Paint',
+    'Tile', 'Sheet', 'Nail', 'Screw', 'Glue', 'Plaster', 'Mortar', 'Beam', 'Panel', 'Membrane',
+]
+QUALIFIERS = ['Grey', 'White', 'Heavy duty', 'Standard', 'Premium', 'Galvanized', 'Treated', 'Fine', 'Coarse', 'Reinforced']
+SIZES = ['6 mm', '8 mm', '10 mm', '12 mm', '25 kg', '50 kg', '2 m', '3 m', '20 L', '1 in', '15x20', '40x40']
+WORDS = (
+    "durable resistant interior exterior waterproof standard grade for masonry concrete "
+    "finishing load bearing walls floors roofs quick setting low shrinkage certified"
+).split()
+# (number of secondary units, weight)
+SECONDARY_COUNTS = [(0, 20), (1, 40), (2, 25), (3, 10), (4, 5)]
+FACTORS = [0.5, 0.25, 5, 10, 12, 20, 25, 50, 100, 1000]
+
+
+def _pool(pool, count, make_extra):
+    return [pool[i] if i < len(pool) else make_extra(i) for i in range(count)]
+
+
+def _get_or_create(model, rows, key, batch_size):
+    existing = {getattr(obj, key): obj for obj in model.objects.filter(**{f'{key}__in': [getattr(r, key) for r in rows]})}
+    missing = [row for row in rows if getattr(row, key) not in existing]
+    model.objects.bulk_create(missing, batch_size=batch_size)
+    return [existing.get(getattr(row, key), row) for row in rows]
+
+
+def _free_symbols(rows):
+    """
+    Renumber the symbols of units to be created that an existing unit already uses
+    """
+    existing = set(Unit.objects.filter(name__in=[row.name for row in rows]).values_list('name', flat=True))
+    taken = set(Unit.objects.values_list('symbol', flat=True))
+    max_length = Unit._meta.get_field('symbol').max_length
+    for row in rows:
+        if row.name in existing:
+            continue
+        symbol, n = row.symbol, 1
+        while row.symbol in taken:
+            n += 1
+            row.symbol = f'{symbol[:max_length - len(str(n))]}{n}'
+        taken.add(row.symbol)
+    return rows
+
+
+def _description(rng):
+    if rng.random() < 0.15:
+        return None
+    sentences = [' '.join(rng.choices(WORDS, k=rng.randint(4, 12))).capitalize() + '.' for _ in range(rng.randint(1, 5))]
+    return ' '.join(sentences)
+
+
+@transaction.atomic
+def seed_catalog(categories=15, units=20, products=1000, seed=1, batch_size=DEFAULT_BATCH_SIZE, tag='S'):
+    """
+    Create a synthetic catalog; returns the number of rows of each model it uses.
+
+    Product names end with ``#<tag><seed>-<n>``, so catalogs with another tag or seed can coexist.
+    """
+    rng = random.Random(seed)
+
+    category_rows = _get_or_create(ProductCategory, [
+        ProductCategory(name=name)
+        for name in _pool(CATEGORY_POOL, categories, lambda i: f'Category {i:03d}')
+    ], 'name', batch_size)
+    unit_rows = _get_or_create(Unit, _free_symbols([
+        Unit(name=name, symbol=symbol)
+        for name, symbol in _pool(UNIT_POOL, units, lambda i: (f'Unit {i:03d}', f'u{i:03d}'))
+    ]), 'name', batch_size)
+    category_weights = [1 / (rank + 1) for rank in range(len(category_rows))]
+    counts, count_weights = zip(*SECONDARY_COUNTS)
+
+    created_products = created_units = 0
+    for start in range(0, products, batch_size):
+        batch, product_units = [], []
+        for i in range(start, min(start + batch_size, products)):
+            product = Product(
+                name=f'{rng.choice(MATERIALS)} {rng.choice(QUALIFIERS)} {rng.choice(SIZES)} #{tag}{seed}-{i:06d}',
+                description=_description(rng),
+                category=rng.choices(category_rows, category_weights)[0] if rng.random() < 0.95 else None,
+                is_active=rng.random() < 0.92,
+                stock_quantity=int(rng.lognormvariate(5, 1.5)),
+            )
+            chosen = rng.sample(unit_rows, min(len(unit_rows), 1 + rng.choices(counts, count_weights)[0]))
+            batch.append(product)
+            product_units.append(ProductUnit(product=product, unit=chosen[0], is_base=True, conversion_factor=1.0))
+            product_units += [
+                ProductUnit(product=product, unit=unit, conversion_factor=rng.choice(FACTORS))
+                for unit in chosen[1:]
+            ]
+        if Product.objects.filter(name__in=[product.name for product in batch]).exists():
+            raise ValueError(f"A catalog was already seeded with seed {seed}; use another --seed.")
+        Product.objects.bulk_create(batch)
+        ProductUnit.objects.bulk_create(product_units, batch_size=batch_size)
+        created_products += len(batch)
+        created_units += len(product_units)
+
+    # bulk_create sends no signals
+    transaction.on_commit(reference_cache.categories.invalidate)
+    transaction.on_commit(reference_cache.units.invalidate)
+    return {
+        'categories': len(category_rows),
+        'units': len(unit_rows),
+        'products': created_products,
+        'product_units': created_units,
+    }
@@ -1,16 +1,32 @@
+import math
+
 from django.db import transaction
 from rest_framework import serializers
-from .models import Product, ProductCategory, ProductUnit, Unit
+from .models import CategorySummary, Product, ProductCategory, ProductUnit, StockMovement, Unit, units_prefetch
+from .bulk import FILTER_FIELDS
+from .sparse_fields import SparseFieldsetMixin
+from .units import UnitSyncPlan
 
 # --- Product Category ---
-class ProductCategorySerializer(serializers.ModelSerializer):
+class ProductCategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = ProductCategory
         fields = ['uuid', 'name', 'description']
 
 
+class CategorySummarySerializer(serializers.ModelSerializer):
+    uuid = serializers.UUIDField(source='category.uuid', read_only=True)
+    name = serializers.CharField(source='category.name', read_only=True)
+
+    class Meta:
+        model = CategorySummary
+        fields = ['uuid', 'name', 'product_count', 'active_product_count', 'stock_total']
+
+
 # --- Unit ---
-class UnitSerializer(serializers.ModelSerializer):
+class UnitSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    sparse_always = ('name',)
+
     class Meta:
         model = Unit
         fields = ['uuid', 'name', 'symbol']
@@ -18,7 +34,17 @@ class UnitSerializer(serializers.ModelSerializer):
 
 
 # --- Product ---
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    # What each output field needs from the database, for ?fields= / ?exclude=
+    sparse_columns = {
+        'category_name': ['category', 'category__name'],
+        'base_unit': [],
+        'secondary_units_details': [],
+    }
+    sparse_select_related = {'category_name': 'category'}
+    sparse_prefetch = {'base_unit': units_prefetch, 'secondary_units_details': units_prefetch}
+    sparse_always = ('name',)
+
     category_name = serializers.CharField(source='category.name', read_only=True)
     base_unit_id = serializers.PrimaryKeyRelatedField(
         queryset=Unit.objects.all(),
@@ -37,20 +63,39 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = [
-            'uuid', 'name', 'description', 'is_active',
+            'uuid', 'name', 'description', 'is_active', 'stock_quantity',
             'category', 'category_name',
             'base_unit_id', 'secondary_units',
             'base_unit', 'secondary_units_details'
         ]
-        read_only_fields = ['uuid', 'base_unit', 'secondary_units_details']
+        read_only_fields = ['uuid', 'stock_quantity', 'base_unit', 'secondary_units_details']
 
     # --- Validation ---
+    def validate_secondary_units(self, value):
+        for su in value:
+            if 'unit_id' not in su:
+                raise serializers.ValidationError("Each secondary unit needs a unit_id.")
+            try:
+                factor = float(su.get('conversion_factor', 1))
+            except (TypeError, ValueError):
+                raise serializers.ValidationError(f"Invalid conversion factor for unit {su['unit_id']}.")
+            if not math.isfinite(factor) or factor <= 0:
+                raise serializers.ValidationError(f"Conversion factor for unit {su['unit_id']} must be positive.")
+            su['conversion_factor'] = factor
+        return value
+
     def validate(self, attrs):
-        base_unit = attrs['base_unit_id']
+        # Absent on a partial update that leaves the units alone
+        base_unit = attrs.get('base_unit_id')
         secondary_units = attrs.get('secondary_units', [])
         secondary_unit_ids = [u['unit_id'] for u in secondary_units]
 
-        if base_unit.id in secondary_unit_ids:
+        if base_unit is None and secondary_unit_ids and self.instance is not None:
+            # The base unit is kept: it must not come back as a secondary
+            base_unit_id = self.instance.units.filter(is_base=True).values_list('unit_id', flat=True).first()
+        else:
+            base_unit_id = base_unit.id if base_unit else None
+        if base_unit_id in secondary_unit_ids:
             raise serializers.ValidationError(
                 "Base unit cannot be included in secondary units."
             )
@@ -61,34 +106,32 @@ class ProductSerializer(serializers.ModelSerializer):
         return attrs
 
     # --- Create Product ---
+    @transaction.atomic
     def create(self, validated_data):
         base_unit = validated_data.pop('base_unit_id')
         secondary_units = validated_data.pop('secondary_units', [])
 
         product = Product.objects.create(**validated_data)
 
-        # Base unit
-        ProductUnit.objects.create(
-            product=product,
-            unit=base_unit,
-            is_base=True,
-            conversion_factor=1
+        ProductUnit.objects.bulk_create(
+            [ProductUnit(product=product, unit=base_unit, is_base=True, conversion_factor=1)]
+            + [
+                ProductUnit(
+                    product=product,
+                    unit_id=su['unit_id'],
+                    conversion_factor=su.get('conversion_factor', 1),
+                    is_base=False
+                )
+                for su in secondary_units
+            ]
         )
 
-        # Secondary units
-        for su in secondary_units:
-            ProductUnit.objects.create(
-                product=product,
-                unit_id=su['unit_id'],
-                conversion_factor=su.get('conversion_factor', 1),
-                is_base=False
-            )
-
         return product
 
     # --- SerializerMethodFields ---
+    # Both read obj.units.all() so a Product.objects.with_units() prefetch is reused
     def get_base_unit(self, obj):
-        pu = obj.units.filter(is_base=True).first()
+        pu = next((pu for pu in obj.units.all() if pu.is_base), None)
         if pu:
             return {"id": pu.unit.id, "name": pu.unit.name, "symbol": pu.unit.symbol}
         return None
@@ -101,44 +144,152 @@ class ProductSerializer(serializers.ModelSerializer):
                 "symbol": pu.unit.symbol,
                 "conversion_factor": pu.conversion_factor
             }
-            for pu in obj.units.filter(is_base=False)
+            for pu in obj.units.all() if not pu.is_base
         ]
 
+    # --- Units sync ---
+    def _sync_units(self, instance, base_unit, secondary_units):
+        plan = UnitSyncPlan()
+        plan.add(
+            instance,
+            ProductUnit.objects.filter(product=instance),
+            base_unit_id=base_unit.id if base_unit else None,
+            secondary_units=None if secondary_units is None else [
+                (su['unit_id'], su.get('conversion_factor', 1)) for su in secondary_units
+            ],
+        )
+        plan.apply()
+
     # --- Update Product ---
     @transaction.atomic
     def update(self, instance, validated_data):
         base_unit = validated_data.pop('base_unit_id', None)
         secondary_units = validated_data.pop('secondary_units', None)
 
-        # Update product fields
+        # Update product fields; only the changed columns are written so a
+        # concurrent stock movement on stock_quantity is never overwritten
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
-        instance.save()
-
-        if base_unit:
-            ProductUnit.objects.filter(product=instance, is_base=True).update(is_base=False)
-            ProductUnit.objects.update_or_create(
-                product=instance,
-                unit=base_unit,
-                defaults={'is_base': True, 'conversion_factor': 1}
-            )
+        if validated_data:
+            instance.save(update_fields=list(validated_data))
+
+        if base_unit or secondary_units is not None:
+            self._sync_units(instance, base_unit, secondary_units)
+
+        return instance
+
+
+# --- Stock movements ---
+class StockMovementSerializer(serializers.ModelSerializer):
+    unit_id = serializers.IntegerField(source='product_unit.unit_id', read_only=True, default=None)
+
+    class Meta:
+        model = StockMovement
+        fields = [
+            'uuid', 'product', 'unit_id', 'movement_type',
+            'quantity', 'base_quantity', 'note', 'created_by', 'created_at'
+        ]
+        read_only_fields = fields
+
+
+class StockMovementLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    unit_id = serializers.IntegerField()
+    movement_type = serializers.ChoiceField(choices=StockMovement.TYPE_CHOICES)
+    quantity = serializers.DecimalField(max_digits=14, decimal_places=3)
+    note = serializers.CharField(max_length=255, required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        if attrs['movement_type'] == StockMovement.ADJUST:
+            if attrs['quantity'] == 0:
+                raise serializers.ValidationError("Adjustment quantity cannot be zero.")
+        elif attrs['quantity'] <= 0:
+            raise serializers.ValidationError("Quantity must be positive for in/out movements.")
+        return attrs
 
-        # --- Sync secondary units ---
-        if secondary_units is not None:
-            existing_units = {pu.unit_id: pu for pu in instance.units.filter(is_base=False)}
-            incoming_ids = []
-
-            for su in secondary_units:
-                unit_id = su['unit_id']
-                incoming_ids.append(unit_id)
-                ProductUnit.objects.update_or_create(
-                    product=instance,
-                    unit_id=unit_id,
-                    defaults={'conversion_factor': su.get('conversion_factor', 1), 'is_base': False}
-                )
 
-            for unit_id, pu in existing_units.items():
-                if unit_id not in incoming_ids:
-                    pu.delete()
+class StockMovementBatchSerializer(serializers.Serializer):
+    MAX_LINES = 10000
 
-        return instance
\ No newline at end of file
+    movements = StockMovementLineSerializer(many=True, allow_empty=False, max_length=MAX_LINES)
+
+
+# --- Bulk product updates ---
+class ProductBulkFieldsSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=Product._meta.get_field('name').max_length, required=False)
+    description = serializers.CharField(allow_blank=True, allow_null=True, required=False)
+    is_active = serializers.BooleanField(required=False)
+    category = serializers.IntegerField(allow_null=True, required=False)
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError("Set at least one field.")
+        return attrs
+
+
+class ProductBulkItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    fields = ProductBulkFieldsSerializer()
+
+
+class ProductBulkFilterSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    category = serializers.IntegerField(allow_null=True, required=False)
+    is_active = serializers.BooleanField(required=False)
+    search = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        # An empty filter would update the whole catalog
+        if not attrs:
+            raise serializers.ValidationError("Give at least one filter.")
+        return attrs
+
+
+class ProductBulkUpdateSerializer(serializers.Serializer):
+    MAX_ITEMS = 5000
+
+    items = ProductBulkItemSerializer(many=True, required=False, allow_empty=False, max_length=MAX_ITEMS)
+    filter = ProductBulkFilterSerializer(required=False)
+    fields = ProductBulkFieldsSerializer(required=False)
+
+    def validate(self, attrs):
+        if ('items' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError("Send either items or filter.")
+        if 'filter' in attrs:
+            if 'fields' not in attrs:
+                raise serializers.ValidationError({'fields': ["Required with filter."]})
+            unsupported = set(attrs['fields']) - set(FILTER_FIELDS)
+            if unsupported:
+                raise serializers.ValidationError({'fields': [f"Cannot be set with a filter: {', '.join(sorted(unsupported))}."]})
+        elif 'fields' in attrs:
+            raise serializers.ValidationError({'fields': ["Set fields per item."]})
+        return attrs
+
+
+# --- Unit conversions ---
+class ConversionItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    from_unit_id = serializers.IntegerField()
+    to_unit_id = serializers.IntegerField()
+    quantity = serializers.DecimalField(max_digits=24, decimal_places=9)
+
+
+class ConversionBatchSerializer(serializers.Serializer):
+    MAX_ITEMS = 5000
+
+    conversions = ConversionItemSerializer(many=True, allow_empty=False, max_length=MAX_ITEMS)
+
+
+class ProductLookupSerializer(serializers.Serializer):
+    MAX_ITEMS = 500
+
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    uuids = serializers.ListField(child=serializers.UUIDField(), required=False, default=list)
+
+    def validate(self, attrs):
+        total = len(attrs['ids']) + len(attrs['uuids'])
+        if not total:
+            raise serializers.ValidationError("Provide at least one id or uuid.")
+        if total > self.MAX_ITEMS:
+            raise serializers.ValidationError(f"At most {self.MAX_ITEMS} ids and uuids per request.")
+        return attrs
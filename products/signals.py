@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import conversion, product_cache, reference_cache
+from .models import Product, ProductCategory, ProductUnit, Unit
+
+
+@receiver([post_save, post_delete], sender=ProductCategory)
+def invalidate_categories(sender, **kwargs):
+    transaction.on_commit(reference_cache.categories.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Unit)
+def invalidate_units(sender, **kwargs):
+    transaction.on_commit(reference_cache.units.invalidate)
+
+
+@receiver([post_save, post_delete], sender=ProductUnit)
+def invalidate_conversions(sender, instance, **kwargs):
+    conversion.invalidate([instance.product_id])
+    # Cached products embed their units; unit deletes cascade through here too
+    product_cache.invalidate([instance.product_id])
+
+
+@receiver(post_save, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    product_cache.invalidate([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def forget_product(sender, instance, **kwargs):
+    # The id can be reused on SQLite, so the uuid pointer goes too
+    product_cache.invalidate([instance.pk], [instance.uuid])
+
+
+@receiver(post_save, sender=ProductCategory)
+def invalidate_category_products(sender, instance, created, **kwargs):
+    # Cached products embed category_name
+    if not created:
+        product_cache.invalidate(instance.products.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=ProductCategory)
+def collect_category_products(sender, instance, **kwargs):
+    # Products are detached with SET_NULL, an UPDATE that sends no signals
+    instance._product_ids = list(instance.products.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=ProductCategory)
+def invalidate_deleted_category_products(sender, instance, **kwargs):
+    product_cache.invalidate(getattr(instance, '_product_ids', ()))
+
+
+@receiver(post_save, sender=Unit)
+def invalidate_unit_products(sender, instance, created, **kwargs):
+    # Cached products embed unit names and symbols
+    if not created:
+        product_cache.invalidate(instance.product_units.values_list('product_id', flat=True))
@@ -0,0 +1,83 @@
+"""
+Sparse fieldsets: ``?fields=uuid,name`` / ``?exclude=description`` on list endpoints.
+
+The selection drops serializer fields and, through ``narrow_queryset``, limits
+the SQL columns with ``.only()`` and skips joins/prefetches no requested field
+needs.
+"""
+from rest_framework.exceptions import ValidationError
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin. Subclasses may describe what each output field needs:
+
+    - ``sparse_columns``: field -> model column paths for ``.only()`` (default: the field name)
+    - ``sparse_select_related``: field -> relation to join
+    - ``sparse_prefetch``: field -> callable returning a ``Prefetch``
+    - ``sparse_always``: columns always loaded (e.g. the cursor pagination key)
+    """
+    sparse_columns = {}
+    sparse_select_related = {}
+    sparse_prefetch = {}
+    sparse_always = ()
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def readable_fields(cls):
+        return [name for name, field in cls().fields.items() if not field.write_only]
+
+    @classmethod
+    def narrow_queryset(cls, queryset, fields):
+        columns = set(cls.sparse_always)
+        select_related = set()
+        prefetches = {}
+        for name in fields:
+            columns.update(cls.sparse_columns.get(name, [name]))
+            if name in cls.sparse_select_related:
+                select_related.add(cls.sparse_select_related[name])
+            if name in cls.sparse_prefetch:
+                prefetch = cls.sparse_prefetch[name]()
+                prefetches[prefetch.prefetch_to] = prefetch
+        queryset = queryset.only(*columns)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches.values())
+        return queryset
+
+
+def _split(value):
+    return [name for name in (part.strip() for part in value.split(',')) if name]
+
+
+def get_sparse_fields(request, serializer_class):
+    """
+    Ordered list of selected output fields, or None when the request selects everything
+    """
+    fields_param = request.query_params.get('fields')
+    exclude_param = request.query_params.get('exclude')
+    if not fields_param and not exclude_param:
+        return None
+
+    readable = serializer_class.readable_fields()
+    selected = _split(fields_param) if fields_param else list(readable)
+    excluded = set(_split(exclude_param or ''))
+    unknown = [name for name in [*selected, *excluded] if name not in readable]
+    if unknown:
+        raise ValidationError({'fields': [f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(readable)}."]})
+    return [name for name in selected if name not in excluded]
+
+
+def trim(rows, fields):
+    """
+    Apply a selection to already serialized rows (e.g. from a cache)
+    """
+    if fields is None:
+        return rows
+    return [{name: row[name] for name in fields} for row in rows]
@@ -0,0 +1,163 @@
+"""
+Batch application of stock movements.
+
+Lines are converted to base units in memory, netted per product and applied
+with set-based ``F()`` updates (one UPDATE per chunk of products) inside a
+single transaction. Decreases and increases carry their guard in the WHERE
+clause, so no row is read or locked up front and stock can never go negative
+or past what ``stock_quantity`` can hold.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, F, Value, When
+
+from . import product_cache
+from .models import Product, ProductUnit, StockMovement
+
+UPDATE_CHUNK_SIZE = 500
+# PositiveIntegerField's upper bound on every supported database
+MAX_STOCK_QUANTITY = 2147483647
+# Failed guards re-checked against balances that no longer fail them (changed concurrently)
+APPLY_ATTEMPTS = 3
+
+
+class StockError(Exception):
+    """
+    Raised when a batch cannot be applied; ``errors`` is a list of per-line/per-product dicts
+    """
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def to_base_quantity(movement_type, quantity, conversion_factor):
+    """
+    Signed change in base units, or None if it is not a whole number of base units
+    """
+    base = quantity * Decimal(str(conversion_factor))
+    if base != base.to_integral_value():
+        return None
+    base = int(base)
+    return -base if movement_type == StockMovement.OUT else base
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _delta_case(deltas):
+    return Case(
+        *[When(id=product_id, then=Value(delta)) for product_id, delta in deltas],
+        output_field=BigIntegerField(),
+    )
+
+
+class _GuardFailed(Exception):
+    pass
+
+
+def _apply_net(increases, decreases):
+    for chunk in _chunks(increases, UPDATE_CHUNK_SIZE):
+        added = _delta_case(chunk)
+        updated = Product.objects.filter(
+            id__in=[pid for pid, _ in chunk],
+            stock_quantity__lte=MAX_STOCK_QUANTITY - added,
+        ).update(stock_quantity=F('stock_quantity') + added)
+        if updated != len(chunk):
+            raise _GuardFailed()
+    for chunk in _chunks(decreases, UPDATE_CHUNK_SIZE):
+        needed = _delta_case([(pid, -delta) for pid, delta in chunk])
+        updated = Product.objects.filter(
+            id__in=[pid for pid, _ in chunk],
+            stock_quantity__gte=needed,
+        ).update(stock_quantity=F('stock_quantity') - needed)
+        if updated != len(chunk):
+            raise _GuardFailed()
+
+
+def _guard_errors(net):
+    """
+    Per-product errors for the changes in ``net`` that current balances cannot take
+    """
+    errors = []
+    for pid, qty in sorted(Product.objects.filter(id__in=list(net)).values_list('id', 'stock_quantity')):
+        delta = net[pid]
+        if qty + delta < 0:
+            errors.append({'product_id': pid, 'error': "Insufficient stock.", 'available': qty, 'requested': -delta})
+        elif qty + delta > MAX_STOCK_QUANTITY:
+            errors.append({
+                'product_id': pid, 'error': f"Stock cannot exceed {MAX_STOCK_QUANTITY} base units.",
+                'available': qty, 'requested': delta
+            })
+    return errors
+
+
+def apply_movements(lines, user=None):
+    """
+    Apply validated lines ({product_id, unit_id, movement_type, quantity, note}).
+    Returns the created StockMovement objects and the new balances by product id.
+    """
+    keys = {(line['product_id'], line['unit_id']) for line in lines}
+    product_units = {
+        (pu.product_id, pu.unit_id): pu
+        for pu in ProductUnit.objects.filter(
+            product_id__in={k[0] for k in keys},
+            unit_id__in={k[1] for k in keys},
+        ).only('id', 'product_id', 'unit_id', 'conversion_factor')
+    }
+
+    errors = []
+    movements = []
+    net = defaultdict(int)
+    for index, line in enumerate(lines):
+        pu = product_units.get((line['product_id'], line['unit_id']))
+        if pu is None:
+            errors.append({'index': index, 'error': "Unit is not configured for this product."})
+            continue
+        base_quantity = to_base_quantity(line['movement_type'], line['quantity'], pu.conversion_factor)
+        if base_quantity is None:
+            errors.append({'index': index, 'error': "Quantity does not convert to a whole number of base units."})
+            continue
+        net[pu.product_id] += base_quantity
+        movements.append(StockMovement(
+            product_id=pu.product_id,
+            product_unit=pu,
+            movement_type=line['movement_type'],
+            quantity=line['quantity'],
+            base_quantity=base_quantity,
+            note=line.get('note', ''),
+            created_by=user,
+        ))
+    if errors:
+        raise StockError(errors)
+
+    # Sorted by id so concurrent batches take row locks in the same order
+    increases = sorted((pid, d) for pid, d in net.items() if d > 0)
+    decreases = sorted((pid, d) for pid, d in net.items() if d < 0)
+
+    with transaction.atomic():
+        for _ in range(APPLY_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    _apply_net(increases, decreases)
+                break
+            except _GuardFailed:
+                # The savepoint is rolled back, so these are the balances the batch saw
+                errors = _guard_errors(net)
+                if errors:
+                    raise StockError(errors)
+                # Another batch moved the stock back within bounds meanwhile: try again
+        else:
+            raise StockError([
+                {'product_id': pid, 'error': "Stock changed concurrently; retry the batch."}
+                for pid, _ in increases + decreases
+            ])
+        StockMovement.objects.bulk_create(movements, batch_size=1000)
+
+    product_cache.invalidate(net)
+    balances = dict(Product.objects.filter(id__in=list(net)).values_list('id', 'stock_quantity'))
+    return movements, balances
@@ -0,0 +1,269 @@
+"""
+Per-category product counts and stock totals (``CategorySummary``).
+
+The summary is maintained by database triggers, so every write path (API,
+bulk import, set-based stock updates, admin) keeps it current. The triggers
+never update the summary rows themselves: they append signed changes to
+``CategorySummaryDelta``, so concurrent stock batches on products of the same
+category take no shared row locks and cannot deadlock on them. ``fold`` adds
+the pending deltas into the summary rows; every job worker runs it each
+SUMMARY_FOLD_SECONDS (products.tasks), and ``manage.py fold_category_summary``
+runs it by hand. ``with_pending`` reads the rows with whatever is still
+pending added, so reads are exact whenever the fold last ran.
+
+PostgreSQL: statement-level triggers with transition tables append one
+grouped delta per category and statement, whatever the number of products
+it touched.
+SQLite: row-level triggers.
+A new category gets its zeroed summary row from a trigger as well.
+``rebuild`` recomputes everything from ``products_product`` and reports drift.
+"""
+from django.db import connections, transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import CategorySummary, CategorySummaryDelta, ProductCategory
+
+SUMMARY_TABLE = 'products_categorysummary'
+DELTA_TABLE = 'products_categorysummarydelta'
+TRIGGER_PREFIX = 'products_categorysummary'
+# pg_advisory_xact_lock key serializing folds (and rebuilds) with each other
+FOLD_LOCK_ID = 0x53554D4D
+
+_SQLITE_APPEND = f"""INSERT INTO {DELTA_TABLE}(category_id, product_count, active_product_count, stock_total)
+        SELECT %(row)s.category_id, %(sign)s1, %(sign)s%(row)s.is_active, %(sign)s%(row)s.stock_quantity
+        WHERE %(row)s.category_id IS NOT NULL;"""
+
+SQLITE_SETUP = [
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_category_ai AFTER INSERT ON products_productcategory BEGIN
+        INSERT OR IGNORE INTO {SUMMARY_TABLE}(category_id, product_count, active_product_count, stock_total)
+        VALUES (new.id, 0, 0, 0);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_ai AFTER INSERT ON products_product BEGIN
+        {_SQLITE_APPEND % {'row': 'new', 'sign': ''}}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_ad AFTER DELETE ON products_product BEGIN
+        {_SQLITE_APPEND % {'row': 'old', 'sign': '-'}}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_au AFTER UPDATE OF category_id, is_active, stock_quantity ON products_product
+    WHEN old.category_id IS NOT new.category_id OR old.is_active != new.is_active OR old.stock_quantity != new.stock_quantity
+    BEGIN
+        {_SQLITE_APPEND % {'row': 'old', 'sign': '-'}}
+        {_SQLITE_APPEND % {'row': 'new', 'sign': ''}}
+    END""",
+]
+
+# Trigger name suffixes, the same on both backends
+TRIGGERS = ['category_ai', 'ai', 'ad', 'au']
+
+SQLITE_TEARDOWN = [f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_{name}" for name in TRIGGERS]
+
+# Appends the grouped rows of a transition table, added (+) or removed (-)
+_POSTGRES_APPEND = f"""
+    INSERT INTO {DELTA_TABLE}(category_id, product_count, active_product_count, stock_total)
+    SELECT category_id, %(sign)scount(*), %(sign)scount(*) FILTER (WHERE is_active), %(sign)ssum(stock_quantity)
+    FROM %(rows)s WHERE category_id IS NOT NULL GROUP BY category_id;
+"""
+
+_CHANGED = """(
+        SELECT %s.* FROM old_rows o JOIN new_rows n ON n.id = o.id
+        WHERE (o.category_id, o.is_active, o.stock_quantity) IS DISTINCT FROM (n.category_id, n.is_active, n.stock_quantity)
+    ) r"""
+
+POSTGRES_SETUP = [
+    f"""CREATE OR REPLACE FUNCTION {TRIGGER_PREFIX}_category_ai() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO {SUMMARY_TABLE}(category_id, product_count, active_product_count, stock_total)
+        VALUES (NEW.id, 0, 0, 0) ON CONFLICT DO NOTHING;
+        RETURN NULL;
+    END $$""",
+    f"""CREATE OR REPLACE FUNCTION {TRIGGER_PREFIX}_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            -- Only rows whose summarized columns changed
+            {_POSTGRES_APPEND % {'sign': '-', 'rows': _CHANGED % 'o'}}
+            {_POSTGRES_APPEND % {'sign': '', 'rows': _CHANGED % 'n'}}
+        ELSIF TG_OP = 'DELETE' THEN
+            {_POSTGRES_APPEND % {'sign': '-', 'rows': 'old_rows'}}
+        ELSE
+            {_POSTGRES_APPEND % {'sign': '', 'rows': 'new_rows'}}
+        END IF;
+        RETURN NULL;
+    END $$""",
+    f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_category_ai ON products_productcategory",
+    f"""CREATE TRIGGER {TRIGGER_PREFIX}_category_ai AFTER INSERT ON products_productcategory
+        FOR EACH ROW EXECUTE FUNCTION {TRIGGER_PREFIX}_category_ai()""",
+    f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_ai ON products_product",
+    f"""CREATE TRIGGER {TRIGGER_PREFIX}_ai AFTER INSERT ON products_product
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {TRIGGER_PREFIX}_apply()""",
+    f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_ad ON products_product",
+    f"""CREATE TRIGGER {TRIGGER_PREFIX}_ad AFTER DELETE ON products_product
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION {TRIGGER_PREFIX}_apply()""",
+    f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_au ON products_product",
+    f"""CREATE TRIGGER {TRIGGER_PREFIX}_au AFTER UPDATE ON products_product
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {TRIGGER_PREFIX}_apply()""",
+]
+
+POSTGRES_TEARDOWN = [
+    f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_au ON products_product",
+    f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_ad ON products_product",
+    f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_ai ON products_product",
+    f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_category_ai ON products_productcategory",
+    f"DROP FUNCTION IF EXISTS {TRIGGER_PREFIX}_apply()",
+    f"DROP FUNCTION IF EXISTS {TRIGGER_PREFIX}_category_ai()",
+]
+
+
+POPULATE = [
+    f"DELETE FROM {SUMMARY_TABLE}",
+    f"""INSERT INTO {SUMMARY_TABLE}(category_id, product_count, active_product_count, stock_total)
+        SELECT c.id, count(p.id), coalesce(sum(CASE WHEN p.is_active THEN 1 ELSE 0 END), 0), coalesce(sum(p.stock_quantity), 0)
+        FROM products_productcategory c LEFT JOIN products_product p ON p.category_id = c.id
+        GROUP BY c.id""",
+]
+
+_TRIGGER_COUNT = {
+    'sqlite': "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+    'postgresql': "SELECT count(*) FROM pg_trigger WHERE NOT tgisinternal AND tgname LIKE %s",
+}
+
+
+def install(connection):
+    """
+    Create (or repair) the summary triggers for this connection. Idempotent.
+
+    When the triggers were missing (first install, or a SQLite table rebuild
+    dropped them) the summary is recomputed from the products.
+    """
+    setup = {'sqlite': SQLITE_SETUP, 'postgresql': POSTGRES_SETUP}.get(connection.vendor)
+    if setup is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(_TRIGGER_COUNT[connection.vendor], [f'{TRIGGER_PREFIX}_%'])
+        intact = cursor.fetchone()[0] == len(TRIGGERS)
+        for sql in setup:
+            cursor.execute(sql)
+        if not intact:
+            # Absent while migrating through 0005-0006
+            if DELTA_TABLE in connection.introspection.table_names(cursor):
+                cursor.execute(f"DELETE FROM {DELTA_TABLE}")
+            for sql in POPULATE:
+                cursor.execute(sql)
+
+
+def uninstall(connection):
+    statements = {'sqlite': SQLITE_TEARDOWN, 'postgresql': POSTGRES_TEARDOWN}.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+# Moves every committed delta into the summary in one statement: rows inserted
+# by transactions still open are not visible to the DELETE, so none is lost
+_POSTGRES_FOLD = f"""
+    WITH moved AS (
+        DELETE FROM {DELTA_TABLE} RETURNING category_id, product_count, active_product_count, stock_total
+    )
+    UPDATE {SUMMARY_TABLE} s SET
+        product_count = s.product_count + d.products,
+        active_product_count = s.active_product_count + d.active,
+        stock_total = s.stock_total + d.stock
+    FROM (
+        SELECT category_id, sum(product_count) AS products, sum(active_product_count) AS active,
+               sum(stock_total) AS stock
+        FROM moved GROUP BY category_id
+    ) d
+    WHERE s.category_id = d.category_id
+"""
+
+
+def fold(using='default'):
+    """
+    Add the pending deltas into the summary rows and delete them; returns the
+    number of summary rows updated
+    """
+    connection = connections[using]
+    with transaction.atomic(using=using):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [FOLD_LOCK_ID])
+                cursor.execute(_POSTGRES_FOLD)
+                return cursor.rowcount
+
+        # Writers are serialized on SQLite: no delta can commit below ``last`` meanwhile
+        deltas = CategorySummaryDelta.objects.using(using)
+        last = deltas.aggregate(last=Max('id'))['last']
+        if last is None:
+            return 0
+        pending = deltas.filter(id__lte=last).values('category_id').annotate(
+            products=Sum('product_count'), active=Sum('active_product_count'), stock=Sum('stock_total'),
+        )
+        updated = 0
+        for row in pending:
+            updated += CategorySummary.objects.using(using).filter(category_id=row['category_id']).update(
+                product_count=F('product_count') + row['products'],
+                active_product_count=F('active_product_count') + row['active'],
+                stock_total=F('stock_total') + row['stock'],
+            )
+        deltas.filter(id__lte=last).delete()
+        return updated
+
+
+def with_pending(queryset):
+    """
+    The CategorySummary rows of ``queryset`` with their unfolded deltas added, in one query
+    """
+    rows = list(queryset.annotate(
+        pending_products=Sum('category__summary_deltas__product_count'),
+        pending_active=Sum('category__summary_deltas__active_product_count'),
+        pending_stock=Sum('category__summary_deltas__stock_total'),
+    ))
+    for row in rows:
+        row.product_count += row.pending_products or 0
+        row.active_product_count += row.pending_active or 0
+        row.stock_total += row.pending_stock or 0
+    return rows
+
+
+def expected(using='default'):
+    """
+    {category_id: (product_count, active_product_count, stock_total)} computed from the products
+    """
+    rows = ProductCategory.objects.using(using).annotate(
+        n=Count('products'),
+        active=Count('products', filter=Q(products__is_active=True)),
+        stock=Coalesce(Sum('products__stock_quantity'), 0),
+    ).values_list('id', 'n', 'active', 'stock')
+    return {pk: (n, active, stock) for pk, n, active, stock in rows}
+
+
+def rebuild(check_only=False, using='default'):
+    """
+    Compare the summary with the products and fix it unless ``check_only``.
+
+    Returns the drifted rows as {category_id: (stored or None, expected)}.
+    """
+    with transaction.atomic(using=using):
+        # Also takes the fold lock on PostgreSQL, so no fold writes the rows meanwhile
+        fold(using)
+        wanted = expected(using)
+        stored = {
+            row[0]: row[1:]
+            for row in CategorySummary.objects.using(using).select_for_update().values_list(
+                'category_id', 'product_count', 'active_product_count', 'stock_total'
+            )
+        }
+        drift = {pk: (stored.get(pk), values) for pk, values in wanted.items() if stored.get(pk) != values}
+        if drift and not check_only:
+            manager = CategorySummary.objects.using(using)
+            manager.bulk_create(
+                [CategorySummary(category_id=pk, product_count=n, active_product_count=a, stock_total=s)
+                 for pk, (n, a, s) in wanted.items() if pk not in stored],
+            )
+            manager.bulk_update(
+                [CategorySummary(category_id=pk, product_count=values[0], active_product_count=values[1], stock_total=values[2])
+                 for pk, (current, values) in drift.items() if current is not None],
+                ['product_count', 'active_product_count', 'stock_total'],
+                batch_size=500,
+            )
+    return drift
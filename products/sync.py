@@ -0,0 +1,351 @@
+"""
+Delta sync for offline clients ("what changed since my last sync").
+
+``updated_at`` on products and units and the ``Tombstone`` rows for deletions
+are written by database triggers, so every write path (API, bulk import,
+set-based stock updates, admin, cascades) is covered:
+
+- inserting or updating a product or unit stamps it;
+- adding, changing or removing a product unit, renaming a unit used by the
+  product or renaming its category stamps the product (its serialized form
+  embeds them);
+- deleting a product or unit writes a tombstone.
+
+Stamps come from the database clock (clock_timestamp() on PostgreSQL). On
+SQLite they are written in the text format Django uses for datetimes, so
+keyset comparisons against Django parameters stay exact.
+
+``changes`` pages through changed rows and tombstones with an opaque keyset
+cursor on (stamp, id). Stamps are taken when a row is written but become
+visible at commit, so a page never reaches past the oldest write transaction
+still open (``writer_bound``) nor into the last ``SYNC_SETTLE_SECONDS``: a
+long bulk update or import commits early stamps after later, shorter
+transactions and is not skipped. Tombstones older than
+``SYNC_TOMBSTONE_RETENTION_DAYS`` are pruned; a cursor older than that gets
+``CursorExpired`` and the client must start over.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils.dateparse import parse_datetime
+
+from BuildStock import db_router
+
+from .models import Product, Tombstone, Unit
+
+TRIGGER_PREFIX = 'products_sync'
+TOMBSTONE_TABLE = 'products_tombstone'
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 2000
+
+# Same text as str(datetime) for a naive UTC value: no fraction when it is zero
+_SQLITE_STAMP = (
+    "strftime('%Y-%m-%d %H:%M:%S', 'now') || CASE WHEN strftime('%f', 'now') LIKE '%.000' "
+    "THEN '' ELSE substr(strftime('%f', 'now'), 3) || '000' END"
+)
+
+SQLITE_SETUP = [
+    # recursive_triggers is off, so the stamping UPDATE does not fire its own trigger again
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_product_ai AFTER INSERT ON products_product BEGIN
+        UPDATE products_product SET updated_at = {_SQLITE_STAMP} WHERE id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_product_au AFTER UPDATE ON products_product BEGIN
+        UPDATE products_product SET updated_at = {_SQLITE_STAMP} WHERE id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_product_ad AFTER DELETE ON products_product BEGIN
+        INSERT INTO {TOMBSTONE_TABLE}(kind, uuid, deleted_at) VALUES ('product', old.uuid, {_SQLITE_STAMP});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_unit_ai AFTER INSERT ON products_unit BEGIN
+        UPDATE products_unit SET updated_at = {_SQLITE_STAMP} WHERE id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_unit_au AFTER UPDATE ON products_unit BEGIN
+        UPDATE products_unit SET updated_at = {_SQLITE_STAMP} WHERE id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_unit_renamed AFTER UPDATE OF name, symbol ON products_unit BEGIN
+        UPDATE products_product SET updated_at = {_SQLITE_STAMP}
+        WHERE id IN (SELECT product_id FROM products_productunit WHERE unit_id = new.id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_unit_ad AFTER DELETE ON products_unit BEGIN
+        INSERT INTO {TOMBSTONE_TABLE}(kind, uuid, deleted_at) VALUES ('unit', old.uuid, {_SQLITE_STAMP});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_productunit_ai AFTER INSERT ON products_productunit BEGIN
+        UPDATE products_product SET updated_at = {_SQLITE_STAMP} WHERE id = new.product_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_productunit_au AFTER UPDATE ON products_productunit BEGIN
+        UPDATE products_product SET updated_at = {_SQLITE_STAMP} WHERE id IN (old.product_id, new.product_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_productunit_ad AFTER DELETE ON products_productunit BEGIN
+        UPDATE products_product SET updated_at = {_SQLITE_STAMP} WHERE id = old.product_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_category_renamed AFTER UPDATE OF name ON products_productcategory BEGIN
+        UPDATE products_product SET updated_at = {_SQLITE_STAMP} WHERE category_id = new.id;
+    END""",
+]
+
+SQLITE_TRIGGERS = [
+    'product_ai', 'product_au', 'product_ad', 'unit_ai', 'unit_au', 'unit_renamed', 'unit_ad',
+    'productunit_ai', 'productunit_au', 'productunit_ad', 'category_renamed',
+]
+
+SQLITE_TEARDOWN = [f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_{name}" for name in SQLITE_TRIGGERS]
+
+# Products touched by a statement on products_productunit, products_unit or
+# products_productcategory, per TG_TABLE_NAME and TG_OP
+_POSTGRES_TOUCHED = {
+    ('products_productunit', 'INSERT'): "SELECT product_id FROM new_rows",
+    ('products_productunit', 'UPDATE'): "SELECT product_id FROM old_rows UNION SELECT product_id FROM new_rows",
+    ('products_productunit', 'DELETE'): "SELECT product_id FROM old_rows",
+    ('products_unit', 'UPDATE'): """SELECT pu.product_id FROM products_productunit pu
+            JOIN new_rows n ON n.id = pu.unit_id JOIN old_rows o ON o.id = n.id
+            WHERE (o.name, o.symbol) IS DISTINCT FROM (n.name, n.symbol)""",
+    ('products_productcategory', 'UPDATE'): """SELECT p.id FROM products_product p
+            JOIN new_rows n ON n.id = p.category_id JOIN old_rows o ON o.id = n.id
+            WHERE o.name IS DISTINCT FROM n.name""",
+}
+
+_POSTGRES_TOUCH = '\n        ELS'.join(
+    f"IF TG_TABLE_NAME = '{table}' AND TG_OP = '{op}' THEN\n"
+    f"            UPDATE products_product SET updated_at = clock_timestamp() WHERE id IN ({touched});"
+    for (table, op), touched in _POSTGRES_TOUCHED.items()
+)
+
+POSTGRES_SETUP = [
+    f"""CREATE OR REPLACE FUNCTION {TRIGGER_PREFIX}_stamp() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.updated_at := clock_timestamp();
+        RETURN NEW;
+    END $$""",
+    f"""CREATE OR REPLACE FUNCTION {TRIGGER_PREFIX}_tombstone() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO {TOMBSTONE_TABLE}(kind, uuid, deleted_at)
+        SELECT TG_ARGV[0], uuid, clock_timestamp() FROM old_rows;
+        RETURN NULL;
+    END $$""",
+    f"""CREATE OR REPLACE FUNCTION {TRIGGER_PREFIX}_touch_products() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        {_POSTGRES_TOUCH}
+        END IF;
+        RETURN NULL;
+    END $$""",
+]
+
+# (name, table, timing and events, transition tables, level, function call)
+_POSTGRES_TRIGGERS = [
+    ('product_stamp', 'products_product', 'BEFORE INSERT OR UPDATE', '', 'FOR EACH ROW', 'stamp()'),
+    ('product_ad', 'products_product', 'AFTER DELETE', 'REFERENCING OLD TABLE AS old_rows', 'FOR EACH STATEMENT', "tombstone('product')"),
+    ('unit_stamp', 'products_unit', 'BEFORE INSERT OR UPDATE', '', 'FOR EACH ROW', 'stamp()'),
+    ('unit_ad', 'products_unit', 'AFTER DELETE', 'REFERENCING OLD TABLE AS old_rows', 'FOR EACH STATEMENT', "tombstone('unit')"),
+    ('unit_renamed', 'products_unit', 'AFTER UPDATE', 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows', 'FOR EACH STATEMENT', 'touch_products()'),
+    ('productunit_ai', 'products_productunit', 'AFTER INSERT', 'REFERENCING NEW TABLE AS new_rows', 'FOR EACH STATEMENT', 'touch_products()'),
+    ('productunit_au', 'products_productunit', 'AFTER UPDATE', 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows', 'FOR EACH STATEMENT', 'touch_products()'),
+    ('productunit_ad', 'products_productunit', 'AFTER DELETE', 'REFERENCING OLD TABLE AS old_rows', 'FOR EACH STATEMENT', 'touch_products()'),
+    ('category_renamed', 'products_productcategory', 'AFTER UPDATE', 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows', 'FOR EACH STATEMENT', 'touch_products()'),
+]
+
+for _name, _table, _event, _transition, _level, _call in _POSTGRES_TRIGGERS:
+    POSTGRES_SETUP += [
+        f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_{_name} ON {_table}",
+        f"""CREATE TRIGGER {TRIGGER_PREFIX}_{_name} {_event} ON {_table}
+            {_transition} {_level} EXECUTE FUNCTION {TRIGGER_PREFIX}_{_call}""",
+    ]
+
+POSTGRES_TEARDOWN = [
+    f"DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_{name} ON {table}" for name, table, *_ in _POSTGRES_TRIGGERS
+] + [
+    f"DROP FUNCTION IF EXISTS {TRIGGER_PREFIX}_touch_products()",
+    f"DROP FUNCTION IF EXISTS {TRIGGER_PREFIX}_tombstone()",
+    f"DROP FUNCTION IF EXISTS {TRIGGER_PREFIX}_stamp()",
+]
+
+
+def install(connection):
+    """
+    Create (or repair) the sync triggers for this connection. Idempotent.
+    """
+    setup = {'sqlite': SQLITE_SETUP, 'postgresql': POSTGRES_SETUP}.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for sql in setup:
+            cursor.execute(sql)
+
+
+def uninstall(connection):
+    statements = {'sqlite': SQLITE_TEARDOWN, 'postgresql': POSTGRES_TEARDOWN}.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+class CursorError(ValueError):
+    pass
+
+
+class CursorExpired(Exception):
+    """
+    The cursor predates the tombstone retention; the client must sync from scratch
+    """
+
+
+def _serialize_products(products):
+    from .serializers import ProductSerializer
+    return ProductSerializer(products, many=True).data
+
+
+def _serialize_units(units):
+    from .serializers import UnitSerializer
+    return UnitSerializer(units, many=True).data
+
+
+# resource -> (queryset, serializer function, tombstone kind)
+RESOURCES = {
+    'products': (lambda: Product.objects.with_units(), _serialize_products, Tombstone.PRODUCT),
+    'units': (lambda: Unit.objects.all(), _serialize_units, Tombstone.UNIT),
+}
+
+
+def db_now(using='default'):
+    """
+    The database clock, which stamps the rows
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT clock_timestamp()")
+            return cursor.fetchone()[0]
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT strftime('%Y-%m-%d %H:%M:%f', 'now')")
+            return parse_datetime(cursor.fetchone()[0]).replace(tzinfo=dt_timezone.utc)
+    return datetime.now(dt_timezone.utc)
+
+
+def writer_bound(using='default'):
+    """
+    Latest stamp no transaction still in progress can write at or below, or None
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            # pg_stat_activity is snapshotted per transaction
+            cursor.execute("SELECT pg_stat_clear_snapshot()")
+            cursor.execute(
+                "SELECT min(xact_start) FROM pg_stat_activity "
+                "WHERE backend_xid IS NOT NULL AND datname = current_database() AND pid <> pg_backend_pid()"
+            )
+            oldest = cursor.fetchone()[0]
+        # Its stamps come from clock_timestamp(), after xact_start
+        return oldest - timedelta(microseconds=1) if oldest is not None else None
+    if connection.vendor == 'sqlite':
+        # One writer at a time: an open one took the lock after every committed stamp
+        stamps = [
+            Product.objects.using(using).aggregate(stamp=Max('updated_at'))['stamp'],
+            Unit.objects.using(using).aggregate(stamp=Max('updated_at'))['stamp'],
+            Tombstone.objects.using(using).aggregate(stamp=Max('deleted_at'))['stamp'],
+        ]
+        return max((stamp for stamp in stamps if stamp is not None), default=None)
+    return None
+
+
+def encode_cursor(resource, updated, deleted):
+    position = {
+        'r': resource,
+        'u': [updated[0].isoformat(), updated[1]] if updated else None,
+        'd': [deleted[0].isoformat(), deleted[1]],
+    }
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).decode()
+
+
+def _position(value):
+    stamp, pk = value
+    stamp = parse_datetime(stamp)
+    if stamp is None or stamp.tzinfo is None or not isinstance(pk, int):
+        raise CursorError("Invalid cursor.")
+    return stamp, pk
+
+
+def decode_cursor(resource, cursor):
+    """
+    (updated position or None, deleted position) from a cursor of ``resource``
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if position['r'] != resource:
+            raise CursorError("Cursor belongs to another resource.")
+        updated = None if position['u'] is None else _position(position['u'])
+        return updated, _position(position['d'])
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError) as exc:
+        if isinstance(exc, CursorError):
+            raise
+        raise CursorError("Invalid cursor.") from exc
+
+
+def _after(field, position):
+    if position is None:
+        return Q()
+    stamp, pk = position
+    return Q(**{f'{field}__gt': stamp}) | Q(**{field: stamp, 'id__gt': pk})
+
+
+@db_router.primary()
+def changes(resource, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    One page of rows of ``resource`` changed and deleted after ``cursor``.
+
+    Without a cursor every row is returned (a full download) and deletions
+    start from now. Returns {results, deleted, cursor, has_more}; the client
+    keeps ``cursor`` and calls again while ``has_more``.
+    Read from the primary: the settle bound comes from its clock, and a lagging
+    replica would hide rows stamped before it for good.
+    """
+    queryset, serialize, kind = RESOURCES[resource]
+    now = db_now()
+    bound = now - timedelta(seconds=getattr(settings, 'SYNC_SETTLE_SECONDS', 2))
+    writers = writer_bound()
+    if writers is not None:
+        bound = min(bound, writers)
+    if cursor:
+        updated, deleted = decode_cursor(resource, cursor)
+        retention = timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 90))
+        if deleted[0] < now - retention:
+            raise CursorExpired()
+    else:
+        # A fresh client has nothing to delete
+        updated, deleted = None, (bound, 0)
+
+    rows = list(
+        queryset().filter(_after('updated_at', updated), updated_at__lte=bound)
+        .order_by('updated_at', 'id')[:page_size + 1]
+    )
+    tombstones = list(
+        Tombstone.objects.filter(_after('deleted_at', deleted), kind=kind, deleted_at__lte=bound)
+        .order_by('deleted_at', 'id').values_list('deleted_at', 'id', 'uuid')[:page_size + 1]
+    )
+    has_more = len(rows) > page_size or len(tombstones) > page_size
+    rows, tombstones = rows[:page_size], tombstones[:page_size]
+    if rows:
+        updated = (rows[-1].updated_at, rows[-1].id)
+    if tombstones:
+        deleted = tombstones[-1][:2]
+    if len(tombstones) < page_size + 1 and deleted[0] < bound:
+        # Caught up: move to the bound so an idle cursor does not age past the retention
+        deleted = (bound, 0)
+    return {
+        'results': serialize(rows),
+        'deleted': [str(uuid) for _, _, uuid in tombstones],
+        'cursor': encode_cursor(resource, updated, deleted),
+        'has_more': has_more,
+    }
+
+
+def prune(days=None):
+    """
+    Delete tombstones older than the retention; returns how many went
+    """
+    if days is None:
+        days = getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 90)
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=db_now() - timedelta(days=days)).delete()
+    return deleted
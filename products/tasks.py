@@ -0,0 +1,78 @@
+"""
+Background tasks for the heavy product operations (run by ``manage.py run_worker``).
+"""
+import codecs
+import os
+
+from django.conf import settings
+
+from jobs import files
+from jobs.queue import JobError
+from jobs.registry import periodic, task
+
+from . import bulk, exporter, summary
+from .importer import import_products
+from .models import Product
+
+
+@task('products.import')
+def import_file(job, payload):
+    storage = files.storage()
+    with storage.open(payload['file'], 'rb') as upload:
+        result = import_products(
+            codecs.iterdecode(upload, 'utf-8-sig'), payload['file_format'], upsert=payload.get('upsert', False),
+            progress=job.set_progress,
+        )
+    # Kept when the import fails, for inspection
+    storage.delete(payload['file'])
+    return result.as_dict()
+
+
+@task('products.export')
+def export_file(job, payload):
+    file_format = payload['file_format']
+    name = f'exports/products-{job.uuid}.{file_format}'
+    path = files.storage().path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    total = Product.objects.count()
+    job.set_progress(0, total)
+    # Rewritten from scratch on a retry
+    with open(path, 'w', encoding='utf-8', newline='') as out:
+        for line in exporter.stream(file_format, _counting(exporter.iter_products(), job, total)):
+            out.write(line)
+    return {
+        'file': name,
+        'filename': f'products.{file_format}',
+        'content_type': exporter.CONTENT_TYPES[file_format],
+        'rows': job.progress_done,
+    }
+
+
+def _counting(products, job, total, every=exporter.DEFAULT_CHUNK_SIZE):
+    done = 0
+    for product in products:
+        yield product
+        done += 1
+        if done % every == 0:
+            job.set_progress(done, total)
+    job.set_progress(done, total)
+
+
+@task('products.bulk_update')
+def bulk_update(job, payload):
+    try:
+        return bulk.apply(payload)
+    except bulk.BulkUpdateError as exc:
+        raise JobError("Invalid bulk update.", result={'errors': exc.errors}) from exc
+
+
+@task('products.rebuild_summary')
+def rebuild_summary(job, payload):
+    drift = summary.rebuild(check_only=payload.get('check', False))
+    return {'drifted': len(drift)}
+
+
+@periodic('products.fold_summary', settings.SUMMARY_FOLD_SECONDS)
+def fold_summary():
+    summary.fold()
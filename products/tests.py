@@ -1,3 +1,1336 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import time
+import warnings
+from datetime import timedelta
+from unittest import mock, skipIf
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from asgiref.sync import async_to_sync, sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework.utils.encoders import JSONEncoder
+
+from BuildStock import db_router, metrics, schema
+from jobs.worker import Worker
+from BuildStock.renderers import ORJSONRenderer, msgpack
+from users.userSerializers import BuildStockTokenObtainPairSerializer
+
+from . import conversion, exporter, product_cache, reference_cache, stock, summary, sync
+from .importer import import_products
+from .seeding import seed_catalog
+from .models import CategorySummary, CategorySummaryDelta, Product, ProductCategory, ProductUnit, StockMovement, Tombstone, Unit
+from .views import ProductExportAPIView
+
+
+class ProductTestMixin:
+    """
+    Shared fixtures: an authenticated client and a small catalog builder
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username='tester', password='P@ssword123!', role='admin'
+        )
+        cls.category = ProductCategory.objects.create(name='Cement')
+        cls.kg = Unit.objects.create(name='Kilogram', symbol='kg')
+        cls.sack = Unit.objects.create(name='Sack', symbol='sac')
+        cls.tonne = Unit.objects.create(name='Tonne', symbol='t')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # on_commit never fires inside TestCase, so start every test from a cold cache
+        reference_cache.categories.invalidate()
+        reference_cache.units.invalidate()
+
+    @classmethod
+    def make_products(cls, count, prefix='Product'):
+        products = []
+        for i in range(count):
+            product = Product.objects.create(name=f'{prefix} {i:04d}', category=cls.category)
+            ProductUnit.objects.create(product=product, unit=cls.kg, is_base=True, conversion_factor=1)
+            ProductUnit.objects.create(product=product, unit=cls.sack, conversion_factor=50)
+            ProductUnit.objects.create(product=product, unit=cls.tonne, conversion_factor=1000)
+            products.append(product)
+        return products
+
+
+class ProductListQueryCountTests(ProductTestMixin, TestCase):
+    def _count_list_queries(self, page_size):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('products-list-create'), {'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.make_products(40)
+        small = self._count_list_queries(2)
+        large = self._count_list_queries(40)
+        self.assertEqual(small, large)
+
+    def test_units_are_serialized_from_prefetch(self):
+        self.make_products(1)
+        response = self.client.get(reverse('products-list-create'))
+        item = response.data['results'][0]
+        self.assertEqual(item['category_name'], 'Cement')
+        self.assertEqual(item['base_unit']['symbol'], 'kg')
+        self.assertEqual(
+            [u['symbol'] for u in item['secondary_units_details']],
+            ['sac', 't']
+        )
+
+
+class CursorPaginationTests(ProductTestMixin, TestCase):
+    def _walk(self, params):
+        names, url, data = [], reverse('products-list-create'), params
+        while url:
+            response = self.client.get(url, data)
+            self.assertEqual(response.status_code, 200)
+            names += [p['name'] for p in response.data['results']]
+            url, data = response.data['next'], None
+        return names, response
+
+    def test_cursor_walk_returns_every_product_once_in_order(self):
+        self.make_products(7)
+        names, response = self._walk({'pagination': 'cursor', 'page_size': 3})
+        self.assertEqual(names, [f'Product {i:04d}' for i in range(7)])
+        self.assertNotIn('count', response.data)
+
+    def test_cursor_mode_honors_search_and_optional_count(self):
+        self.make_products(4, prefix='Cement')
+        self.make_products(3, prefix='Gravel')
+        names, _ = self._walk({'pagination': 'cursor', 'page_size': 2, 'search': 'gravel'})
+        self.assertEqual(names, ['Gravel 0000', 'Gravel 0001', 'Gravel 0002'])
+
+        response = self.client.get(reverse('products-list-create'), {'pagination': 'cursor', 'count': 'true', 'search': 'cement'})
+        self.assertEqual(response.data['count'], 4)
+
+    def test_units_support_cursor_mode(self):
+        response = self.client.get(reverse('units-list-create'), {'pagination': 'cursor', 'page_size': 2})
+        self.assertEqual([u['symbol'] for u in response.data['results']], ['kg', 'sac'])
+        self.assertIsNotNone(response.data['next'])
+
+
+class ProductSearchTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Product.objects.create(name='Gravier concassé', description='Granulats pour béton')
+        Product.objects.create(name='Ciment Portland', description='Sac de 50 kg')
+        Product.objects.create(name='Béton prêt', description='Mélange ciment et gravier')
+
+    def _search(self, query, **params):
+        response = self.client.get(reverse('products-list-create'), {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [p['name'] for p in response.data['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self._search('ciment'), ['Ciment Portland', 'Béton prêt'])
+
+    def test_prefix_and_accent_insensitive(self):
+        self.assertEqual(self._search('beto'), ['Béton prêt', 'Gravier concassé'])
+
+    def test_index_follows_updates_and_deletes(self):
+        product = Product.objects.get(name='Ciment Portland')
+        product.name = 'Chaux vive'
+        product.save()
+        self.assertEqual(self._search('chaux'), ['Chaux vive'])
+        product.delete()
+        self.assertEqual(self._search('chaux'), [])
+
+    def test_search_is_paginated(self):
+        response = self.client.get(reverse('products-list-create'), {'search': 'gravier', 'page_size': 1})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class StockMovementBatchTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cement, self.sand = self.make_products(2)
+
+    def _post(self, movements):
+        return self.client.post(reverse('stock-movements-list-create'), {'movements': movements}, format='json')
+
+    def test_batch_converts_units_and_nets_per_product(self):
+        response = self._post([
+            {'product_id': self.cement.id, 'unit_id': self.sack.id, 'movement_type': 'in', 'quantity': '3'},
+            {'product_id': self.cement.id, 'unit_id': self.kg.id, 'movement_type': 'out', 'quantity': '20'},
+            {'product_id': self.sand.id, 'unit_id': self.tonne.id, 'movement_type': 'in', 'quantity': '0.5'},
+        ])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['balances'], {self.cement.id: 130, self.sand.id: 500})
+        self.assertEqual(
+            list(StockMovement.objects.filter(product=self.cement).order_by('id').values_list('base_quantity', flat=True)),
+            [150, -20]
+        )
+
+    def test_batch_that_would_go_negative_is_rejected_as_a_whole(self):
+        Product.objects.filter(pk=self.cement.pk).update(stock_quantity=100)
+        response = self._post([
+            {'product_id': self.sand.id, 'unit_id': self.kg.id, 'movement_type': 'in', 'quantity': '5'},
+            {'product_id': self.cement.id, 'unit_id': self.sack.id, 'movement_type': 'out', 'quantity': '3'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], [
+            {'product_id': self.cement.id, 'error': "Insufficient stock.", 'available': 100, 'requested': 150}
+        ])
+        self.assertEqual(
+            dict(Product.objects.values_list('id', 'stock_quantity')),
+            {self.cement.id: 100, self.sand.id: 0}
+        )
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_increase_past_the_field_bound_is_rejected_per_product(self):
+        Product.objects.filter(pk=self.cement.pk).update(stock_quantity=stock.MAX_STOCK_QUANTITY - 100)
+        response = self._post([
+            {'product_id': self.sand.id, 'unit_id': self.kg.id, 'movement_type': 'in', 'quantity': '5'},
+            {'product_id': self.cement.id, 'unit_id': self.sack.id, 'movement_type': 'in', 'quantity': '3'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], [{
+            'product_id': self.cement.id, 'error': f"Stock cannot exceed {stock.MAX_STOCK_QUANTITY} base units.",
+            'available': stock.MAX_STOCK_QUANTITY - 100, 'requested': 150
+        }])
+        self.assertEqual(Product.objects.get(pk=self.sand.pk).stock_quantity, 0)
+
+    def test_guard_failure_gone_on_recheck_is_retried_not_reported_empty(self):
+        # The first attempt fails as if another batch had held the stock and released it before the recheck
+        with mock.patch.object(stock, '_apply_net', side_effect=[stock._GuardFailed(), None]) as attempts:
+            response = self._post([
+                {'product_id': self.cement.id, 'unit_id': self.kg.id, 'movement_type': 'in', 'quantity': '5'},
+            ])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(attempts.call_count, 2)
+
+        with mock.patch.object(stock, '_apply_net', side_effect=stock._GuardFailed()):
+            response = self._post([
+                {'product_id': self.cement.id, 'unit_id': self.kg.id, 'movement_type': 'in', 'quantity': '5'},
+            ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], [
+            {'product_id': self.cement.id, 'error': "Stock changed concurrently; retry the batch."}
+        ])
+
+    def test_unknown_unit_and_fractional_base_quantity_are_reported_per_line(self):
+        response = self._post([
+            {'product_id': self.cement.id, 'unit_id': self.kg.id, 'movement_type': 'in', 'quantity': '1.5'},
+            {'product_id': self.cement.id, 'unit_id': 999, 'movement_type': 'in', 'quantity': '1'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([e['index'] for e in response.data['errors']], [0, 1])
+
+    def test_batch_query_count_is_independent_of_line_count(self):
+        products = self.make_products(30, prefix='Bulk')
+        lines = [
+            {'product_id': p.id, 'unit_id': self.sack.id, 'movement_type': 'in', 'quantity': '2'}
+            for p in products
+        ]
+        with CaptureQueriesContext(connection) as small:
+            self._post(lines[:2])
+        with CaptureQueriesContext(connection) as large:
+            self._post(lines)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_ledger_is_append_only_and_listed_per_product(self):
+        self._post([{'product_id': self.cement.id, 'unit_id': self.sack.id, 'movement_type': 'in', 'quantity': '1'}])
+        movement = StockMovement.objects.get()
+        with self.assertRaises(ValueError):
+            movement.save()
+        response = self.client.get(reverse('stock-movements-list-create'), {'product': self.cement.id})
+        self.assertEqual(response.data['results'][0]['unit_id'], self.sack.id)
+        self.assertEqual(response.data['results'][0]['base_quantity'], 50)
+
+
+class ProductUnitSyncTests(ProductTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.extra_units = [Unit.objects.create(name=f'Pack {i}', symbol=f'p{i}') for i in range(12)]
+
+    def _payload(self, units, base=None, name='Ciment', factor=10):
+        return {
+            'name': name,
+            'base_unit_id': (base or self.kg).id,
+            'secondary_units': [{'unit_id': u.id, 'conversion_factor': factor + i} for i, u in enumerate(units)],
+        }
+
+    def _units(self, product):
+        return {
+            pu.unit_id: (pu.is_base, pu.conversion_factor)
+            for pu in ProductUnit.objects.filter(product=product)
+        }
+
+    def _count_write_queries(self, method, url, payload):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, payload, format='json')
+        self.assertIn(response.status_code, (200, 201), response.data)
+        return sum(1 for q in ctx.captured_queries if not q['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE')))
+
+    def test_create_query_count_is_independent_of_unit_count(self):
+        url = reverse('products-list-create')
+        few = self._count_write_queries('post', url, self._payload(self.extra_units[:1], name='A'))
+        many = self._count_write_queries('post', url, self._payload(self.extra_units, name='B'))
+        self.assertEqual(few, many)
+
+    def test_update_applies_diff_with_fixed_round_trips(self):
+        self.client.post(reverse('products-list-create'), self._payload(self.extra_units[:6]), format='json')
+        product = Product.objects.get(name='Ciment')
+        url = reverse('product-detail', args=[product.id])
+
+        first = self._count_write_queries('put', url, self._payload(self.extra_units[3:9]))
+        # Each PUT deletes, updates and inserts; the second touches twice as many inserts
+        second = self._count_write_queries('put', url, self._payload(self.extra_units[:3] + self.extra_units[6:], factor=20))
+        self.assertEqual(first, second)
+
+        units = self._units(product)
+        self.assertEqual(len(units), 10)
+        self.assertEqual(units[self.kg.id], (True, 1.0))
+        self.assertEqual(units[self.extra_units[11].id], (False, 28.0))
+
+    def test_changing_base_unit_demotes_previous_base(self):
+        self.client.post(reverse('products-list-create'), self._payload([self.sack]), format='json')
+        product = Product.objects.get(name='Ciment')
+        response = self.client.patch(
+            reverse('product-detail', args=[product.id]),
+            {'base_unit_id': self.tonne.id},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self._units(product), {
+            self.tonne.id: (True, 1.0),
+            self.kg.id: (False, 1.0),
+            self.sack.id: (False, 10.0),
+        })
+
+
+class ProductImportTests(ProductTestMixin, TestCase):
+    CSV = (
+        "name,description,category,is_active,base_unit,secondary_units\n"
+        "Ciment CPJ,\"Sac, 50 kg\",Cement,true,kg,sac:50|t:1000\n"
+        "Sable,,,no,Kilogram,\n"
+        ",missing name,,,kg,\n"
+        "Gravier,,Unknown,,kg,\n"
+        "Chaux,,,,kg,sac:abc\n"
+    )
+
+    def _upload(self, content, filename='catalog.csv', **params):
+        upload = SimpleUploadedFile(filename, content.encode())
+        url = reverse('products-import')
+        if params:
+            url += '?' + urlencode(params)
+        return self.client.post(url, {'file': upload}, format='multipart')
+
+    def test_csv_import_creates_products_and_reports_bad_rows(self):
+        response = self._upload(self.CSV)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([e['row'] for e in response.data['errors']], [3, 4, 5])
+
+        cement = Product.objects.with_units().get(name='Ciment CPJ')
+        self.assertEqual(cement.category, self.category)
+        self.assertEqual(cement.description, 'Sac, 50 kg')
+        self.assertEqual(
+            sorted((pu.unit.symbol, pu.is_base, pu.conversion_factor) for pu in cement.units.all()),
+            [('kg', True, 1.0), ('sac', False, 50.0), ('t', False, 1000.0)]
+        )
+        self.assertFalse(Product.objects.get(name='Sable').is_active)
+
+    def test_jsonl_upsert_updates_existing_products(self):
+        self._upload(self.CSV)
+        jsonl = "\n".join([
+            '{"name": "Ciment CPJ", "is_active": false, "secondary_units": [{"unit": "sac", "conversion_factor": 25}]}',
+            'not json',
+            '{"name": "Sable", "base_unit": "t"}',
+        ])
+        response = self._upload(jsonl, 'update.jsonl')
+        self.assertEqual(response.data['updated'], 0)
+        self.assertEqual(len(response.data['errors']), 3)
+
+        response = self._upload(jsonl, 'update.jsonl', upsert='true')
+        self.assertEqual((response.data['created'], response.data['updated']), (0, 2))
+        self.assertEqual([e['row'] for e in response.data['errors']], [2])
+
+        cement = Product.objects.get(name='Ciment CPJ')
+        self.assertFalse(cement.is_active)
+        self.assertEqual(
+            dict(cement.units.values_list('unit__symbol', 'conversion_factor')),
+            {'kg': 1.0, 'sac': 25.0}
+        )
+        sable = Product.objects.get(name='Sable')
+        self.assertEqual(sable.units.get(is_base=True).unit, self.tonne)
+
+    def test_upsert_keeps_the_base_unit_and_description_and_refuses_bad_encodings(self):
+        self._upload(self.CSV)
+        update = (
+            "name,description,category,is_active,base_unit,secondary_units\n"
+            "Ciment CPJ,,,,,kg:2|sac:40\n"
+            "Sable,,,,,sac:25\n"
+        )
+        response = self._upload(update, upsert='true')
+        self.assertEqual(response.data['errors'], [
+            {'row': 1, 'name': 'Ciment CPJ', 'error': "Base unit cannot be included in secondary units."}
+        ])
+        cement = Product.objects.get(name='Ciment CPJ')
+        self.assertEqual(cement.description, 'Sac, 50 kg')
+        self.assertEqual(cement.units.get(is_base=True).unit, self.kg)
+        self.assertEqual(Product.objects.get(name='Sable').units.get(unit=self.sack).conversion_factor, 25)
+
+        patch = self.client.patch(
+            reverse('product-detail', args=[cement.id]),
+            {'secondary_units': [{'unit_id': self.kg.id, 'conversion_factor': 2}]}, format='json'
+        )
+        self.assertEqual(patch.status_code, 400)
+        self.assertEqual(cement.units.get(is_base=True).unit, self.kg)
+
+        latin1 = SimpleUploadedFile('catalog.csv', "name,base_unit\nCiment Portland Ã  prise,kg\n".encode('latin-1'))
+        response = self.client.post(reverse('products-import'), {'file': latin1}, format='multipart')
+        self.assertEqual((response.status_code, response.data), (400, {'file': ["File is not valid UTF-8."]}))
+        self.assertFalse(Product.objects.filter(name__startswith='Ciment Portland').exists())
+
+    def test_units_are_matched_regardless_of_case(self):
+        Unit.objects.create(name='Tonne US', symbol='T')
+        content = "name,base_unit,secondary_units\nCiment CPJ,KG,SAC:50|T:907\nSable,kilogram,t:1000\n"
+        result = import_products(io.StringIO(content), 'csv')
+        self.assertEqual((result.created, result.errors), (2, []))
+        self.assertEqual(
+            sorted(ProductUnit.objects.filter(product__name='Ciment CPJ').values_list('unit__symbol', 'is_base')),
+            [('T', False), ('kg', True), ('sac', False)]
+        )
+        self.assertEqual(
+            sorted(ProductUnit.objects.filter(product__name='Sable').values_list('unit__symbol', flat=True)),
+            ['kg', 't']
+        )
+
+    def test_import_query_count_is_fixed_per_chunk(self):
+        rows = "".join(f"Produit {i},,Cement,,kg,sac:50\n" for i in range(200))
+        content = "name,description,category,is_active,base_unit,secondary_units\n" + rows
+        with CaptureQueriesContext(connection) as ctx:
+            result = import_products(io.StringIO(content), 'csv', chunk_size=500)
+        self.assertEqual(result.created, 200)
+        self.assertLessEqual(len(ctx.captured_queries), 10)
+
+    def test_management_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(self.CSV)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_products', f.name, stdout=out, stderr=err)
+        os.unlink(f.name)
+        self.assertIn('2 created, 0 updated, 3 errors', out.getvalue())
+        self.assertIn('row 4 (Gravier): Unknown category', err.getvalue())
+
+
+class ProductExportTests(ProductTestMixin, TestCase):
+    def test_export_streams_under_asgi_without_buffering(self):
+        self.make_products(5)
+        pulled = []
+
+        def counting(products):
+            for product in products:
+                pulled.append(product.pk)
+                yield product
+
+        request = AsyncRequestFactory().get(reverse('products-export'))
+        force_authenticate(request, self.user)
+        with mock.patch.object(exporter, 'ASYNC_BATCH_LINES', 2), \
+                mock.patch('products.views.exporter.iter_products', return_value=counting(exporter.iter_products())):
+            response = ProductExportAPIView.as_view()(request)
+            self.assertTrue(response.is_async)
+
+            async def first_line():
+                return await anext(response.__aiter__())
+
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                header = async_to_sync(first_line)()
+        self.assertTrue(header.startswith(b'uuid,name'))
+        # The header and one row: the other four products have not been read
+        self.assertEqual(len(pulled), 1)
+
+    def test_csv_export_streams_and_round_trips_through_import(self):
+        self.make_products(5)
+        response = self.client.get(reverse('products-export'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        lines = content.splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertIn('Product 0000,,Cement,true,0,kg,sac:50|t:1000', lines[1])
+
+        Product.objects.all().delete()
+        result = import_products(io.StringIO(content), 'csv')
+        self.assertEqual((result.created, result.errors), (5, []))
+
+    def test_csv_export_keeps_every_digit_of_conversion_factors(self):
+        product, = self.make_products(1)
+        factors = {self.sack.id: 1234567.0, self.tonne.id: 0.123456789}
+        for unit_id, factor in factors.items():
+            ProductUnit.objects.filter(product=product, unit_id=unit_id).update(conversion_factor=factor)
+        content = b''.join(self.client.get(reverse('products-export')).streaming_content).decode()
+        self.assertIn('sac:1234567|t:0.123456789', content)
+
+        Product.objects.all().delete()
+        self.assertEqual(import_products(io.StringIO(content), 'csv').errors, [])
+        imported = dict(ProductUnit.objects.filter(is_base=False).values_list('unit_id', 'conversion_factor'))
+        self.assertEqual(imported, factors)
+
+    def test_jsonl_export_prefetches_per_chunk(self):
+        self.make_products(9)
+        with CaptureQueriesContext(connection) as ctx:
+            rows = [json.loads(line) for line in exporter.stream('jsonl', exporter.iter_products(chunk_size=3))]
+        self.assertEqual(len(rows), 9)
+        self.assertEqual(rows[0]['secondary_units'], [
+            {'unit': 'sac', 'conversion_factor': 50.0},
+            {'unit': 't', 'conversion_factor': 1000.0},
+        ])
+        # One product query plus one unit prefetch per chunk of 3
+        self.assertEqual(len(ctx.captured_queries), 1 + 3)
+
+    def test_management_command_writes_jsonl(self):
+        self.make_products(2)
+        out = io.StringIO()
+        call_command('export_products', '--format', 'jsonl', stdout=out)
+        self.assertEqual([json.loads(line)['name'] for line in out.getvalue().splitlines()], ['Product 0000', 'Product 0001'])
+
+
+class ReferenceListCacheTests(ProductTestMixin, TestCase):
+    def test_category_list_is_cached_and_revalidated_without_queries(self):
+        url = reverse('categories-list-create')
+        first = self.client.get(url)
+        self.assertEqual([c['name'] for c in first.data], ['Cement'])
+        self.assertIn('ETag', first)
+
+        with self.assertNumQueries(0):
+            again = self.client.get(url)
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_save_invalidates_after_commit(self):
+        url = reverse('categories-list-create')
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'name': 'Steel'}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['name'] for c in response.data], ['Cement', 'Steel'])
+
+    def test_unit_pages_have_distinct_etags_and_search_bypasses_cache(self):
+        url = reverse('units-list-create')
+        page1 = self.client.get(url, {'page_size': 2})
+        page2 = self.client.get(url, {'page_size': 2, 'page': 2})
+        self.assertNotEqual(page1['ETag'], page2['ETag'])
+        self.assertEqual([u['symbol'] for u in page2.data['results']], ['t'])
+        self.assertEqual(self.client.get(url, {'page_size': 2}, HTTP_IF_NONE_MATCH=page1['ETag']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Unit.objects.create(name='Bag', symbol='bag')
+        self.assertEqual(self.client.get(url, {'page_size': 2}, HTTP_IF_NONE_MATCH=page1['ETag']).status_code, 200)
+        self.assertNotIn('ETag', self.client.get(url, {'search': 'ton'}))
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_each_media_type_has_its_own_validator(self):
+        url = reverse('categories-list-create')
+        as_json = self.client.get(url)
+        as_msgpack = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertNotEqual(as_json['ETag'], as_msgpack['ETag'])
+        self.assertIn('Accept', as_json['Vary'])
+
+        # A JSON validator must not revalidate a MessagePack request
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=as_json['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        not_modified = self.client.get(url, HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=as_msgpack['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertIn('Accept', not_modified['Vary'])
+
+    def test_without_a_shared_cache_validators_come_from_the_database(self):
+        url = reverse('units-list-create')
+        first = self.client.get(url)
+        unit = Unit.objects.order_by('updated_at').last()
+        self.assertEqual(first['Last-Modified'], http_date(int(unit.updated_at.timestamp())))
+        # Another worker loading the same rows hands out the same validators
+        other_worker = reference_cache.ReferenceCache('units', reference_cache._load_units, reference_cache._units_modified)
+        self.assertEqual(other_worker.state(), reference_cache.units.state())
+
+        # Changed elsewhere (no invalidation reaches this process): stale only until the TTL runs out
+        Unit.objects.filter(pk=unit.pk).update(name='Tonne (metric)')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        later = time.monotonic() + settings.REFERENCE_CACHE_LOCAL_TTL
+        with mock.patch('products.reference_cache.time.monotonic', return_value=later):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Tonne (metric)', [u['name'] for u in response.data['results']])
+
+    @override_settings(
+        REFERENCE_CACHE_ALIAS='shared',
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'reference-tests'},
+        },
+    )
+    def test_version_is_shared_through_cache_backend(self):
+        url = reverse('categories-list-create')
+        etag = self.client.get(url)['ETag']
+        # Another worker bumping the shared version invalidates this process too
+        other_worker = reference_cache.ReferenceCache('categories', lambda: [])
+        other_worker.invalidate()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class UnitConversionTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.cement, = self.make_products(1)
+        self.bag = Unit.objects.create(name='Bag', symbol='bag')
+        ProductUnit.objects.create(product=self.cement, unit=self.bag, conversion_factor=0.1)
+
+    def _convert(self, *items):
+        response = self.client.post(reverse('unit-conversions'), {'conversions': [
+            {'product_id': self.cement.id, 'from_unit_id': src.id, 'to_unit_id': dst.id, 'quantity': qty}
+            for src, dst, qty in items
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['results']
+
+    def test_conversions_between_secondary_units_are_exact(self):
+        results = self._convert(
+            (self.sack, self.tonne, '40'),
+            (self.bag, self.kg, '3'),
+            (self.kg, self.sack, '1'),
+            (self.sack, Unit.objects.create(name='Litre', symbol='l'), '1'),
+        )
+        self.assertEqual([(r.get('result'), r.get('exact')) for r in results[:3]], [
+            ('2', True), ('0.3', True), ('0.02', True)
+        ])
+        self.assertIn('error', results[3])
+
+    def test_rounding_is_reported(self):
+        ProductUnit.objects.filter(product=self.cement, unit=self.sack).update(conversion_factor=3)
+        result, = self._convert((self.kg, self.sack, '1'))
+        self.assertEqual((result['result'], result['exact']), ('0.333333333', False))
+
+    def test_matrix_is_cached_and_invalidated_on_unit_changes(self):
+        self._convert((self.sack, self.kg, '1'))
+        with self.assertNumQueries(0):
+            conversion.get_matrix(self.cement.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                reverse('product-detail', args=[self.cement.id]),
+                {'base_unit_id': self.kg.id, 'secondary_units': [{'unit_id': self.sack.id, 'conversion_factor': 25}]},
+                format='json'
+            )
+        result, = self._convert((self.sack, self.kg, '2'))
+        self.assertEqual(result['result'], '50')
+
+    def test_non_positive_factors_are_refused_on_write_and_fail_per_item(self):
+        url = reverse('product-detail', args=[self.cement.id])
+        for factor in (0, -5, 'nan'):
+            response = self.client.patch(
+                url, {'secondary_units': [{'unit_id': self.sack.id, 'conversion_factor': factor}]}, format='json'
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('secondary_units', response.data)
+        lines = ['name,secondary_units\n', 'Product 0000,sac:0\n', 'Product 0000,t:inf\n']
+        self.assertEqual([e['row'] for e in import_products(lines, upsert=True).errors], [1, 2])
+        self.assertEqual(ProductUnit.objects.get(product=self.cement, unit=self.sack).conversion_factor, 50)
+
+        # A row stored before validation existed: that pair fails, the rest of the batch converts
+        ProductUnit.objects.filter(product=self.cement, unit=self.bag).update(conversion_factor=0)
+        bad, good = self._convert((self.sack, self.bag, '1'), (self.sack, self.kg, '1'))
+        self.assertIn('invalid conversion factor', bad['error'])
+        self.assertEqual(good['result'], '50')
+
+
+class AsyncReadEndpointTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+        self.token = str(BuildStockTokenObtainPairSerializer.get_token(self.user).access_token)
+
+    async def _get(self, path, data=None, **headers):
+        return await self.async_client.get(path, data, headers={'Authorization': f'Bearer {self.token}', **headers})
+
+    async def test_async_product_list_matches_sync_response(self):
+        await sync_to_async(self.make_products)(12)
+        response = await self._get('/api/async/products/products/', {'page_size': 5, 'page': 2})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+
+        expected = await sync_to_async(self.client.get)(reverse('products-list-create'), {'page_size': 5, 'page': 2})
+        self.assertEqual(data['count'], 12)
+        self.assertEqual(data['results'], json.loads(json.dumps(expected.data['results'], cls=JSONEncoder)))
+        self.assertIn('page=3', data['next'])
+        self.assertNotIn('page=', data['previous'])
+
+    async def test_async_unit_and_category_lists(self):
+        units = (await self._get('/api/async/products/units/', {'search': 'to'})).json()
+        self.assertEqual([u['symbol'] for u in units['results']], ['t'])
+
+        categories = await self._get('/api/async/products/categories/')
+        self.assertEqual([c['name'] for c in categories.json()], ['Cement'])
+        not_modified = await self._get('/api/async/products/categories/', **{'If-None-Match': categories['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_middleware_chain_runs_async_under_asgi(self):
+        # With DEBUG, Django logs each sync-only middleware it has to adapt
+        with override_settings(DEBUG=True), self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+    async def test_async_lists_support_sparse_fields_cursors_and_renderers(self):
+        await sync_to_async(self.make_products)(3)
+        await sync_to_async(metrics.registry.reset)()
+        response = await self._get('/api/async/products/products/', {'fields': 'uuid,name', 'pagination': 'cursor', 'page_size': 2})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = response.json()
+        self.assertEqual(set(data['results'][0]), {'uuid', 'name'})
+        self.assertNotIn('count', data)
+        following = await self.async_client.get(data['next'], headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual([p['name'] for p in following.json()['results']], ['Product 0002'])
+        # Counted by the async MetricsMiddleware path, queries included
+        self.assertRegex(
+            metrics.registry.render(),
+            r'buildstock_db_queries_per_request_sum\{method="GET",route="/api/async/products/products/"\} [1-9]'
+        )
+
+        units = await self._get('/api/async/products/units/', {'fields': 'symbol'})
+        self.assertEqual(units.json()['results'], [{'symbol': 'kg'}, {'symbol': 'sac'}, {'symbol': 't'}])
+        self.assertEqual((await self._get('/api/async/products/units/', {'fields': 'nope'})).status_code, 400)
+        if msgpack is not None:
+            packed = await self._get('/api/async/products/categories/', Accept='application/msgpack')
+            self.assertEqual(msgpack.unpackb(packed.content), [{'uuid': str(self.category.uuid), 'name': 'Cement', 'description': None}])
+
+    async def test_async_endpoints_require_authentication_and_are_read_only(self):
+        self.assertEqual((await self.async_client.get('/api/async/products/products/')).status_code, 401)
+        response = await self.async_client.post(
+            '/api/async/products/units/', headers={'Authorization': f'Bearer {self.token}'}
+        )
+        self.assertEqual(response.status_code, 405)
+
+
+class RendererNegotiationTests(ProductTestMixin, TestCase):
+    def test_orjson_output_matches_stdlib_renderer(self):
+        self.make_products(3)
+        data = self.client.get(reverse('products-list-create')).data
+        data['balances'] = {1: 150}
+        self.assertEqual(
+            json.loads(ORJSONRenderer().render(data)),
+            json.loads(JSONRenderer().render(data))
+        )
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_is_selected_by_accept_header_and_parsed_on_input(self):
+        self.make_products(1)
+        response = self.client.get(reverse('products-list-create'), HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['results'][0]['base_unit']['symbol'], 'kg')
+
+        response = self.client.post(
+            reverse('categories-list-create'),
+            msgpack.packb({'name': 'Steel'}),
+            content_type='application/msgpack'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get(reverse('products-list-create'))['Content-Type'], 'application/json')
+
+
+class SparseFieldsetTests(ProductTestMixin, TestCase):
+    def test_product_fields_narrow_columns_and_skip_unit_prefetch(self):
+        self.make_products(3)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('products-list-create'), {'fields': 'uuid,name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]), {'uuid', 'name'})
+        sql = ' '.join(query['sql'] for query in ctx.captured_queries)
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('products_productunit', sql)
+
+        response = self.client.get(reverse('products-list-create'), {'fields': 'name,base_unit,category_name'})
+        item = response.data['results'][0]
+        self.assertEqual((item['base_unit']['symbol'], item['category_name']), ('kg', 'Cement'))
+
+    def test_exclude_and_unknown_fields(self):
+        self.make_products(1)
+        response = self.client.get(reverse('products-list-create'), {'exclude': 'description,secondary_units_details'})
+        self.assertNotIn('description', response.data['results'][0])
+        self.assertIn('base_unit', response.data['results'][0])
+
+        response = self.client.get(reverse('products-list-create'), {'fields': 'name,secondary_units'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cached_reference_lists_are_trimmed_per_selection(self):
+        response = self.client.get(reverse('units-list-create'), {'fields': 'symbol'})
+        self.assertEqual(response.data['results'], [{'symbol': 'kg'}, {'symbol': 'sac'}, {'symbol': 't'}])
+        full = self.client.get(reverse('units-list-create'))
+        self.assertNotEqual(full['ETag'], response['ETag'])
+        self.assertEqual(set(full.data['results'][0]), {'uuid', 'name', 'symbol'})
+
+        response = self.client.get(reverse('categories-list-create'), {'fields': 'name'})
+        self.assertEqual(response.data, [{'name': 'Cement'}])
+
+
+class IndexPlanTests(ProductTestMixin, TestCase):
+    """
+    The list and unit lookups are served by the indexes of migration 0004
+    """
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == 'postgresql':
+            # The test tables are tiny; make the planner show the index it would pick at scale
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        elif connection.vendor != 'sqlite':
+            self.skipTest(f"No expected plan for {connection.vendor}")
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('TEMP B-TREE', plan)  # SQLite: no sort step after the index scan
+
+    def test_list_orderings_use_indexes(self):
+        self.make_products(5)
+        self.assertUsesIndex(Product.objects.filter(category=self.category).order_by('name'), 'product_category_name')
+        self.assertUsesIndex(Product.objects.filter(is_active=True).order_by('name'), 'product_active_name')
+        self.assertUsesIndex(Product.objects.order_by('-created_at'), 'product_created_at')
+
+    def test_base_unit_lookup_uses_partial_unique_index(self):
+        product = self.make_products(1)[0]
+        self.assertUsesIndex(ProductUnit.objects.filter(product=product, is_base=True), 'productunit_one_base_per_product')
+
+    def test_second_base_unit_is_rejected(self):
+        product = self.make_products(1)[0]
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProductUnit.objects.filter(product=product, unit=self.sack).update(is_base=True)
+
+
+class SeedCatalogAndBenchmarkTests(ProductTestMixin, TestCase):
+    def test_seed_is_reproducible_and_reuses_reference_rows(self):
+        counts = seed_catalog(categories=4, units=5, products=30, seed=7, batch_size=8)
+        self.assertEqual(counts['products'], 30)
+        self.assertEqual(ProductCategory.objects.count(), 4)  # 'Cement' already existed
+        self.assertEqual(ProductUnit.objects.filter(is_base=True, product__name__contains='#S7-').count(), 30)
+        names = list(Product.objects.filter(name__contains='#S7-').order_by('name').values_list('name', flat=True))
+
+        with self.assertRaises(ValueError):
+            seed_catalog(products=30, seed=7)
+        seed_catalog(categories=4, units=5, products=30, seed=7, tag='T')
+        again = Product.objects.filter(name__contains='#T7-').order_by('name').values_list('name', flat=True)
+        self.assertEqual([name.replace('#S7-', '#T7-') for name in names], list(again))
+
+    def test_units_whose_symbol_is_taken_get_a_numbered_one(self):
+        Unit.objects.create(name='Pièce', symbol='pc')
+        Unit.objects.create(name='Pc (old)', symbol='pc2')
+        call_command('seed_catalog', categories=1, units=5, products=10, seed=3, stdout=io.StringIO())
+        self.assertEqual(Unit.objects.get(name='Piece').symbol, 'pc3')
+        self.assertEqual(Unit.objects.get(name='Sack').symbol, 'sac')
+
+        with self.assertRaisesMessage(CommandError, "already seeded"):
+            call_command('seed_catalog', categories=1, units=5, products=10, seed=3, stdout=io.StringIO())
+
+    def test_bench_api_writes_results_and_rolls_back(self):
+        before = Product.objects.count()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.json')
+            call_command('bench_api', iterations=2, warmup=0, products=10, output=path, stdout=io.StringIO())
+            with open(path) as f:
+                results = json.load(f)
+            out = io.StringIO()
+            call_command('bench_api', scenario=['unit_list'], iterations=2, warmup=0, products=0, compare=path, stdout=out)
+
+        self.assertEqual(Product.objects.count(), before)
+        self.assertEqual(set(results['scenarios']), {
+            'product_list', 'product_search', 'product_create', 'product_update', 'unit_list', 'login'
+        })
+        for summary in results['scenarios'].values():
+            self.assertEqual(summary['errors'], 0)
+            self.assertLessEqual(summary['p50_ms'], summary['p99_ms'])
+        self.assertIn('unit_list       queries', out.getvalue())
+
+
+class MetricsTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+
+    def test_requests_are_recorded_per_route(self):
+        self.make_products(2)
+        self.client.get(reverse('products-list-create'))
+        self.client.get('/api/no-such-endpoint/')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        labels = 'method="GET",route="/api/products/products/"'
+        self.assertIn(f'buildstock_http_requests_total{{{labels},status="200"}} 1', body)
+        self.assertIn(f'buildstock_db_queries_per_request_count{{{labels}}} 1', body)
+        self.assertIn(f'buildstock_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1', body)
+        self.assertIn('method="GET",route="<unmatched>",status="404"', body)
+
+    def test_metrics_require_authentication_or_scrape_token(self):
+        self.assertEqual(APIClient().get(reverse('metrics')).status_code, 401)
+        with override_settings(METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(APIClient().get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+            self.assertEqual(APIClient().get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+
+    def test_slow_queries_are_logged_and_counted(self):
+        with override_settings(SLOW_QUERY_LOG_SECONDS=0):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            with self.assertLogs('buildstock.metrics', 'WARNING') as logs:
+                client.get(reverse('products-list-create'))
+        self.assertIn('Slow query', logs.output[0])
+        self.assertRegex(
+            metrics.registry.render(),
+            r'buildstock_db_slow_queries_total\{method="GET",route="/api/products/products/"\} [1-9]'
+        )
+
+
+class OpenAPISchemaTests(TestCase):
+    def test_schema_is_served_from_the_built_file_with_etag(self):
+        self.addCleanup(schema.reset)
+        with tempfile.TemporaryDirectory() as tmp, override_settings(OPENAPI_SCHEMA_FILE=os.path.join(tmp, 'schema.json')):
+            call_command('build_schema', stdout=io.StringIO())
+            schema.reset()
+            # Startup loads the file; requests must not generate anything
+            with mock.patch.object(schema, 'generate', side_effect=AssertionError("schema generated")):
+                schema.warm()
+                response = self.client.get(reverse('schema'), {'format': 'json'})
+                yaml_response = self.client.get(reverse('schema'))
+                not_modified = self.client.get(reverse('schema'), {'format': 'json'}, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(response.status_code, 200)
+        document = json.loads(response.content)
+        self.assertEqual(document['info']['title'], 'BuildStock API')  # SPECTACULAR_SETTINGS applies
+        self.assertIn('/api/products/products/', document['paths'])
+        self.assertIn('jwtAuth', document['components']['securitySchemes'])
+        self.assertTrue(yaml_response.content.startswith(b'openapi:'))
+        self.assertNotEqual(yaml_response['ETag'], response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+
+class CategorySummaryTests(ProductTestMixin, TestCase):
+    def summary_of(self, category):
+        row, = summary.with_pending(CategorySummary.objects.filter(category=category))
+        return row.product_count, row.active_product_count, row.stock_total
+
+    def test_summary_follows_every_write_path(self):
+        steel = ProductCategory.objects.create(name='Steel')
+        self.assertEqual(self.summary_of(steel), (0, 0, 0))
+
+        cement, sand = self.make_products(2)
+        self.client.post(reverse('stock-movements-list-create'), {'movements': [
+            {'product_id': cement.id, 'unit_id': self.sack.id, 'movement_type': 'in', 'quantity': '2'},
+            {'product_id': sand.id, 'unit_id': self.kg.id, 'movement_type': 'in', 'quantity': '5'},
+        ]}, format='json')
+        self.assertEqual(self.summary_of(self.category), (2, 2, 105))
+
+        Product.objects.filter(pk=sand.pk).update(category=steel, is_active=False)
+        self.assertEqual(self.summary_of(self.category), (1, 1, 100))
+        self.assertEqual(self.summary_of(steel), (1, 0, 5))
+
+        import_products(io.StringIO("name,category,base_unit\nRebar 12,Steel,kg\n"), 'csv')
+        Product.objects.filter(pk=cement.pk).delete()
+        self.assertEqual(self.summary_of(self.category), (0, 0, 0))
+        self.assertEqual(self.summary_of(steel), (2, 1, 5))
+        self.assertEqual(summary.rebuild(check_only=True), {})
+
+    def test_writes_append_deltas_that_fold_into_the_rows(self):
+        cement, sand = self.make_products(2)
+        Product.objects.filter(pk=cement.pk).update(stock_quantity=F('stock_quantity') + 40)
+        Product.objects.filter(pk=sand.pk).update(name='Sand')
+        # Two inserts and one stock change; the rename leaves the summary alone
+        self.assertEqual(CategorySummaryDelta.objects.count(), 4)
+        self.assertEqual(CategorySummary.objects.get(category=self.category).product_count, 0)
+
+        self.assertEqual(summary.fold(), 1)
+        self.assertFalse(CategorySummaryDelta.objects.exists())
+        row = CategorySummary.objects.get(category=self.category)
+        self.assertEqual((row.product_count, row.active_product_count, row.stock_total), (2, 2, 40))
+        self.assertEqual(self.summary_of(self.category), (2, 2, 40))
+
+        call_command('fold_category_summary', stdout=io.StringIO())
+        self.assertEqual(self.summary_of(self.category), (2, 2, 40))
+
+    def test_job_workers_fold_the_deltas_so_they_stay_bounded(self):
+        products = self.make_products(5)
+        for round_ in range(3):
+            for product in products:
+                self.client.post(reverse('stock-movements-list-create'), {'movements': [
+                    {'product_id': product.id, 'unit_id': self.kg.id, 'movement_type': 'in', 'quantity': '2'},
+                ]}, format='json')
+            # One delta per insert, two (old and new) per update
+            self.assertEqual(CategorySummaryDelta.objects.count(), 10 if round_ else 15)
+            Worker(name='test-worker').run(burst=True)
+            self.assertFalse(CategorySummaryDelta.objects.exists())
+        row = CategorySummary.objects.get(category=self.category)
+        self.assertEqual((row.product_count, row.stock_total), (5, 30))
+
+    def test_endpoint_reads_one_row_per_category(self):
+        self.make_products(5)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('categories-summary'))
+        self.assertEqual(response.data, [{
+            'uuid': str(self.category.uuid), 'name': 'Cement',
+            'product_count': 5, 'active_product_count': 5, 'stock_total': 0,
+        }])
+
+    def test_rebuild_command_reports_and_fixes_drift(self):
+        self.make_products(3)
+        CategorySummary.objects.filter(category=self.category).update(product_count=42)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_category_summary', check=True, stdout=io.StringIO(), stderr=io.StringIO())
+        call_command('rebuild_category_summary', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(self.summary_of(self.category), (3, 3, 0))
+
+
+class ProductLookupCacheTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Product ids are reused across tests once their transactions roll back
+        cache.clear()
+        self.cement, self.sand = self.make_products(2)
+
+    def test_detail_by_id_or_uuid_is_served_from_cache(self):
+        by_id = self.client.get(reverse('product-detail', args=[self.cement.id]))
+        self.assertEqual(by_id.status_code, 200)
+        self.assertEqual(by_id.data['base_unit']['symbol'], 'kg')
+        with self.assertNumQueries(0):
+            by_uuid = self.client.get(reverse('product-detail-uuid', args=[self.cement.uuid]))
+            fields = self.client.get(reverse('product-detail', args=[self.cement.id]), {'fields': 'uuid,name'})
+        self.assertEqual(by_uuid.data, by_id.data)
+        self.assertEqual(fields.data, {'uuid': str(self.cement.uuid), 'name': 'Product 0000'})
+        self.assertEqual(self.client.get(reverse('product-detail', args=[999])).status_code, 404)
+
+    def test_per_process_cache_expires_changes_made_elsewhere(self):
+        url = reverse('product-detail', args=[self.cement.id])
+        self.client.get(url)
+        # Renamed by another process: its invalidation never reaches this cache
+        Product.objects.filter(pk=self.cement.pk).update(name='Cement CPJ')
+        self.assertEqual(self.client.get(url).data['name'], 'Product 0000')
+        later = time.time() + product_cache.LOCAL_TIMEOUT
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertEqual(self.client.get(url).data['name'], 'Cement CPJ')
+
+    def test_batch_lookup_loads_misses_in_one_query_with_units(self):
+        url = reverse('products-lookup')
+        missing_uuid = '0f8fad5b-d9cb-469f-a165-70867728950e'
+        payload = {'ids': [self.cement.id, 999], 'uuids': [str(self.sand.uuid), missing_uuid]}
+        # The products (category joined) and their units
+        with self.assertNumQueries(2):
+            response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results']), {str(self.cement.id), str(self.sand.uuid)})
+        self.assertEqual(response.data['missing'], ['999', missing_uuid])
+        self.assertEqual(len(response.data['results'][str(self.sand.uuid)]['secondary_units_details']), 2)
+
+        with self.assertNumQueries(0):
+            cached = self.client.post(url, {'ids': [self.cement.id], 'uuids': [str(self.sand.uuid)]}, format='json')
+        self.assertEqual(len(cached.data['results']), 2)
+
+        self.assertEqual(self.client.post(url, {}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(url, {'ids': list(range(1, 502))}, format='json').status_code, 400)
+
+    def test_writes_invalidate_cached_products(self):
+        url = reverse('product-detail', args=[self.cement.id])
+        self.client.get(url)
+        self.client.patch(url, {'name': 'Portland', 'base_unit_id': self.kg.id}, format='json')
+        self.assertEqual(self.client.get(url).data['name'], 'Portland')
+
+        self.client.post(reverse('stock-movements-list-create'), {'movements': [
+            {'product_id': self.cement.id, 'unit_id': self.sack.id, 'movement_type': 'in', 'quantity': '2'},
+        ]}, format='json')
+        self.assertEqual(self.client.get(url).data['stock_quantity'], 100)
+
+        self.sack.symbol = 'sk'
+        self.sack.save()
+        self.category.name = 'Binders'
+        self.category.save()
+        data = self.client.get(url).data
+        self.assertEqual([u['symbol'] for u in data['secondary_units_details']], ['sk', 't'])
+        self.assertEqual(data['category_name'], 'Binders')
+
+    def test_category_and_unit_deletes_invalidate_cached_products(self):
+        url = reverse('product-detail', args=[self.cement.id])
+        self.assertEqual(self.client.get(url).data['category_name'], 'Cement')
+        self.category.delete()
+        self.sack.delete()
+        data = self.client.get(url).data
+        self.assertEqual((data['category'], data.get('category_name')), (None, None))
+        self.assertEqual([u['symbol'] for u in data['secondary_units_details']], ['t'])
+
+        self.client.get(url)
+        ProductUnit.objects.get(product=self.cement, unit=self.tonne).delete()
+        self.assertEqual(self.client.get(url).data['secondary_units_details'], [])
+
+    def test_delete_drops_the_uuid_pointer(self):
+        url = reverse('product-detail-uuid', args=[self.sand.uuid])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.sand.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ProductBulkUpdateTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.products = self.make_products(4)
+        self.steel = ProductCategory.objects.create(name='Steel')
+
+    def _patch(self, payload):
+        return self.client.patch(reverse('products-bulk-update'), payload, format='json')
+
+    def test_items_are_applied_with_one_statement_per_distinct_change(self):
+        a, b, c, d = self.products
+        items = [
+            {'id': a.id, 'fields': {'category': self.steel.id, 'is_active': False}},
+            {'id': b.id, 'fields': {'category': self.steel.id, 'name': 'Rebar 12'}},
+            {'id': c.id, 'fields': {'description': 'Bags', 'is_active': True}},
+        ]
+        # lock/read, categories, names, savepoint pair, 2 grouped UPDATEs, 2 bulk_updates
+        with self.assertNumQueries(9):
+            response = self._patch({'items': items})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual([r['changed'] for r in response.data['results']], [
+            ['is_active', 'category'], ['name', 'category'], ['description'],
+        ])
+        rows = {p.id: p for p in Product.objects.all()}
+        self.assertEqual((rows[a.id].category, rows[a.id].is_active), (self.steel, False))
+        self.assertEqual((rows[b.id].name, rows[b.id].category), ('Rebar 12', self.steel))
+        self.assertEqual(rows[c.id].description, 'Bags')
+        self.assertEqual(rows[d.id].category, self.category)
+        self.assertEqual(summary.with_pending(CategorySummary.objects.filter(category=self.steel))[0].product_count, 2)
+
+    def test_invalid_batch_is_rejected_as_a_whole(self):
+        a, b, c, _ = self.products
+        response = self._patch({'items': [
+            {'id': a.id, 'fields': {'is_active': False}},
+            {'id': b.id, 'fields': {'name': c.name}},
+            {'id': 999, 'fields': {'category': 999}},
+            {'id': a.id, 'fields': {'description': 'again'}},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [(e['index'], e['error']) for e in response.data['errors']],
+            [(1, "Name already in use."), (2, "Unknown product."), (2, "Unknown category."),
+             (3, "Product listed more than once.")]
+        )
+        self.assertFalse(Product.objects.filter(is_active=False).exists())
+
+        response = self._patch({'items': [{'id': a.id, 'fields': {}}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_filter_updates_matching_products_and_invalidates_cache(self):
+        a, b, c, d = self.products
+        Product.objects.filter(pk=d.pk).update(is_active=False)
+        self.client.get(reverse('product-detail', args=[a.id]))
+
+        response = self._patch({'filter': {'category': self.category.id}, 'fields': {'is_active': False}})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['matched'], response.data['ids']), (4, [a.id, b.id, c.id]))
+        self.assertFalse(self.client.get(reverse('product-detail', args=[a.id])).data['is_active'])
+        self.assertEqual(summary.with_pending(CategorySummary.objects.filter(category=self.category))[0].active_product_count, 0)
+
+        response = self._patch({'filter': {'search': 'Product 0001'}, 'fields': {'category': self.steel.id}})
+        self.assertEqual(response.data['ids'], [b.id])
+
+    def test_filter_mode_is_restricted(self):
+        self.assertEqual(self._patch({'filter': {}, 'fields': {'is_active': False}}).status_code, 400)
+        self.assertEqual(self._patch({'filter': {'is_active': True}, 'fields': {'name': 'Same'}}).status_code, 400)
+        self.assertEqual(self._patch({'filter': {'is_active': True}}).status_code, 400)
+        response = self._patch({'filter': {'is_active': True}, 'fields': {'category': 999}})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'][0]['error'], "Unknown category.")
+
+    def test_partial_patch_no_longer_requires_base_unit(self):
+        product = self.products[0]
+        response = self.client.patch(reverse('product-detail', args=[product.id]), {'is_active': False}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['base_unit']['symbol'], 'kg')
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class DeltaSyncTests(ProductTestMixin, TestCase):
+    def _sync(self, resource='products', cursor=None, page_size=2):
+        params = {'page_size': page_size}
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get(reverse('sync-changes', args=[resource]), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def _drain(self, resource='products', cursor=None):
+        names, deleted = [], []
+        while True:
+            page = self._sync(resource, cursor)
+            names += [row['name'] for row in page['results']]
+            deleted += page['deleted']
+            cursor = page['cursor']
+            if not page['has_more']:
+                return names, deleted, cursor
+
+    def test_full_download_then_only_changes(self):
+        # One statement, so SQLite stamps these rows alike: the id breaks the ties
+        Product.objects.bulk_create([Product(name=f'Bulk {i}', category=self.category) for i in range(5)])
+        names, deleted, cursor = self._drain()
+        self.assertEqual(sorted(names), [f'Bulk {i}' for i in range(5)])
+        self.assertEqual(deleted, [])
+        self.assertEqual(self._drain(cursor=cursor)[:2], ([], []))
+
+        bulk = {p.name: p for p in Product.objects.all()}
+        ProductUnit.objects.create(product=bulk['Bulk 1'], unit=self.kg, is_base=True)
+        Product.objects.filter(pk=bulk['Bulk 2'].pk).update(stock_quantity=5)
+        bulk['Bulk 3'].delete()
+        names, deleted, cursor = self._drain(cursor=cursor)
+        self.assertEqual(sorted(names), ['Bulk 1', 'Bulk 2'])
+        self.assertEqual(deleted, [str(bulk['Bulk 3'].uuid)])
+
+        self.kg.symbol = 'kgs'
+        self.kg.save()
+        names, _, cursor = self._drain(cursor=cursor)
+        self.assertEqual(names, ['Bulk 1'])
+        units = self._sync('units', page_size=10)['results']
+        self.assertEqual(sorted(u['symbol'] for u in units), ['kgs', 'sac', 't'])
+
+    def test_an_open_write_transaction_holds_the_cursor_back(self):
+        first, second = self.make_products(2)
+        _, _, cursor = self._drain()
+        Product.objects.filter(pk=first.pk).update(description='Changed')
+        second.delete()
+        stamp = Product.objects.get(pk=first.pk).updated_at
+
+        # A bulk update that began before these writes and has not committed yet:
+        # its early stamps must still be ahead of the cursor once it does
+        with mock.patch('products.sync.writer_bound', return_value=stamp - timedelta(microseconds=1)):
+            names, deleted, held = self._drain(cursor=cursor)
+        self.assertEqual((names, deleted), ([], []))
+        updated, deleted_position = sync.decode_cursor('products', held)
+        self.assertLess(deleted_position[0], stamp)
+
+        names, deleted, _ = self._drain(cursor=held)
+        self.assertEqual((names, deleted), (['Product 0000'], [str(second.uuid)]))
+
+    def test_unit_deletions_are_tombstoned(self):
+        _, _, cursor = self._drain('units')
+        uuid = str(self.tonne.uuid)
+        self.tonne.delete()
+        names, deleted, _ = self._drain('units', cursor)
+        self.assertEqual((names, deleted), ([], [uuid]))
+        self.assertTrue(Tombstone.objects.filter(kind=Tombstone.UNIT, uuid=uuid).exists())
+
+    def test_bad_and_expired_cursors(self):
+        url = reverse('sync-changes', args=['products'])
+        self.assertEqual(self.client.get(url, {'cursor': 'not-a-cursor'}).status_code, 400)
+        units_cursor = self._sync('units')['cursor']
+        self.assertEqual(self.client.get(url, {'cursor': units_cursor}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'page_size': 0}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('sync-changes', args=['orders'])).status_code, 404)
+
+        cursor = self._sync()['cursor']
+        with override_settings(SYNC_TOMBSTONE_RETENTION_DAYS=0):
+            self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 410)
+
+    def test_prune_tombstones(self):
+        product = self.make_products(1)[0]
+        product.delete()
+        Tombstone.objects.update(deleted_at=sync.db_now() - timedelta(days=100))
+        out = io.StringIO()
+        call_command('prune_tombstones', stdout=out)
+        self.assertIn('1 tombstones pruned', out.getvalue())
+        self.assertFalse(Tombstone.objects.exists())
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_STICKY_SECONDS=5)
+class ReadReplicaRoutingTests(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.router = db_router.ReplicaRouter()
+        self.factory = RequestFactory()
+        self.seen = []
+
+    def _request(self, method, user=None, view=None, cookies=None, shared_pin=False):
+        def get_response(request):
+            self.seen.append(self.router.db_for_read(Product))
+            return view() if view else HttpResponse()
+
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'} if user else {}
+        request = getattr(self.factory, method)('/api/products/products/', **headers)
+        request.COOKIES.update(cookies or {})
+        request.user = AnonymousUser()
+        middleware = db_router.ReplicaMiddleware(get_response)
+        # Each request is handled by a fresh middleware, as on another worker
+        middleware.shared_pin = shared_pin
+        return middleware(request)
+
+    def test_a_write_pins_the_client_to_the_primary_through_a_signed_cookie(self):
+        self._request('get', self.user)
+        pin = self._request('post', self.user).cookies[db_router.PIN_COOKIE]
+        self.assertTrue(pin['httponly'])
+        self.assertEqual(pin['max-age'], 5)
+        self._request('get', self.user, cookies={db_router.PIN_COOKIE: pin.value})
+        self._request('get', self.user, cookies={db_router.PIN_COOKIE: pin.value + 'x'})
+        # LocMem is per process: no pin is kept there
+        self._request('get', self.user)
+        self.assertEqual(self.seen, ['replica1', 'default', 'default', 'replica1', 'replica1'])
+        # Outside a request, and for writes, always the primary
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + 6):
+            self._request('get', self.user, cookies={db_router.PIN_COOKIE: pin.value})
+        self.assertEqual(self.seen[-1], 'replica1')
+
+    def test_a_shared_cache_pins_the_user_without_cookies(self):
+        other = get_user_model().objects.create_user(username='other', password='x', role='storekeeper')
+        self._request('post', self.user, shared_pin=True)
+        self._request('get', self.user, shared_pin=True)
+        self._request('get', other, shared_pin=True)
+        self._request('get', shared_pin=True)
+        self.assertEqual(self.seen, ['default', 'default', 'replica1', 'replica1'])
+
+    def test_cache_fills_read_from_the_primary(self):
+        # The test run has no replica1 connection: these would fail if they used it
+        def fill():
+            cache.clear()
+            found, _ = product_cache.get_many([self.product.id])
+            matrix = conversion.get_matrix(self.product.id)
+            names = [c['name'] for c in reference_cache.categories.get()]
+            return JsonResponse({'found': len(found), 'units': len(matrix), 'categories': names})
+
+        self.product, = self.make_products(1)
+        response = self._request('get', view=fill)
+        self.assertEqual(self.seen, ['replica1'])
+        self.assertEqual(json.loads(response.content), {'found': 1, 'units': 3, 'categories': ['Cement']})
+
+    def test_streamed_bodies_read_from_the_replica_and_sync_from_the_primary(self):
+        def stream():
+            yield self.router.db_for_read(Product)
+
+        response = self._request('get', view=lambda: StreamingHttpResponse(stream()))
+        self.assertEqual(b''.join(response.streaming_content), b'replica1')
+
+        # The test run has no replica1 connection: sync would fail if it used it
+        with override_settings(SYNC_SETTLE_SECONDS=0):
+            response = self._request('get', view=lambda: JsonResponse(sync.changes('units')))
+        self.assertEqual(len(json.loads(response.content)['results']), 3)
@@ -0,0 +1,72 @@
+"""
+In-memory diffing of a product's units, shared by ProductSerializer and the bulk import.
+"""
+from . import conversion, product_cache
+from .models import ProductUnit
+
+
+class UnitSyncPlan:
+    """
+    Pending unit changes for one or more products
+    """
+
+    def __init__(self):
+        self.stale = []
+        self.changed = []
+        self.new = []
+        self.product_ids = set()
+
+    def add(self, product, existing_units, base_unit_id=None, secondary_units=None):
+        """
+        Diff ``existing_units`` of ``product`` against the wanted state.
+
+        ``secondary_units`` is a list of (unit_id, conversion_factor); None leaves
+        secondaries untouched. A replaced base unit is kept as a secondary unless
+        ``secondary_units`` drops it. Callers validate that the base unit (new
+        or kept) is not listed as a secondary; ValueError otherwise.
+        """
+        existing = {pu.unit_id: pu for pu in existing_units}
+        self.product_ids.add(product.pk)
+        wanted = {uid: (pu.is_base, pu.conversion_factor) for uid, pu in existing.items()}
+
+        if base_unit_id:
+            wanted = {uid: (False, factor) for uid, (_, factor) in wanted.items()}
+            wanted[base_unit_id] = (True, 1.0)
+
+        if secondary_units is not None:
+            wanted = {uid: state for uid, state in wanted.items() if state[0]}
+            for unit_id, factor in secondary_units:
+                if wanted.get(unit_id, (False,))[0]:
+                    raise ValueError(f"Unit {unit_id} is the base unit of product {product.pk}.")
+                wanted[unit_id] = (False, float(factor))
+
+        for uid, pu in existing.items():
+            if uid not in wanted:
+                self.stale.append(pu.pk)
+            elif (pu.is_base, pu.conversion_factor) != wanted[uid]:
+                pu.is_base, pu.conversion_factor = wanted[uid]
+                self.changed.append(pu)
+        self.new += [
+            ProductUnit(product=product, unit_id=uid, is_base=is_base, conversion_factor=factor)
+            for uid, (is_base, factor) in wanted.items() if uid not in existing
+        ]
+
+    def apply(self):
+        """
+        A fixed number of queries whatever the number of units: one filtered
+        delete, the bulk updates and one bulk_create. Demotions are written
+        before promotions because the one-base-per-product constraint is
+        checked row by row.
+        """
+        if self.stale:
+            ProductUnit.objects.filter(pk__in=self.stale).delete()
+        demoted = [pu for pu in self.changed if not pu.is_base]
+        promoted = [pu for pu in self.changed if pu.is_base]
+        for batch in (demoted, promoted):
+            if batch:
+                ProductUnit.objects.bulk_update(batch, ['is_base', 'conversion_factor'], batch_size=1000)
+        if self.new:
+            ProductUnit.objects.bulk_create(self.new, batch_size=1000)
+        if self.stale or self.changed or self.new:
+            conversion.invalidate(self.product_ids)
+            product_cache.invalidate(self.product_ids)
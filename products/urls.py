@@ -1,14 +1,34 @@
 from django.urls import path
 from .views import (
     ProductCategoryListCreateAPIView,
+    CategorySummaryAPIView,
+    CategorySummaryRebuildAPIView,
     ProductListCreateAPIView,
     ProductDetailAPIView,
+    ProductByUUIDAPIView,
+    ProductLookupAPIView,
+    ProductBulkUpdateAPIView,
+    ProductImportAPIView,
+    ProductExportAPIView,
     UnitListCreateAPIView,
+    StockMovementListCreateAPIView,
+    UnitConversionAPIView,
+    SyncAPIView,
 )
 
 urlpatterns = [
     path('categories/', ProductCategoryListCreateAPIView.as_view(), name='categories-list-create'),
+    path('categories/summary/', CategorySummaryAPIView.as_view(), name='categories-summary'),
+    path('categories/summary/rebuild/', CategorySummaryRebuildAPIView.as_view(), name='categories-summary-rebuild'),
     path('products/', ProductListCreateAPIView.as_view(), name='products-list-create'),
+    path('products/export/', ProductExportAPIView.as_view(), name='products-export'),
+    path('products/import/', ProductImportAPIView.as_view(), name='products-import'),
+    path('products/bulk/', ProductBulkUpdateAPIView.as_view(), name='products-bulk-update'),
+    path('products/lookup/', ProductLookupAPIView.as_view(), name='products-lookup'),
     path('products/<int:product_id>/', ProductDetailAPIView.as_view(), name='product-detail'),
+    path('products/<uuid:product_uuid>/', ProductByUUIDAPIView.as_view(), name='product-detail-uuid'),
     path('units/', UnitListCreateAPIView.as_view(), name='units-list-create'),
+    path('conversions/', UnitConversionAPIView.as_view(), name='unit-conversions'),
+    path('sync/<str:resource>/', SyncAPIView.as_view(), name='sync-changes'),
+    path('stock-movements/', StockMovementListCreateAPIView.as_view(), name='stock-movements-list-create'),
 ]
\ No newline at end of file
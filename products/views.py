@@ -1,25 +1,107 @@
+import codecs
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.parsers import MultiPartParser
+from django.core.handlers.asgi import ASGIRequest
 from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiParameter
-from .pagination import GlobalPagination
-from .models import Product, ProductCategory, Unit
-from .serializers import ProductSerializer, ProductCategorySerializer, UnitSerializer
+from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiExample, OpenApiParameter
+from .pagination import GlobalPagination, get_paginator
+from .models import CategorySummary, Product, ProductCategory, StockMovement, Unit
+from .serializers import (
+    ProductSerializer, ProductCategorySerializer, CategorySummarySerializer, UnitSerializer,
+    StockMovementSerializer, StockMovementBatchSerializer, ConversionBatchSerializer, ProductLookupSerializer,
+    ProductBulkUpdateSerializer,
+)
+from .stock import StockError, apply_movements
+from .bulk import BulkUpdateError
+from .importer import FORMATS, detect_format, import_products
+from . import bulk, conversion, exporter, product_cache, reference_cache, summary, sync
+from .reference_cache import conditional_response
+from .sparse_fields import get_sparse_fields, trim
+from jobs import files
+from jobs.queue import enqueue
+from jobs.serializers import JobSerializer
+from jobs.views import accepted
+from idempotency.decorators import idempotent
+
+
+PAGINATION_PARAMETERS = [
+    OpenApiParameter('search', str, description="Filter on name/description (products) or name/symbol (units)"),
+    OpenApiParameter('pagination', str, enum=['page', 'cursor'], description="Use 'cursor' for keyset pagination on (name, id)"),
+    OpenApiParameter('cursor', str, description="Opaque cursor from a previous next/previous link"),
+    OpenApiParameter('count', bool, description="Include the total count in cursor mode"),
+]
+
+ASYNC_PARAMETER = OpenApiParameter(
+    'async', bool, description="Queue a background job and answer 202 with it (poll /api/jobs/<uuid>/)"
+)
+
+SPARSE_PARAMETERS = [
+    OpenApiParameter('fields', str, description="Comma-separated output fields to keep, e.g. uuid,name"),
+    OpenApiParameter('exclude', str, description="Comma-separated output fields to drop"),
+]
+
+
+def run_async(request):
+    return request.query_params.get('async', '').lower() in ('1', 'true')
+
+
+def _is_utf8(upload):
+    # Checked up front: failing mid-import would leave earlier chunks committed
+    try:
+        for _ in codecs.iterdecode(upload, 'utf-8-sig'):
+            pass
+        return True
+    except UnicodeDecodeError:
+        return False
+    finally:
+        upload.seek(0)
+
+
+def product_list_queryset(search_query, fields):
+    """
+    Products for the list endpoints (also products.async_views)
+    """
+    if fields is None:
+        products = Product.objects.with_units()
+    else:
+        # Only the selected columns; no unit prefetch unless a unit field is selected
+        products = ProductSerializer.narrow_queryset(Product.objects.all(), fields)
+    products = products.order_by('name')
+    if search_query:
+        # Ranked in page mode; cursor mode keeps its (name, id) keyset order
+        products = products.search(search_query).order_by('-search_rank', 'name', 'id')
+    return products
+
+
+def unit_list_queryset(search_query, fields):
+    queryset = Unit.objects.all().order_by('name')
+    if fields is not None:
+        queryset = UnitSerializer.narrow_queryset(queryset, fields)
+    if search_query:
+        queryset = queryset.filter(Q(name__icontains=search_query) | Q(symbol__icontains=search_query))
+    return queryset
 
 
 # --- ProductCategory ---
 class ProductCategoryListCreateAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
-    @extend_schema(responses=ProductCategorySerializer, description="Retrieve all product categories")
+    @extend_schema(responses=ProductCategorySerializer, description="Retrieve all product categories", parameters=SPARSE_PARAMETERS)
     def get(self, request):
-        categories = ProductCategory.objects.all()
-        serializer = ProductCategorySerializer(categories, many=True)
-        return Response(serializer.data)
+        fields = get_sparse_fields(request, ProductCategorySerializer)
+        # Served from the versioned reference cache; 304 when the client's copy is current
+        return conditional_response(
+            request, reference_cache.categories,
+            lambda categories: Response(trim(categories, fields)),
+            variant=request.GET.urlencode()
+        )
 
     @extend_schema(
         request=ProductCategorySerializer,
@@ -27,6 +109,7 @@ class ProductCategoryListCreateAPIView(APIView):
         description="Create a new product category",
         examples=[OpenApiExample("Example Category", summary="Category creation", value={"name": "Cement"})]
     )
+    @idempotent
     def post(self, request):
         serializer = ProductCategorySerializer(data=request.data)
         if serializer.is_valid():
@@ -35,58 +118,269 @@ class ProductCategoryListCreateAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class CategorySummaryAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        responses=CategorySummarySerializer(many=True),
+        description="Product counts and total base-unit stock per category (maintained incrementally, one row per category)"
+    )
+    def get(self, request):
+        summaries = summary.with_pending(CategorySummary.objects.select_related('category').order_by('category__name'))
+        return Response(CategorySummarySerializer(summaries, many=True).data)
+
+
+class CategorySummaryRebuildAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=None,
+        responses={202: JobSerializer},
+        description="Queue a recomputation of the category summary from the products (fixes any drift)"
+    )
+    def post(self, request):
+        return accepted(request, enqueue('products.rebuild_summary', user=request.user))
+
+
 # --- Product ---
 class ProductListCreateAPIView(APIView):
     permission_classes = [IsAuthenticated]
     pagination_class = GlobalPagination
 
-    @extend_schema(responses=ProductSerializer, description="List all products with optional search and pagination")
+    @extend_schema(
+        responses=ProductSerializer,
+        description="List all products with optional search and pagination",
+        parameters=PAGINATION_PARAMETERS + SPARSE_PARAMETERS,
+    )
     def get(self, request):
-        search_query = request.GET.get('search', '')
-        products = Product.objects.all().order_by('name')
-
-        if search_query:
-            products = products.filter(
-                Q(name__icontains=search_query) |
-                Q(description__icontains=search_query)
-            )
-
-        paginator = self.pagination_class()
+        fields = get_sparse_fields(request, ProductSerializer)
+        products = product_list_queryset(request.GET.get('search', ''), fields)
+        paginator = get_paginator(request, self.pagination_class)
         paginated_products = paginator.paginate_queryset(products, request)
-        serializer = ProductSerializer(paginated_products, many=True)
+        serializer = ProductSerializer(paginated_products, many=True, fields=fields)
         return paginator.get_paginated_response(serializer.data)
 
     @extend_schema(request=ProductSerializer, responses={201: ProductSerializer, 400: None}, description="Create a new product")
+    @idempotent
     def post(self, request):
         serializer = ProductSerializer(data=request.data)
         if serializer.is_valid():
-            product = serializer.save()
+            product = Product.objects.with_units().get(pk=serializer.save().pk)
             return Response(ProductSerializer(product).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _product_lookup(product_id=None, product_uuid=None):
+    return {'id': product_id} if product_id is not None else {'uuid': product_uuid}
+
+
 class ProductDetailAPIView(APIView):
+    """
+    Routed by integer id (products/<id>/) or by uuid (products/<uuid>/)
+    """
     permission_classes = [IsAuthenticated]
 
+    @extend_schema(
+        operation_id='api_products_products_detail_retrieve',
+        responses={200: ProductSerializer, 404: None},
+        description="Retrieve a product (cached)",
+        parameters=SPARSE_PARAMETERS,
+    )
+    def get(self, request, product_id=None, product_uuid=None):
+        fields = get_sparse_fields(request, ProductSerializer)
+        found, by_uuid = product_cache.get_many(
+            ids=[product_id] if product_id is not None else [],
+            uuids=[product_uuid] if product_uuid is not None else [],
+        )
+        pk = product_id if product_id is not None else by_uuid.get(str(product_uuid))
+        if pk not in found:
+            return Response({'detail': "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(trim([found[pk]], fields)[0])
+
     @extend_schema(request=ProductSerializer, responses={200: ProductSerializer, 400: None}, description="Update a product fully")
-    def put(self, request, product_id):
-        product = get_object_or_404(Product, id=product_id)
+    def put(self, request, product_id=None, product_uuid=None):
+        product = get_object_or_404(Product, **_product_lookup(product_id, product_uuid))
         serializer = ProductSerializer(product, data=request.data)
         if serializer.is_valid():
-            product = serializer.save()
+            product = Product.objects.with_units().get(pk=serializer.save().pk)
             return Response(ProductSerializer(product).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @extend_schema(request=ProductSerializer, responses={200: ProductSerializer, 400: None}, description="Update a product partially")
-    def patch(self, request, product_id):
-        product = get_object_or_404(Product, id=product_id)
+    def patch(self, request, product_id=None, product_uuid=None):
+        product = get_object_or_404(Product, **_product_lookup(product_id, product_uuid))
         serializer = ProductSerializer(product, data=request.data, partial=True)
         if serializer.is_valid():
-            product = serializer.save()
+            product = Product.objects.with_units().get(pk=serializer.save().pk)
             return Response(ProductSerializer(product).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+# Own operation ids, which drf-spectacular would otherwise suffix with numerals
+@extend_schema_view(
+    get=extend_schema(operation_id='api_products_products_by_uuid_retrieve'),
+    put=extend_schema(operation_id='api_products_products_by_uuid_update'),
+    patch=extend_schema(operation_id='api_products_products_by_uuid_partial_update'),
+)
+class ProductByUUIDAPIView(ProductDetailAPIView):
+    pass
+
+
+class ProductLookupAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=ProductLookupSerializer,
+        responses={200: dict, 400: dict},
+        description=(
+            "Resolve up to 500 product ids and/or uuids in one call. `results` maps each requested "
+            "id or uuid to the product; unknown ones are listed in `missing`."
+        ),
+        parameters=SPARSE_PARAMETERS,
+        examples=[OpenApiExample(
+            "Scanned labels",
+            request_only=True,
+            value={"ids": [12, 40], "uuids": ["0f8fad5b-d9cb-469f-a165-70867728950e"]}
+        )]
+    )
+    def post(self, request):
+        fields = get_sparse_fields(request, ProductSerializer)
+        serializer = ProductLookupSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = serializer.validated_data['ids']
+        uuids = [str(u) for u in serializer.validated_data['uuids']]
+        found, by_uuid = product_cache.get_many(ids, uuids)
+        results, missing = {}, []
+        for key, pk in [(str(pk), pk) for pk in ids] + [(u, by_uuid.get(u)) for u in uuids]:
+            if pk in found:
+                results[key] = trim([found[pk]], fields)[0]
+            else:
+                missing.append(key)
+        return Response({'results': results, 'missing': missing})
+
+
+class ProductBulkUpdateAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=ProductBulkUpdateSerializer,
+        responses={200: dict, 202: JobSerializer, 400: dict},
+        description=(
+            "Update many products in one transaction. Send `items` ({id, fields}, up to 5000) or a "
+            "`filter` (ids, category, is_active, search) with one `fields` set (is_active, category, "
+            "description). Editable fields: name, description, is_active, category. Nothing is "
+            "written if any item is invalid; `errors` lists every problem."
+        ),
+        parameters=[ASYNC_PARAMETER],
+        examples=[
+            OpenApiExample(
+                "Per product",
+                request_only=True,
+                value={"items": [
+                    {"id": 12, "fields": {"category": 3}},
+                    {"id": 40, "fields": {"is_active": False, "name": "Ciment CPJ 45 (old)"}}
+                ]}
+            ),
+            OpenApiExample(
+                "Deactivate a category",
+                request_only=True,
+                value={"filter": {"category": 3, "is_active": True}, "fields": {"is_active": False}}
+            ),
+        ]
+    )
+    def patch(self, request):
+        serializer = ProductBulkUpdateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if run_async(request):
+            return accepted(request, enqueue('products.bulk_update', serializer.validated_data, user=request.user))
+        try:
+            return Response(bulk.apply(serializer.validated_data))
+        except BulkUpdateError as exc:
+            return Response({'errors': exc.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ProductImportAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    @extend_schema(
+        request={'multipart/form-data': {'type': 'object', 'properties': {'file': {'type': 'string', 'format': 'binary'}}}},
+        responses={200: dict, 202: JobSerializer, 400: dict},
+        description=(
+            "Bulk import products from a CSV or JSONL upload. Rows are processed in chunks; "
+            "invalid rows are reported in `errors` without aborting the import. "
+            "Columns: name, description, category, is_active, base_unit, secondary_units ('sac:50|t:1000'). "
+            "With async=true the file is stored and imported by a worker; the job result has the same shape."
+        ),
+        parameters=[
+            OpenApiParameter('file_format', str, enum=list(FORMATS), description="Defaults to the file extension"),
+            OpenApiParameter('upsert', bool, description="Update products that already exist by name"),
+            ASYNC_PARAMETER,
+        ],
+    )
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ["No file was submitted."]}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.query_params.get('file_format') or detect_format(upload.name)
+        if file_format not in FORMATS:
+            return Response({'file_format': [f"Expected one of {', '.join(FORMATS)}."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not _is_utf8(upload):
+            return Response({'file': ["File is not valid UTF-8."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        upsert = request.query_params.get('upsert', '').lower() in ('1', 'true')
+        if run_async(request):
+            name = files.storage().save(f'imports/{upload.name}', upload)
+            payload = {'file': name, 'file_format': file_format, 'upsert': upsert}
+            return accepted(request, enqueue('products.import', payload, user=request.user))
+
+        # Uploads larger than FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to disk and read line by line
+        lines = codecs.iterdecode(upload, 'utf-8-sig')
+        result = import_products(lines, file_format, upsert=upsert)
+        return Response(result.as_dict())
+
+
+class ProductExportAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        responses={(200, 'text/csv'): str, (200, 'application/x-ndjson'): str},
+        description=(
+            "Stream the whole catalog with category, base unit and secondary units, "
+            "in the layout accepted by the import endpoint."
+        ),
+        parameters=[OpenApiParameter('file_format', str, enum=list(exporter.FORMATS), description="Defaults to csv")],
+    )
+    def get(self, request):
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in exporter.FORMATS:
+            return Response({'file_format': [f"Expected one of {', '.join(exporter.FORMATS)}."]}, status=status.HTTP_400_BAD_REQUEST)
+        # Under ASGI a sync iterator would be read whole before the first byte is sent
+        stream = exporter.astream if isinstance(request._request, ASGIRequest) else exporter.stream
+        response = StreamingHttpResponse(
+            stream(file_format, exporter.iter_products()),
+            content_type=exporter.CONTENT_TYPES[file_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+        return response
+
+    @extend_schema(
+        request=None,
+        responses={202: JobSerializer, 400: dict},
+        description="Queue the export as a background job; download the file from the job's file_url when it succeeds.",
+        parameters=[OpenApiParameter('file_format', str, enum=list(exporter.FORMATS), description="Defaults to csv")],
+    )
+    def post(self, request):
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in exporter.FORMATS:
+            return Response({'file_format': [f"Expected one of {', '.join(exporter.FORMATS)}."]}, status=status.HTTP_400_BAD_REQUEST)
+        return accepted(request, enqueue('products.export', {'file_format': file_format}, user=request.user))
+
+
 # --- Unit ---
 class UnitListCreateAPIView(APIView):
     permission_classes = [IsAuthenticated]
@@ -94,17 +388,22 @@ class UnitListCreateAPIView(APIView):
 
     @extend_schema(
         responses=UnitSerializer,
-        description="List all units with optional search and pagination."
+        description="List all units with optional search and pagination.",
+        parameters=PAGINATION_PARAMETERS + SPARSE_PARAMETERS,
     )
     def get(self, request):
         search_query = request.query_params.get('search', '')
-        queryset = Unit.objects.all().order_by('name')
-        if search_query:
-            queryset = queryset.filter(Q(name__icontains=search_query) | Q(symbol__icontains=search_query))
+        fields = get_sparse_fields(request, UnitSerializer)
+        paginator = get_paginator(request, self.pagination_class)
 
-        paginator = self.pagination_class()
+        if not search_query and isinstance(paginator, GlobalPagination):
+            def build_response(units):
+                return paginator.get_paginated_response(trim(paginator.paginate_queryset(units, request), fields))
+            return conditional_response(request, reference_cache.units, build_response, variant=request.GET.urlencode())
+
+        queryset = unit_list_queryset(search_query, fields)
         paginated_units = paginator.paginate_queryset(queryset, request)
-        serializer = UnitSerializer(paginated_units, many=True)
+        serializer = UnitSerializer(paginated_units, many=True, fields=fields)
         return paginator.get_paginated_response(serializer.data)
 
     @extend_schema(
@@ -113,9 +412,139 @@ class UnitListCreateAPIView(APIView):
         description="Create a new unit",
         examples=[OpenApiExample("Example Unit", summary="Create unit", value={"name": "Carton", "symbol": "ctn"})]
     )
+    @idempotent
     def post(self, request):
         serializer = UnitSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+# --- Stock movements ---
+class StockMovementListCreateAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+    pagination_class = GlobalPagination
+
+    @extend_schema(
+        responses=StockMovementSerializer,
+        description="List the stock ledger, newest first, optionally for one product.",
+        parameters=[OpenApiParameter('product', int, description="Product id")],
+    )
+    def get(self, request):
+        queryset = StockMovement.objects.select_related('product_unit').order_by('-created_at', '-id')
+        product_id = request.query_params.get('product')
+        if product_id:
+            queryset = queryset.filter(product_id=product_id)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, request)
+        serializer = StockMovementSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @extend_schema(
+        request=StockMovementBatchSerializer,
+        responses={201: dict, 400: dict},
+        description=(
+            "Apply a batch of stock movements atomically. Quantities are given in any unit "
+            "configured for the product and converted to base units. The whole batch is "
+            "rejected if any product would go below zero."
+        ),
+        examples=[OpenApiExample(
+            "Receive and ship",
+            request_only=True,
+            value={"movements": [
+                {"product_id": 1, "unit_id": 2, "movement_type": "in", "quantity": "10"},
+                {"product_id": 1, "unit_id": 1, "movement_type": "out", "quantity": "25", "note": "Order 42"}
+            ]}
+        )]
+    )
+    @idempotent
+    def post(self, request):
+        serializer = StockMovementBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            movements, balances = apply_movements(serializer.validated_data['movements'], user=request.user)
+        except StockError as exc:
+            return Response({'errors': exc.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {'created': len(movements), 'balances': balances},
+            status=status.HTTP_201_CREATED
+        )
+
+
+# --- Delta sync ---
+class SyncAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        responses={200: dict, 400: dict, 410: dict},
+        description=(
+            "Products or units changed and deleted since `cursor`. Without a cursor every row is "
+            "returned. Keep the returned `cursor` and call again while `has_more`; on the next "
+            "refresh, pass the last cursor to receive only what changed. `deleted` lists uuids. "
+            "410 means the cursor is older than the deletion log: drop local data and start over."
+        ),
+        parameters=[
+            OpenApiParameter('resource', str, OpenApiParameter.PATH, enum=list(sync.RESOURCES)),
+            OpenApiParameter('cursor', str, description="Opaque cursor from the previous response"),
+            OpenApiParameter('page_size', int, description=f"Defaults to {sync.DEFAULT_PAGE_SIZE}, at most {sync.MAX_PAGE_SIZE}"),
+        ],
+    )
+    def get(self, request, resource):
+        if resource not in sync.RESOURCES:
+            return Response({'detail': "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            page_size = int(request.query_params.get('page_size', sync.DEFAULT_PAGE_SIZE))
+        except ValueError:
+            page_size = 0
+        if not 1 <= page_size <= sync.MAX_PAGE_SIZE:
+            return Response({'page_size': [f"Expected 1 to {sync.MAX_PAGE_SIZE}."]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return Response(sync.changes(resource, request.query_params.get('cursor'), page_size))
+        except sync.CursorError as exc:
+            return Response({'cursor': [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+        except sync.CursorExpired:
+            return Response({'detail': "Cursor expired; sync again without a cursor."}, status=status.HTTP_410_GONE)
+
+
+# --- Unit conversions ---
+class UnitConversionAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=ConversionBatchSerializer,
+        responses={200: dict, 400: dict},
+        description=(
+            "Convert many quantities between two units of the same product in one call. "
+            "Results are computed with exact fractions and rounded to 9 decimal places; "
+            "`exact` is false when that rounding changed the value."
+        ),
+        examples=[OpenApiExample(
+            "Sacks to tonnes",
+            request_only=True,
+            value={"conversions": [{"product_id": 1, "from_unit_id": 2, "to_unit_id": 3, "quantity": "40"}]}
+        )]
+    )
+    def post(self, request):
+        serializer = ConversionBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        items = serializer.validated_data['conversions']
+        matrices = conversion.get_matrices(item['product_id'] for item in items)
+        results = []
+        for item in items:
+            result = {**item, 'quantity': format(item['quantity'].normalize(), 'f')}
+            try:
+                value = conversion.convert(
+                    matrices[item['product_id']], item['quantity'], item['from_unit_id'], item['to_unit_id']
+                )
+            except conversion.ConversionError as exc:
+                result['error'] = str(exc)
+            else:
+                converted, result['exact'] = conversion.to_decimal(value)
+                result['result'] = str(converted)
+            results.append(result)
+        return Response({'results': results})
@@ -0,0 +1,83 @@
+"""
+JWT authentication that resolves the user from a short-lived cache.
+
+Access tokens carry the user's ``role`` and ``token_version`` ("ver") as
+claims; a token whose role no longer matches the user's is rejected too. The
+authenticated user's fields, minus the password hash, are cached under
+(user id, token version), so hot endpoints do no auth query. Changing a user's role or deactivating them
+bumps ``token_version`` (see users.signals, and UserQuerySet.update for bulk
+changes): their cached entry is deleted and every token issued before the
+change is rejected.
+
+That deletion only reaches other workers through a shared cache (REDIS_URL).
+With a per-process cache, entries live AUTH_USER_LOCAL_CACHE_TIMEOUT seconds
+instead, after which token_version and is_active are checked against the
+database again.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from BuildStock import db_router
+
+KEY_PREFIX = 'buildstock:auth-user'
+VERSION_CLAIM = 'ver'
+ROLE_CLAIM = 'role'
+
+
+def cache_key(user_id, version):
+    return f'{KEY_PREFIX}:{user_id}:{version}'
+
+
+def cache_timeout():
+    timeout = getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60)
+    if isinstance(caches['default'], (LocMemCache, DummyCache)):
+        # Revocations made by other processes never reach this cache
+        return min(timeout, getattr(settings, 'AUTH_USER_LOCAL_CACHE_TIMEOUT', 5))
+    return timeout
+
+
+def _cached_fields(user):
+    """
+    The user's column values, without the password hash
+    """
+    return {
+        field.attname: getattr(user, field.attname)
+        for field in user._meta.concrete_fields if field.name != 'password'
+    }
+
+
+def _from_cache(fields):
+    # The password is left deferred: reading it loads it, and save() only writes loaded fields
+    return get_user_model().from_db(DEFAULT_DB_ALIAS, list(fields), list(fields.values()))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        version = validated_token.get(VERSION_CLAIM, 0)
+
+        key = cache_key(user_id, version)
+        fields = cache.get(key)
+        if fields is not None:
+            user = _from_cache(fields)
+        else:
+            # From the primary: a replica may not have the latest token_version yet
+            with db_router.primary():
+                user = super().get_user(validated_token)
+            if user.token_version != version:
+                raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+            cache.set(key, _cached_fields(user), cache_timeout())
+        if validated_token.get(ROLE_CLAIM, user.role) != user.role:
+            raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+        return user
@@ -1,7 +1,32 @@
-from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.db import models, transaction
+from django.db.models import F
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
+
+# Changing any of these revokes the user's tokens and cached auth entry
+REVOKING_FIELDS = ('role', 'is_active')
+
+
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """
+        Bulk changes to role / is_active revoke tokens as save() does (users.signals):
+        every matched user's token_version is bumped and their cached auth entry dropped
+        """
+        if 'token_version' in kwargs or not set(kwargs) & set(REVOKING_FIELDS):
+            return super().update(**kwargs)
+        from django.core.cache import cache
+        from .authentication import cache_key
+
+        with transaction.atomic(using=self.db):
+            revoked = list(self.select_for_update().values_list('pk', 'token_version'))
+            count = super().update(token_version=F('token_version') + 1, **kwargs)
+        cache.delete_many([cache_key(pk, version) for pk, version in revoked])
+        return count
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    pass
 
-# Create your models here.
 
 class User(AbstractUser):
     ROLE_CHOICES = (
@@ -11,6 +36,16 @@ class User(AbstractUser):
     )
     role=models.CharField(max_length=15, choices=ROLE_CHOICES)
     phone=models.CharField(max_length=12, blank=True, null=True)
+    token_version=models.PositiveIntegerField(default=0, editable=False, help_text="Bumped to revoke issued JWTs, e.g. on role change or deactivation")
+
+    objects = UserManager()
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Listing filters on role / is_active and orders by username
+            models.Index(fields=['role', 'is_active', 'username'], name='user_role_active_username'),
+            models.Index(fields=['is_active', 'username'], name='user_active_username'),
+        ]
 
     def __str__(self):
         return f"{self.username} {self.role}"
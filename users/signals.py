@@ -0,0 +1,32 @@
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .authentication import cache_key
+from .models import REVOKING_FIELDS, User
+
+
+@receiver(pre_save, sender=User)
+def remember_revoking_fields(sender, instance, update_fields=None, **kwargs):
+    instance._revoking_snapshot = None
+    if instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(REVOKING_FIELDS):
+        return
+    instance._revoking_snapshot = User.objects.filter(pk=instance.pk).values(*REVOKING_FIELDS, 'token_version').first()
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens_on_change(sender, instance, **kwargs):
+    old = getattr(instance, '_revoking_snapshot', None)
+    if not old or all(old[field] == getattr(instance, field) for field in REVOKING_FIELDS):
+        return
+    User.objects.filter(pk=instance.pk).update(token_version=F('token_version') + 1)
+    instance.token_version = old['token_version'] + 1
+    cache.delete(cache_key(instance.pk, old['token_version']))
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance, **kwargs):
+    cache.delete(cache_key(instance.pk, instance.token_version))
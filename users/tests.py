@@ -1,3 +1,150 @@
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import CachedJWTAuthentication, cache_key
+from .models import User
+
+
+class UserListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='admin', email='admin@example.com', password='x', role='admin')
+        for i in range(12):
+            User.objects.create_user(
+                username=f'store{i:02d}', email=f'store{i:02d}@depot.example', password='x',
+                role='storekeeper', is_active=i % 3 != 0
+            )
+        User.objects.create_user(username='compta', email='compta@example.com', password='x', role='account')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_list_is_paginated_and_ordered_by_username(self):
+        response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 14)
+        self.assertEqual([u['username'] for u in response.data['results'][:3]], ['admin', 'compta', 'store00'])
+        self.assertNotIn('password', response.data['results'][0])
+
+    def test_filters_and_search(self):
+        response = self.client.get('/api/users/', {'role': 'storekeeper', 'is_active': 'false'})
+        self.assertEqual([u['username'] for u in response.data['results']], ['store00', 'store03', 'store06', 'store09'])
+
+        response = self.client.get('/api/users/', {'search': 'depot', 'ordering': '-username', 'page_size': 2})
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual([u['username'] for u in response.data['results']], ['store11', 'store10'])
+
+        self.assertEqual(self.client.get('/api/users/', {'ordering': 'password'}).status_code, 400)
+
+    def test_only_serialized_columns_are_selected(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/users/')
+        sql = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('"password"', sql)
+        self.assertNotIn('"last_login"', sql)
+
+    def test_sparse_fields_select_only_requested_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/users/', {'fields': 'id,username'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'username'})
+        self.assertNotIn('"email"', ctx.captured_queries[-1]['sql'])
+        self.assertEqual(self.client.get('/api/users/', {'fields': 'password'}).status_code, 400)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    PASSWORD = 'P@ssword123!'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='magasin', password=self.PASSWORD, role='storekeeper')
+        self.client = APIClient()
+
+    def _login(self):
+        response = self.client.post('/api/login/', {'username': 'magasin', 'password': self.PASSWORD}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return AccessToken(response.data['access'])
+
+    def test_token_carries_role_and_version_claims(self):
+        token = self._login()
+        self.assertEqual((token['role'], token['ver']), ('storekeeper', 0))
+
+    def test_authenticated_reads_skip_the_user_query_once_cached(self):
+        self._login()
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 200)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/api/products/stock-movements/').status_code, 200)
+        self.assertFalse(any('"users_user"' in q['sql'] for q in ctx.captured_queries))
+
+    def test_cache_holds_no_password_hash_and_cached_users_save_safely(self):
+        token = self._login()
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 200)
+        cached = cache.get(cache_key(self.user.pk, token['ver']))
+        self.assertNotIn('password', cached)
+        self.assertNotIn(self.user.password, cached.values())
+
+        user = CachedJWTAuthentication().get_user(token)
+        self.assertEqual((user.pk, user.role), (self.user.pk, 'storekeeper'))
+        user.phone = '0102030405'
+        user.save()
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password(self.PASSWORD))
+
+    def test_token_with_another_role_is_rejected(self):
+        token = AccessToken.for_user(self.user)
+        token['ver'], token['role'] = self.user.token_version, 'account'
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 401)
+
+    def test_role_change_and_deactivation_revoke_immediately(self):
+        self._login()
+        self.client.get('/api/products/categories/')
+
+        self.user.role = 'account'
+        self.user.save()
+        response = self.client.get('/api/products/categories/')
+        self.assertEqual(response.status_code, 401)
+
+        self._login()
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 200)
+        self.user.refresh_from_db()
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 401)
+
+    def test_bulk_updates_revoke_too(self):
+        self._login()
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 200)
+        self.assertEqual(User.objects.filter(pk=self.user.pk).update(role='account'), 1)
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 401)
+
+        self._login()
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 401)
+        self.assertEqual(User.objects.get(pk=self.user.pk).token_version, 2)
+
+    def test_per_process_cache_rechecks_the_database_soon(self):
+        self._login()
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 200)
+        # Revoked by another worker: its cache deletion never reaches this process
+        User.objects.filter(pk=self.user.pk).update(token_version=F('token_version') + 1)
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 200)
+        later = time.time() + settings.AUTH_USER_LOCAL_CACHE_TIMEOUT
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertEqual(self.client.get('/api/products/categories/').status_code, 401)
 
-# Create your tests here.
+    def test_unrelated_saves_keep_tokens_valid(self):
+        self._login()
+        self.user.phone = '0102030405'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/products/categories/').status_code, 200)
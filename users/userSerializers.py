@@ -1,17 +1,21 @@
 from rest_framework import serializers
 from .models import User
 from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .authentication import ROLE_CLAIM, VERSION_CLAIM
+from products.sparse_fields import SparseFieldsetMixin
 import re
 User=get_user_model()
 
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     password=serializers.CharField(write_only=True, required=True)
 
     class Meta :
         model= User
-        fields =  ['id', 'username', 'first_name', 'last_name', 'email', 'role', 'phone', 'password']
+        fields =  ['id', 'username', 'first_name', 'last_name', 'email', 'role', 'phone', 'is_active', 'password']
+        read_only_fields = ['is_active']
     
     
     def validate_password(self, value):
@@ -40,4 +44,17 @@ class UserSerializer(serializers.ModelSerializer):
         user.set_password(password)
         user.save()
 
-        return user
\ No newline at end of file
+        return user
+
+
+class BuildStockTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Adds the role and token version claims read by CachedJWTAuthentication
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[ROLE_CLAIM] = user.role
+        token[VERSION_CLAIM] = user.token_version
+        return token
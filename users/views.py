@@ -1,17 +1,36 @@
 from rest_framework.views import APIView
-from .userSerializers import UserSerializer
+from .userSerializers import UserSerializer, BuildStockTokenObtainPairSerializer
+from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework import status
 from rest_framework.response import Response
 from .models import User
 from rest_framework.permissions import IsAuthenticated
-from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiExample
+from django.db.models import Q
+from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiExample, OpenApiParameter
+from products.pagination import GlobalPagination
+from products.sparse_fields import get_sparse_fields
+from idempotency.decorators import idempotent
+
+# Columns UserSerializer reads; the password hash and permission fields are never loaded
+LIST_COLUMNS = ['id', 'username', 'first_name', 'last_name', 'email', 'role', 'phone', 'is_active']
+ORDERING_FIELDS = ['username', '-username', 'date_joined', '-date_joined', 'id', '-id']
 
 
 @extend_schema_view(
     get=extend_schema(
         summary="List Users",
-        description="Returns the list of all users registered in the system.",
+        description="Returns a paginated list of users, optionally filtered by role and status.",
         responses=UserSerializer(many=True),
+        parameters=[
+            OpenApiParameter('role', str, enum=[choice for choice, _ in User.ROLE_CHOICES]),
+            OpenApiParameter('is_active', bool),
+            OpenApiParameter('search', str, description="Matches username or email"),
+            OpenApiParameter('ordering', str, enum=ORDERING_FIELDS, description="Defaults to username"),
+            OpenApiParameter('page', int),
+            OpenApiParameter('page_size', int),
+            OpenApiParameter('fields', str, description="Comma-separated output fields to keep, e.g. id,username"),
+            OpenApiParameter('exclude', str, description="Comma-separated output fields to drop"),
+        ],
     ),
     post=extend_schema(
         summary="Create a User",
@@ -51,11 +70,36 @@ from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiExam
 class ListCreateUserApiView(APIView):
     permission_classes = [IsAuthenticated]
 
+    pagination_class = GlobalPagination
+
     def get(self, request, *args, **kwargs):
-        users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        params = request.query_params
+        fields = get_sparse_fields(request, UserSerializer)
+        if fields is None:
+            users = User.objects.only(*LIST_COLUMNS)
+        else:
+            users = UserSerializer.narrow_queryset(User.objects.all(), fields)
+
+        if params.get('role'):
+            users = users.filter(role=params['role'])
+        if params.get('is_active', '') != '':
+            users = users.filter(is_active=params['is_active'].lower() in ('1', 'true'))
+        if params.get('search'):
+            users = users.filter(
+                Q(username__icontains=params['search']) |
+                Q(email__icontains=params['search'])
+            )
+        ordering = params.get('ordering', 'username')
+        if ordering not in ORDERING_FIELDS:
+            return Response({'ordering': [f"Expected one of {', '.join(ORDERING_FIELDS)}."]}, status=status.HTTP_400_BAD_REQUEST)
+        users = users.order_by(ordering, 'id')
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(users, request)
+        serializer = UserSerializer(page, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         serializer = UserSerializer(data=request.data)
         if serializer.is_valid():
@@ -71,3 +115,7 @@ class ListCreateUserApiView(APIView):
                 status=status.HTTP_201_CREATED
             )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class BuildStockTokenObtainPairView(TokenObtainPairView):
+    serializer_class = BuildStockTokenObtainPairSerializer